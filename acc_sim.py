@@ -1,9 +1,15 @@
-import paho.mqtt.client as mqtt
 import json
 import time
 import math
 import random
 import configparser
+import argparse
+import os
+import sys
+import threading
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main'))
 
 # Add program start time
 PROGRAM_START_TIME = time.time() * 1000  # Convert to milliseconds
@@ -19,14 +25,6 @@ def load_config():
         'password': config.get('mqtt', 'password'),
     }
 
-config = load_config()
-
-# Use configuration values
-MQTT_HOST = config['host']
-MQTT_PORT = config['port']
-MQTT_USER = config['username']
-MQTT_PASSWORD = config['password']
-
 # Track time since last reset
 last_reset_time = time.time()
 RESET_INTERVAL = random.uniform(2, 6)  # Random interval between 2 and 6 seconds
@@ -100,26 +98,317 @@ def simulate_circular_acceleration():
     
     return acceleration
 
-def main():
-    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
-    client.on_connect = on_connect
-    
+# Raw MPU-6050 readings of the pen lying still (MotionProcessor's baseline)
+REST_ACCEL = (-1950, 100, 17600)
+RAW_AMPLITUDE = 1500  # Raw counts of the simulated circular motion
+
+def simulate_raw_sample():
+    """One raw sensor sample (ax, ay, az, gx, gy, gz, timestamp) in int16 counts"""
+    current_time = time.time()
+    angle = (current_time * ANGULAR_VELOCITY) % (2 * math.pi)
+    noise = 30
+    return (
+        REST_ACCEL[0] + RAW_AMPLITUDE * math.cos(angle) + random.uniform(-noise, noise),
+        REST_ACCEL[1] + RAW_AMPLITUDE * math.sin(angle) + random.uniform(-noise, noise),
+        REST_ACCEL[2] + random.uniform(-noise, noise),
+        random.uniform(-noise, noise),
+        random.uniform(-noise, noise),
+        random.uniform(-noise, noise),
+        int(current_time * 1000 - PROGRAM_START_TIME)
+    )
+
+def run_binary(client, topic, rate, frame_samples):
+    """Publish binary frames of frame_samples samples captured at rate Hz"""
+    from frames import encode_frame
+    device_id = zlib.crc32(topic.encode())
+    seq = 0
+    pending = []
+    interval = 1.0 / rate
+    next_sample = time.monotonic()
+    report_time = next_sample + 1
+    published = 0
+
+    while True:
+        if should_reset():
+            if pending:
+                client.publish(topic, encode_frame(device_id, seq, pending), qos=1)
+                seq += 1
+                pending = []
+            client.publish(topic, encode_frame(device_id, seq, [], reset=True), qos=1)
+            seq += 1
+            print("Canvas Reset Signal Sent")
+
+        pending.append(simulate_raw_sample())
+        if len(pending) >= frame_samples:
+            client.publish(topic, encode_frame(device_id, seq, pending), qos=1)
+            seq += 1
+            published += len(pending)
+            pending = []
+
+        # Pace against a schedule instead of sleeping a fixed time per sample
+        next_sample += interval
+        now = time.monotonic()
+        if now >= report_time:
+            print(f"Published {published} samples/s in {published // frame_samples} frames")
+            published = 0
+            report_time += 1
+        if next_sample > now:
+            time.sleep(next_sample - now)
+
+# Load generator: many virtual pens whose data depends only on a seed
+
+class VirtualPen:
+    def __init__(self, index, rate, seed=0, reset_range=(5, 15)):
+        """
+        Simulated pen publishing on coordinates/sim<index>
+        Its trajectory, noise and reset schedule come from the seed and the
+        sample count, not the wall clock, so runs with the same seed publish
+        the same samples however fast they are paced
+        rate: Samples per second
+        reset_range: (min, max) seconds between reset signals, None sends none
+        """
+        self.device = f"sim{index}"
+        self.topic = f"coordinates/{self.device}"
+        self.device_id = zlib.crc32(self.topic.encode())
+        self.rate = rate
+        self.random = random.Random(f"{seed}:{index}")
+        self.phase = self.random.uniform(0, 2 * math.pi)
+        self.reset_range = reset_range
+        self.count = 0
+        self.seq = 0
+        self.resets = 0
+        self.next_reset = self._next_reset()
+
+    def _next_reset(self):
+        if not self.reset_range:
+            return None
+        return self.count + max(1, int(self.random.uniform(*self.reset_range) * self.rate))
+
+    def samples(self, count):
+        """The next count raw samples, with None where a reset signal is due"""
+        rows = []
+        uniform = self.random.uniform
+        noise = 30
+        for _ in range(count):
+            if self.count == self.next_reset:
+                rows.append(None)
+                self.resets += 1
+                self.next_reset = self._next_reset()
+            t = self.count / self.rate
+            angle = self.phase + t * ANGULAR_VELOCITY
+            rows.append((
+                round(REST_ACCEL[0] + RAW_AMPLITUDE * math.cos(angle) + uniform(-noise, noise)),
+                round(REST_ACCEL[1] + RAW_AMPLITUDE * math.sin(angle) + uniform(-noise, noise)),
+                round(REST_ACCEL[2] + uniform(-noise, noise)),
+                round(uniform(-noise, noise)),
+                round(uniform(-noise, noise)),
+                round(uniform(-noise, noise)),
+                round(t * 1000)
+            ))
+            self.count += 1
+        return rows
+
+    def json_payloads(self, count):
+        """The next count samples as firmware JSON messages, one per sample"""
+        payloads = []
+        for row in self.samples(count):
+            if row is None:
+                # Firmware reset sentinel: -1 on all accelerometer axes
+                row = (-1, -1, -1, 0, 0, 0, round(self.count / self.rate * 1000))
+            payloads.append(json.dumps({
+                "timestamp": row[6],
+                "accel": {"x": row[0], "y": row[1], "z": row[2]},
+                "gyro": {"x": row[3], "y": row[4], "z": row[5]},
+            }))
+        return payloads
+
+    def frame_payloads(self, count):
+        """The next count samples packed into one binary frame, split at resets"""
+        from frames import encode_frame
+        payloads = []
+        pending = []
+        for row in self.samples(count):
+            if row is not None:
+                pending.append(row)
+                continue
+            if pending:
+                payloads.append(encode_frame(self.device_id, self.seq, pending))
+                self.seq += 1
+                pending = []
+            payloads.append(encode_frame(self.device_id, self.seq, [], reset=True))
+            self.seq += 1
+        if pending:
+            payloads.append(encode_frame(self.device_id, self.seq, pending))
+            self.seq += 1
+        return payloads
+
+
+class PublishStats:
+    """Messages handed to the MQTT clients and PUBACKs received from the broker"""
+
+    def __init__(self):
+        self.published = 0
+        self.errors = 0
+        self.acked = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+
+    def on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        # Runs on the clients' network threads once the broker acknowledged a QoS 1 message
+        with self._lock:
+            self.acked += 1
+            if getattr(reason_code, 'is_failure', False):
+                self.failed += 1
+
+
+def run_load(pens, clients, stats, chunk, binary=False, duration=None, report_interval=5.0):
+    """
+    Publish chunk samples per pen and tick, as binary frames or a burst of JSON
+    messages, pacing the ticks so every pen keeps its rate
+    Runs for duration seconds (None: until Ctrl-C) and returns the seconds spent
+    """
+    tick = chunk / pens[0].rate
+    started = time.monotonic()
+    next_report = started + report_interval
+    ticks = 0
+    try:
+        while duration is None or ticks * tick < duration:
+            for pen, client in zip(pens, clients):
+                payloads = pen.frame_payloads(chunk) if binary else pen.json_payloads(chunk)
+                for payload in payloads:
+                    if client.publish(pen.topic, payload, qos=1).rc == 0:
+                        stats.published += 1
+                    else:
+                        stats.errors += 1
+            ticks += 1
+            now = time.monotonic()
+            if report_interval and now >= next_report:
+                print(f"{now - started:6.1f} s: published {stats.published} messages "
+                      f"({stats.published / (now - started):,.0f}/s), {stats.acked} acked")
+                next_report += report_interval
+            # Pace against the schedule; a late tick is caught up without sleeping
+            delay = started + ticks * tick - now
+            if delay > 0:
+                time.sleep(delay)
+    except KeyboardInterrupt:
+        pass
+    return time.monotonic() - started
+
+
+def wait_for_acks(stats, timeout):
+    """Wait up to timeout seconds for the broker to acknowledge everything published"""
+    deadline = time.monotonic() + timeout
+    while stats.acked < stats.published and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+
+def print_load_summary(pens, stats, elapsed):
+    samples = sum(pen.count for pen in pens)
+    resets = sum(pen.resets for pen in pens)
+    target = sum(pen.rate for pen in pens)
+    print(f"Published {stats.published} messages ({samples} samples, {resets} resets) "
+          f"from {len(pens)} devices in {elapsed:.1f} s")
+    print(f"Achieved {stats.published / elapsed:,.0f} messages/s and {samples / elapsed:,.0f} samples/s "
+          f"(target {target:,.0f} samples/s)")
+    print(f"Broker acks: {stats.acked} of {stats.published}, "
+          f"{stats.published - stats.acked} outstanding, {stats.failed} failed, "
+          f"{stats.errors} publish errors")
+
+
+def make_client(config, client_id=''):
+    """MQTT client with the configured credentials, not connected yet"""
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=client_id)
+
     # Set credentials
-    client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
-    
+    client.username_pw_set(config['username'], config['password'])
+
     # Enable SSL/TLS
     client.tls_set()
+    return client
+
+
+def run_load_mode(args, config):
+    """Publish from args.devices virtual pens, each with its own client id and topic"""
+    rate = args.total_rate / args.devices if args.total_rate else args.rate
+    reset_range = None if args.no_resets else (args.reset_min, args.reset_max)
+    pens = [VirtualPen(i, rate, args.seed, reset_range) for i in range(args.devices)]
+    stats = PublishStats()
+    clients = []
+    try:
+        for pen in pens:
+            client = make_client(config, client_id=f"{args.client_prefix}{pen.device}")
+            client.on_publish = stats.on_publish
+            client.max_inflight_messages_set(args.max_inflight)
+            client.connect(config['host'], config['port'], 60)
+            client.loop_start()
+            clients.append(client)
+        print(f"Publishing from {len(pens)} devices at {rate:,.0f} samples/s each")
+
+        chunk = args.frame_samples if args.binary else args.batch
+        elapsed = run_load(pens, clients, stats, chunk, args.binary, args.duration, args.report_interval)
+        wait_for_acks(stats, args.ack_timeout)
+        print_load_summary(pens, stats, elapsed)
+    finally:
+        for client in clients:
+            client.loop_stop()
+            client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulated pen publishing to the MQTT broker")
+    parser.add_argument('--binary', action='store_true',
+                        help="Publish multi-sample binary frames instead of one JSON message per sample")
+    parser.add_argument('--rate', type=float, default=500,
+                        help="Samples per second in binary mode, per device with --load")
+    parser.add_argument('--frame-samples', type=int, default=10,
+                        help="Samples packed into each binary frame")
+    parser.add_argument('--device', default=None,
+                        help="Publish on coordinates/<device> instead of coordinates")
+    load = parser.add_argument_group("load generator (--load)")
+    load.add_argument('--load', action='store_true',
+                      help="Publish from many seeded virtual pens without per-message output")
+    load.add_argument('--devices', type=int, default=10,
+                      help="Virtual pens, each with its own client id and coordinates/sim<n> topic")
+    load.add_argument('--total-rate', type=float,
+                      help="Samples per second across all devices (overrides --rate)")
+    load.add_argument('--seed', type=int, default=0,
+                      help="Seed of the trajectories, noise and reset schedule")
+    load.add_argument('--duration', type=float, help="Seconds to publish (default: until Ctrl-C)")
+    load.add_argument('--batch', type=int, default=10,
+                      help="JSON messages each device publishes per tick")
+    load.add_argument('--reset-min', type=float, default=5, help="Minimum seconds between resets")
+    load.add_argument('--reset-max', type=float, default=15, help="Maximum seconds between resets")
+    load.add_argument('--no-resets', action='store_true', help="Do not send reset signals")
+    load.add_argument('--max-inflight', type=int, default=100,
+                      help="Unacknowledged QoS 1 messages per client")
+    load.add_argument('--ack-timeout', type=float, default=10,
+                      help="Seconds to wait for outstanding acks at the end")
+    load.add_argument('--report-interval', type=float, default=5,
+                      help="Seconds between status lines (0 disables them)")
+    load.add_argument('--client-prefix', default="acc-sim-", help="Prefix of the client ids")
+    args = parser.parse_args()
+    topic = f"coordinates/{args.device}" if args.device else "coordinates"
+    config = load_config()
+
+    if args.load:
+        run_load_mode(args, config)
+        return
+
+    client = make_client(config)
+    client.on_connect = on_connect
     
     # Connect to Solace Cloud
-    client.connect(MQTT_HOST, MQTT_PORT, 60)
+    client.connect(config['host'], config['port'], 60)
     
     # Start the MQTT client loop in the background
     client.loop_start()
     
     try:
+        if args.binary:
+            run_binary(client, topic, args.rate, args.frame_samples)
         while True:
             acceleration_data = simulate_circular_acceleration()
-            topic = "coordinates"  # Changed topic to reflect acceleration data
             client.publish(topic, json.dumps(acceleration_data), qos=1, retain=False)
             print(f"Published: {acceleration_data}")
             print(f"Time until next reset: {RESET_INTERVAL - (time.time() - last_reset_time):.1f} seconds")
@@ -1,11 +1,18 @@
 import tkinter as tk
 from tkinter import ttk
 import os
-import certifi
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
-from plotter import Plotter
+import base64
+import queue
+import threading
+from canvas_points import (
+    POINTS_COLLECTION, SESSION_PAGE_SIZE, list_sessions, session_canvases,
+    iter_canvas_chunks, canvas_point_count, STROKE_GAP
+)
+from rasterize import render_points, encode_png
+from thumbnail_cache import ThumbnailCache
+
+THUMBNAIL_SIZE = 96
+THUMBNAILS_PER_ROW = 4
 
 class SessionViewer(tk.Tk):
     def __init__(self):
@@ -13,18 +20,20 @@ class SessionViewer(tk.Tk):
 
         # Configure the main window
         self.title("Session and Canvas Viewer")
-        self.geometry("400x300")
+        self.geometry("480x560")
         self.configure(bg='#f0f0f0')  # Light gray background
 
         # MongoDB connection setup
-        load_dotenv()
-        self.client = MongoClient(
-            os.getenv("uri"),
-            server_api=ServerApi('1'),
-            tlsCAFile=certifi.where()
-        )
+        self.client = self._connect()
         self.db = self.client['Uottahack']
         self.collection = self.db['sessions']
+        self.points_collection = self.db[POINTS_COLLECTION]
+
+        # Rendered previews survive restarts; a canvas that grew gets a new one
+        self.thumbnails = ThumbnailCache()
+        self._thumbnail_results = queue.Queue()
+        self._thumbnail_images = {}
+        self._preview_generation = 0
 
         # Create and setup the main frame
         self.main_frame = ttk.Frame(self, padding="20")
@@ -41,6 +50,20 @@ class SessionViewer(tk.Tk):
         # Load initial data
         self.load_sessions()
 
+    @staticmethod
+    def _connect():
+        import certifi
+        from pymongo.mongo_client import MongoClient
+        from pymongo.server_api import ServerApi
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        return MongoClient(
+            os.getenv("uri"),
+            server_api=ServerApi('1'),
+            tlsCAFile=certifi.where()
+        )
+
     def create_widgets(self):
         # Session Selection
         self.session_label = ttk.Label(
@@ -57,9 +80,18 @@ class SessionViewer(tk.Tk):
             state='readonly',
             width=30
         )
-        self.session_dropdown.pack(pady=(0, 20))
+        self.session_dropdown.pack(pady=(0, 5))
         self.session_dropdown.bind('<<ComboboxSelected>>', self.on_session_select)
 
+        # Shown while older history has not been listed yet
+        self.more_button = ttk.Button(
+            self.main_frame,
+            text="Load more sessions",
+            command=self.load_sessions
+        )
+        self.session_spacer = ttk.Frame(self.main_frame, height=15)
+        self.session_spacer.pack()
+
         # Canvas Selection (initially hidden)
         self.canvas_label = ttk.Label(
             self.main_frame, 
@@ -74,38 +106,62 @@ class SessionViewer(tk.Tk):
             width=30
         )
         self.canvas_dropdown.bind('<<ComboboxSelected>>', self.on_canvas_select)
+
+        # Canvas previews, click one to open it
+        self.preview_frame = ttk.Frame(self.main_frame)
         
         # Don't pack canvas elements initially
         # They will be packed when a session is selected
 
     def load_sessions(self):
-        # Get all sessions from MongoDB
-        sessions = list(self.collection.find())
-        
-        # Create new user-friendly names
-        session_names = []
-        
-        # Prepare a dict to map the 'Session X' name to the actual session data
-        self.sessions_data = {}
+        """Append the next page of session summaries to the dropdown"""
+        if not hasattr(self, 'sessions_data'):
+            # Map the 'Session X' name to the session summary
+            self.sessions_data = {}
+            self._last_session_id = None
+
+        # Only ids, timestamps and canvas counts, coordinates stay on the server
+        try:
+            sessions = list_sessions(self.collection, after=self._last_session_id,
+                                     limit=SESSION_PAGE_SIZE)
+        except Exception as e:
+            print(f"Error loading sessions: {e}")
+            return
 
-        for i, session in enumerate(sessions, start=1):
+        for i, session in enumerate(sessions, start=len(self.sessions_data) + 1):
             # Build a new name for each session
             session_name = f"Session {i}"
-            session_names.append(session_name)
-            
-            # Store session data keyed by the new name
+            if session.get('timestamp'):
+                session_name += f" - {session['timestamp']:%Y-%m-%d %H:%M}"
+            session_name += f" ({session['canvas_count']} canvases"
+            if session.get('summary'):
+                session_name += f", {session['summary']['points']} points"
+            session_name += ")"
             self.sessions_data[session_name] = session
-        
+        if sessions:
+            self._last_session_id = sessions[-1]['_id']
+
         # Update the dropdown with the new session names
-        self.session_dropdown['values'] = session_names
+        self.session_dropdown['values'] = list(self.sessions_data)
+
+        # A full page means there may be more
+        if len(sessions) == SESSION_PAGE_SIZE:
+            self.more_button.pack(before=self.session_spacer)
+        else:
+            self.more_button.pack_forget()
 
     def on_session_select(self, event):
         selected_session = self.session_var.get()
         if selected_session:
             session_data = self.sessions_data[selected_session]
+            try:
+                self.canvases = session_canvases(self.collection, session_data['_id'])
+            except Exception as e:
+                print(f"Error loading canvases: {e}")
+                return
             
             # Create a list of "Canvas 1", "Canvas 2", etc.
-            canvas_display_names = [f"Canvas {i+1}" for i in range(len(session_data['canvases']))]
+            canvas_display_names = [f"Canvas {i+1}" for i in range(len(self.canvases))]
             
             # Show canvas selection elements
             self.canvas_label.pack(pady=(0, 5))
@@ -114,16 +170,111 @@ class SessionViewer(tk.Tk):
             # Set the display names in the dropdown
             self.canvas_dropdown['values'] = canvas_display_names
             self.canvas_var.set('')
+            self.show_previews(session_data['_id'], self.canvases)
 
             # Store the mapping between display names and canvas IDs for later use
             # self.canvas_mapping = dict(zip(canvas_display_names, 
             #                             [canvas['canvas_id'] for canvas in session_data['canvases']]))
             
 
+    def show_previews(self, session_id, canvases):
+        """Show a thumbnail per canvas, rendering the ones not cached yet in the background"""
+        for widget in self.preview_frame.winfo_children():
+            widget.destroy()
+        self._thumbnail_images = {}
+        self._preview_generation += 1
+        self.preview_frame.pack(pady=(0, 10))
+
+        self._preview_labels = []
+        for index in range(len(canvases)):
+            label = ttk.Label(self.preview_frame, text=f"Canvas {index + 1}", compound='top')
+            label.grid(row=index // THUMBNAILS_PER_ROW, column=index % THUMBNAILS_PER_ROW,
+                       padx=4, pady=4)
+            label.bind('<Button-1>', lambda event, index=index: self._open_canvas(index))
+            self._preview_labels.append(label)
+
+        threading.Thread(
+            target=self._render_previews,
+            args=(self._preview_generation, session_id, canvases),
+            daemon=True
+        ).start()
+        self.after(50, self._poll_previews, self._preview_generation)
+
+    def _render_previews(self, generation, session_id, canvases):
+        """
+        Worker thread: fetch PNG bytes per canvas from the cache, rendering misses
+        Posts (generation, index, png) per canvas, png None if it failed, then
+        (generation, None, None) once the generation is done
+        """
+        try:
+            self._render_preview_list(generation, session_id, canvases)
+        finally:
+            self._thumbnail_results.put((generation, None, None))
+
+    def _render_preview_list(self, generation, session_id, canvases):
+        for index, canvas_data in enumerate(canvases):
+            if generation != self._preview_generation:
+                return
+            try:
+                embedded = canvas_data.get('embedded')
+                summary = canvas_data.get('summary')
+                if embedded is not None:
+                    version = embedded
+                elif summary is not None:
+                    version = summary['count']
+                else:
+                    # Sessions written before canvases carried summaries
+                    version = canvas_point_count(self.points_collection, session_id, index)
+                # Previews cached with another stroke gap are rendered again
+                version = f"{version}-g{STROKE_GAP}"
+
+                def render():
+                    points = []
+                    for chunk in iter_canvas_chunks(self.collection, self.points_collection,
+                                                    session_id, index, embedded):
+                        points.extend(chunk)
+                    # Only pen-down points are stored, pauses separate the strokes
+                    return encode_png(render_points(points, THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                                    max_gap=STROKE_GAP, line_width=1.5))
+
+                png = self.thumbnails.get_or_render(session_id, index, version, render)
+                self._thumbnail_results.put((generation, index, png))
+            except Exception as e:
+                print(f"Error rendering preview of canvas {index + 1}: {e}")
+                self._thumbnail_results.put((generation, index, None))
+
+    def _poll_previews(self, generation):
+        """Show rendered previews on the Tk thread until the worker of generation is done"""
+        if generation != self._preview_generation:
+            # Another session was selected, its own poll took over
+            return
+        try:
+            while True:
+                result_generation, index, png = self._thumbnail_results.get_nowait()
+                if result_generation != generation:
+                    continue
+                if index is None:
+                    return
+                if png is None:
+                    self._preview_labels[index].configure(text=f"Canvas {index + 1}\n(no preview)")
+                    continue
+                image = tk.PhotoImage(data=base64.b64encode(png))
+                self._thumbnail_images[index] = image
+                self._preview_labels[index].configure(image=image)
+        except queue.Empty:
+            pass
+        self.after(50, self._poll_previews, generation)
+
+    def _open_canvas(self, index):
+        self.canvas_var.set(f"Canvas {index + 1}")
+        self.on_canvas_select(None)
+
     def on_canvas_select(self, event):
         selected_session = self.session_var.get()
         selected_canvas_display = self.canvas_var.get()  # This is "Canvas 1", "Canvas 2", etc.
 
+        # matplotlib is only loaded once a canvas is opened
+        from plotter import Plotter
         plotter = Plotter(max_points=1000)
 
         if selected_session and selected_canvas_display:
@@ -134,21 +285,40 @@ class SessionViewer(tk.Tk):
             canvas_index = int(selected_canvas_display.split()[1]) - 1
             
             # Get the canvas data using the index
-            canvas_data = session_data['canvases'][canvas_index]
+            canvas_data = self.canvases[canvas_index]
             
-            if canvas_data:
-                coordinates = canvas_data['coordinates']
-                print("Coordinates: ")
-                print(list(coordinates))
-
-                plotter.add_points(coordinates)
+            if canvas_data is not None:
+                # Fetch the points chunk by chunk while the plot is already showing;
+                # sessions that were not migrated yet still embed their coordinates
+                chunks = iter_canvas_chunks(
+                    self.collection, self.points_collection, session_data['_id'],
+                    canvas_index, canvas_data.get('embedded')
+                )
+                threading.Thread(
+                    target=self._stream_points,
+                    args=(chunks, plotter, selected_canvas_display),
+                    daemon=True
+                ).start()
                 plotter.start_animation(interval=100)
 
+    def _stream_points(self, chunks, plotter, name):
+        """Worker thread: queue the points of a canvas on the plotter as chunks arrive"""
+        loaded = 0
+        try:
+            for chunk in chunks:
+                for point in chunk:
+                    plotter.add_point(point['x'], point['y'], point['z'])
+                loaded += len(chunk)
+        except Exception as e:
+            print(f"Error loading {name}: {e}")
+        print(f"Loaded {loaded} points of {name}")
+
 
 
 def main():
-        app = SessionViewer()
-        app.mainloop()
+    app = SessionViewer()
+    app.mainloop()
 
 
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
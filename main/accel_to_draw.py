@@ -2,7 +2,7 @@
 from dataclasses import dataclass
 from typing import Tuple
 import numpy as np
-from collections import deque
+from rolling_stats import RollingStats, RollingFlags
 
 @dataclass
 class IMUPoint:
@@ -23,6 +23,7 @@ class MotionProcessor:
         
         # Base values (from your stationary data)
         self.accel_offset = np.array([-1950, 100, 17600])
+        self._offset = tuple(float(v) for v in self.accel_offset)
         
         # Movement parameters
         self.movement_speed = 50.0
@@ -30,28 +31,28 @@ class MotionProcessor:
         
         # Calibration state
         self.is_calibrating = True
-        self.calibration_samples_x = deque(maxlen=20)  # Reduced sample size for quicker updates
-        self.calibration_samples_y = deque(maxlen=20)
+        self.calibration_samples_x = RollingStats(20)  # Reduced sample size for quicker updates
+        self.calibration_samples_y = RollingStats(20)
         self.accel_threshold_x = 250  # Initial values
         self.accel_threshold_y = 650
         
         # State tracking
         self.is_moving = False
         self.current_direction = np.zeros(3)
-        self.rest_samples = deque(maxlen=8)
+        self.rest_samples = RollingFlags(8)
         self.last_timestamp = None
         
         # Add Y-axis stability tracking
-        self.y_samples = deque(maxlen=3)
+        self.y_samples = RollingStats(3)
 
-    def _update_thresholds(self, accel):
+    def _update_thresholds(self, accel, report=True):
         """Update thresholds based on current rest period readings"""
         self.calibration_samples_x.append(accel[0])
         self.calibration_samples_y.append(accel[1])
         
         if len(self.calibration_samples_x) >= 10:  # Wait for at least 10 samples
-            x_std = np.std(self.calibration_samples_x)
-            y_std = np.std(self.calibration_samples_y)
+            x_std = self.calibration_samples_x.std()
+            y_std = self.calibration_samples_y.std()
             
             # Update X threshold (with bounds)
             self.accel_threshold_x = max(250, min(500, x_std * 3.0))
@@ -59,22 +60,23 @@ class MotionProcessor:
             # Update Y threshold (with bounds)
             self.accel_threshold_y = max(500, min(800, y_std * 3.0))
             
-            print(f"Updated thresholds - X: {self.accel_threshold_x:.1f}, Y: {self.accel_threshold_y:.1f}")
+            if report:
+                print(f"Updated thresholds - X: {self.accel_threshold_x:.1f}, Y: {self.accel_threshold_y:.1f}")
 
-    def _is_at_rest(self, accel_raw):
-        """Determine if sensor is at rest"""
-        accel_diff = np.abs(accel_raw - self.accel_offset)
-        is_rest = np.all(accel_diff < self.rest_threshold)
+    def _is_at_rest(self, accel):
+        """Determine if sensor is at rest (accel is relative to the baseline)"""
+        threshold = self.rest_threshold
+        is_rest = abs(accel[0]) < threshold and abs(accel[1]) < threshold and abs(accel[2]) < threshold
         self.rest_samples.append(is_rest)
-        return len(self.rest_samples) >= 3 and all(self.rest_samples)
+        return len(self.rest_samples) >= 3 and self.rest_samples.all_true()
 
     def _is_y_stable(self, accel_y):
         """Check if Y acceleration is stable"""
         self.y_samples.append(accel_y)
         if len(self.y_samples) < 3:
             return False
-        y_variation = np.std(self.y_samples)
-        return y_variation < 200
+        # Compare variances to skip the square root
+        return self.y_samples.variance() < 200 * 200
 
     def _process_point(self, point: IMUPoint) -> None:
         if self.last_timestamp is None:
@@ -82,13 +84,13 @@ class MotionProcessor:
             return
 
         dt = (point.timestamp - self.last_timestamp) / 1000.0
-        accel_raw = np.array([point.ax, point.ay, point.az])
         
         # Get acceleration relative to baseline
-        accel = accel_raw - self.accel_offset
+        ox, oy, oz = self._offset
+        accel = (point.ax - ox, point.ay - oy, point.az - oz)
         
         # Check if at rest
-        if self._is_at_rest(accel_raw):
+        if self._is_at_rest(accel):
             if self.is_moving:  # Just came to rest
                 self.calibration_samples_x.clear()
                 self.calibration_samples_y.clear()
@@ -123,6 +125,87 @@ class MotionProcessor:
         point = IMUPoint(ax, ay, az, gx, gy, gz, timestamp)
         self._process_point(point)
 
+    def process_batch(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Process an (N, 7) array of (ax, ay, az, gx, gy, gz, timestamp) rows.
+        Returns an (N, 3) array of (x, y, pen_up) after every sample, the same
+        values add_point followed by get_plot_coordinates would produce.
+        """
+        samples = np.asarray(samples, dtype=np.float64).reshape(-1, 7)
+        n = len(samples)
+        out = np.empty((n, 3))
+        if n == 0:
+            return out
+
+        start = 0
+        if self.last_timestamp is None:
+            # The very first sample only sets the time base
+            self.last_timestamp = samples[0, 6]
+            out[0] = (self.position[0], self.position[1], 0 if self.is_moving else 1)
+            start = 1
+            if n == 1:
+                return out
+
+        rows = samples[start:]
+        m = len(rows)
+        timestamps = rows[:, 6]
+        dt = np.diff(timestamps, prepend=self.last_timestamp) / 1000.0
+        accel = rows[:, :3] - self.accel_offset
+
+        # Rest detection: every flag in the (up to 8 long) window must be true
+        rest = np.all(np.abs(accel) < self.rest_threshold, axis=1)
+        index = np.arange(m)
+        last_false = np.maximum.accumulate(np.where(rest, -1, index))
+        run = index - last_false
+        run = np.where(last_false < 0, run + self.rest_samples.run, run)
+        window = np.minimum(len(self.rest_samples) + index + 1, self.rest_samples.size)
+        at_rest = (window >= 3) & (run >= window)
+
+        # The moving/threshold state machine is inherently sequential; run it
+        # over plain floats and leave the integration to NumPy
+        direction = np.zeros((m, 2))
+        moving = np.zeros(m, dtype=bool)
+        is_moving = self.is_moving
+        dir_x, dir_y = self.current_direction[0], self.current_direction[1]
+        ax_list = accel[:, 0].tolist()
+        ay_list = accel[:, 1].tolist()
+        for i, resting in enumerate(at_rest.tolist()):
+            ax = ax_list[i]
+            ay = ay_list[i]
+            if resting:
+                if is_moving:
+                    self.calibration_samples_x.clear()
+                    self.calibration_samples_y.clear()
+                is_moving = False
+                dir_x = dir_y = 0.0
+                self._update_thresholds((ax, ay), report=False)
+                continue
+            if not is_moving:
+                if abs(ay) > self.accel_threshold_y:
+                    is_moving = True
+                    dir_x, dir_y = 0.0, (-1.0 if ay > 0 else 1.0)
+                elif self._is_y_stable(ay) and abs(ax) > self.accel_threshold_x:
+                    is_moving = True
+                    dir_x, dir_y = (-1.0 if ax > 0 else 1.0), 0.0
+            if is_moving:
+                direction[i, 0] = dir_x
+                direction[i, 1] = dir_y
+                moving[i] = True
+
+        # Integrate in sample order so the result matches the scalar path exactly
+        steps = direction * self.movement_speed * dt[:, None]
+        path = np.cumsum(np.vstack([self.position[:2], steps]), axis=0)[1:]
+        out[start:, :2] = path
+        out[start:, 2] = np.where(moving, 0, 1)
+
+        # Carry the state over to the next call (batch or scalar)
+        self.rest_samples.extend(rest[-self.rest_samples.size:].tolist())
+        self.position[:2] = path[-1]
+        self.is_moving = is_moving
+        self.current_direction = np.array([dir_x, dir_y, 0.0]) if is_moving else np.zeros(3)
+        self.last_timestamp = timestamps[-1]
+        return out
+
     def get_current_position(self) -> Tuple[float, float, float]:
         return tuple(self.position)
 
@@ -0,0 +1,314 @@
+# archive.py
+# Streams sessions out of MongoDB into a columnar archive on disk and back.
+#
+# Layout of an archive directory:
+#   manifest.json    format version, column dtypes and the total point count
+#   sessions.jsonl   one session document per line (Extended JSON, no points)
+#   index.npy        one row per canvas: session, canvas, offset, count
+#   x.f32 y.f32 z.f32 timestamp.i32
+#                    raw little-endian columns holding every point of every
+#                    canvas back to back, in index order; points without a
+#                    timestamp (seeded and legacy canvases) hold NO_TIMESTAMP
+#
+# Columns are plain arrays so that they can be appended while streaming and
+# memory-mapped when read: a canvas is a slice of each column, nothing is
+# deserialized into Python objects until it is actually needed.
+import json
+import os
+import argparse
+import numpy as np
+from bson import json_util
+from pymongo.errors import BulkWriteError
+from canvas_points import (POINTS_COLLECTION, BUCKET_SIZE, ensure_indexes, iter_canvas_buckets,
+                           bucket_bounds, empty_summary, summarize_points, merge_summary,
+                           session_summary)
+
+ARCHIVE_VERSION = 2
+# Version 1 archives stored missing timestamps as 0 and are still readable
+READABLE_VERSIONS = (1, 2)
+COLUMNS = {
+    'x': np.dtype('<f4'),
+    'y': np.dtype('<f4'),
+    'z': np.dtype('<f4'),
+    'timestamp': np.dtype('<i4'),
+}
+COLUMN_FILES = {'x': 'x.f32', 'y': 'y.f32', 'z': 'z.f32', 'timestamp': 'timestamp.i32'}
+INDEX_DTYPE = np.dtype([
+    ('session', '<i4'),
+    ('canvas', '<i4'),
+    ('offset', '<i8'),
+    ('count', '<i8'),
+])
+_INT32 = np.iinfo(np.int32)
+# Timestamp column value of a point that has no timestamp
+NO_TIMESTAMP = _INT32.min
+
+
+def points_to_columns(points):
+    """
+    Convert a list of point dicts into a dict of column arrays
+    A missing timestamp (seeded coordinates have none) is stored as NO_TIMESTAMP,
+    other missing fields as 0
+    """
+    columns = {
+        name: np.fromiter((point.get(name, 0) for point in points), dtype=np.float64, count=len(points))
+        for name in COLUMNS if name != 'timestamp'
+    }
+    timestamps = np.fromiter(
+        (np.nan if point.get("timestamp") is None else point["timestamp"] for point in points),
+        dtype=np.float64, count=len(points)
+    )
+    present = timestamps[~np.isnan(timestamps)]
+    if len(present) and (present.min() <= NO_TIMESTAMP or present.max() > _INT32.max):
+        raise ValueError("Point timestamps do not fit the int32 timestamp column")
+    columns['timestamp'] = np.where(np.isnan(timestamps), NO_TIMESTAMP, timestamps)
+    return {name: columns[name].astype(dtype) for name, dtype in COLUMNS.items()}
+
+
+def columns_to_points(columns, start=0, stop=None):
+    """Convert column slices back into the point dicts stored in MongoDB"""
+    names = list(COLUMNS)
+    values = [columns[name][start:stop].tolist() for name in names]
+    return [
+        {"x": x, "y": y, "z": z, "timestamp": timestamp} if timestamp != NO_TIMESTAMP
+        else {"x": x, "y": y, "z": z}
+        for x, y, z, timestamp in zip(*values)
+    ]
+
+
+def _canvas_point_batches(points_collection, session, canvas, canvas_doc):
+    """Yield the points of a canvas in order, from buckets or the legacy embedded array"""
+    if "coordinates" in canvas_doc:
+        yield canvas_doc["coordinates"]
+        return
+    yield from iter_canvas_buckets(points_collection, session["_id"], canvas)
+
+
+def export_sessions(sessions_collection, points_collection, path, query=None):
+    """
+    Stream sessions matching query into an archive directory
+    Returns (sessions, canvases, points) written
+    """
+    os.makedirs(path, exist_ok=True)
+    files = {name: open(os.path.join(path, COLUMN_FILES[name]), 'wb') for name in COLUMNS}
+    index = []
+    total = 0
+    sessions = 0
+    try:
+        with open(os.path.join(path, "sessions.jsonl"), 'w') as sessions_file:
+            for session in sessions_collection.find(query or {}).sort("_id", 1):
+                canvases = session.get("canvases", [])
+                for canvas, canvas_doc in enumerate(canvases):
+                    offset = total
+                    for points in _canvas_point_batches(points_collection, session, canvas, canvas_doc):
+                        for name, column in points_to_columns(points).items():
+                            files[name].write(column.tobytes())
+                        total += len(points)
+                    index.append((sessions, canvas, offset, total - offset))
+
+                # Everything but the points goes into the session line
+                session["canvases"] = [
+                    {key: value for key, value in canvas_doc.items() if key != "coordinates"}
+                    for canvas_doc in canvases
+                ]
+                sessions_file.write(json_util.dumps(session) + "\n")
+                sessions += 1
+    finally:
+        for f in files.values():
+            f.close()
+
+    np.save(os.path.join(path, "index.npy"), np.array(index, dtype=INDEX_DTYPE))
+    with open(os.path.join(path, "manifest.json"), 'w') as f:
+        json.dump({
+            'version': ARCHIVE_VERSION,
+            'points': total,
+            'columns': {name: {'file': COLUMN_FILES[name], 'dtype': dtype.str}
+                        for name, dtype in COLUMNS.items()},
+        }, f, indent=2)
+    return sessions, len(index), total
+
+
+class SessionArchive:
+    def __init__(self, path):
+        """
+        Read-only view of an archive directory
+        path: Directory written by export_sessions
+        Columns and the canvas index are memory-mapped, sessions are parsed on demand
+        """
+        self.path = path
+        with open(os.path.join(path, "manifest.json")) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get('version') not in READABLE_VERSIONS:
+            raise ValueError(f"Unsupported archive version {self.manifest.get('version')}")
+        self.points = self.manifest['points']
+        self.index = np.load(os.path.join(path, "index.npy"), mmap_mode='r')
+        self.columns = {}
+        for name, column in self.manifest['columns'].items():
+            if self.points:
+                self.columns[name] = np.memmap(os.path.join(path, column['file']),
+                                               dtype=np.dtype(column['dtype']), mode='r',
+                                               shape=(self.points,))
+            else:
+                # np.memmap refuses empty files
+                self.columns[name] = np.empty(0, dtype=np.dtype(column['dtype']))
+        self._sessions = None
+
+    def sessions(self):
+        """Return the session documents (without points) in archive order"""
+        if self._sessions is None:
+            with open(os.path.join(self.path, "sessions.jsonl")) as f:
+                self._sessions = [json_util.loads(line) for line in f if line.strip()]
+        return self._sessions
+
+    def __len__(self):
+        return len(self.index)
+
+    def canvas(self, position):
+        """Return the column slices of the canvas at a row of the index"""
+        row = self.index[position]
+        start = int(row['offset'])
+        stop = start + int(row['count'])
+        return {name: column[start:stop] for name, column in self.columns.items()}
+
+    def find_canvas(self, session, canvas):
+        """Return the index row of canvas number canvas in session number session"""
+        rows = np.flatnonzero((self.index['session'] == session) & (self.index['canvas'] == canvas))
+        if len(rows) == 0:
+            raise KeyError(f"No canvas {canvas} in archived session {session}")
+        return int(rows[0])
+
+    def iter_canvases(self):
+        """Yield (session position, canvas, columns) for every canvas"""
+        for position, row in enumerate(self.index):
+            yield int(row['session']), int(row['canvas']), self.canvas(position)
+
+
+def _insert_chunks(collection, documents, chunk_size):
+    """
+    insert_many(ordered=False) in chunks; documents already present are skipped
+    Returns the number inserted and the positions in documents of the skipped ones
+    """
+    inserted = 0
+    skipped = []
+    for start in range(0, len(documents), chunk_size):
+        part = documents[start:start + chunk_size]
+        try:
+            inserted += len(collection.insert_many(part, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            inserted += e.details.get('nInserted', 0)
+            skipped += [start + error['index'] for error in e.details.get('writeErrors', [])]
+    return inserted, skipped
+
+
+def import_archive(sessions_collection, points_collection, path, bucket_size=BUCKET_SIZE,
+                   chunk_size=1000):
+    """
+    Bulk load an archive into the sessions and bucketed canvas_points collections
+    Documents that already exist (same _id or bucket key) are skipped, so an
+    interrupted import can be run again. Buckets get their bounds and every
+    inserted session its canvas and session summaries, like written ones. A
+    session that was already present keeps its summaries unless it has none
+    (inserted by an interrupted import of a legacy session)
+    Returns a dict of inserted and skipped counts
+    """
+    archive = SessionArchive(path)
+    sessions = archive.sessions()
+    ensure_indexes(points_collection, sessions_collection)
+    inserted_sessions, skipped_sessions = _insert_chunks(sessions_collection, sessions, chunk_size)
+    skipped_sessions = set(skipped_sessions)
+
+    inserted_buckets = 0
+    skipped_buckets = 0
+    pending = []
+    # session index -> {canvas: summary}
+    summaries = {}
+    for session, canvas, columns in archive.iter_canvases():
+        session_id = sessions[session]["_id"]
+        count = len(columns['x'])
+        summary = empty_summary()
+        last = None
+        for seq, start in enumerate(range(0, count, bucket_size)):
+            part = columns_to_points(columns, start, start + bucket_size)
+            batch, last = summarize_points(part, last)
+            summary = merge_summary(summary, batch)
+            pending.append({"session_id": session_id, "canvas": canvas, "seq": seq,
+                            "count": len(part), "points": part, **bucket_bounds(part)})
+            if len(pending) >= chunk_size:
+                inserted, skipped = _insert_chunks(points_collection, pending, chunk_size)
+                inserted_buckets += inserted
+                skipped_buckets += len(skipped)
+                pending = []
+        summaries.setdefault(session, {})[canvas] = summary
+    inserted, skipped = _insert_chunks(points_collection, pending, chunk_size)
+    inserted_buckets += inserted
+    skipped_buckets += len(skipped)
+
+    for session, doc in enumerate(sessions):
+        canvas_summaries = summaries.get(session, {})
+        canvases = [canvas_summaries.get(canvas, empty_summary())
+                    for canvas in range(len(doc.get("canvases", [])))]
+        update = {f"canvases.{canvas}.summary": summary for canvas, summary in enumerate(canvases)}
+        update["summary"] = session_summary(canvases)
+        query = {"_id": doc["_id"]}
+        if session in skipped_sessions:
+            # An existing session may have received points since the export
+            query["summary"] = {"$exists": False}
+        sessions_collection.update_one(query, {"$set": update})
+
+    return {
+        'sessions': inserted_sessions,
+        'sessions_skipped': len(skipped_sessions),
+        'buckets': inserted_buckets,
+        'buckets_skipped': skipped_buckets,
+        'points': archive.points,
+    }
+
+
+def main():
+    import certifi
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from dotenv import load_dotenv
+
+    parser = argparse.ArgumentParser(description="Export sessions to a columnar archive or import one")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="Write sessions to an archive directory")
+    export.add_argument('path')
+    export.add_argument('--session', action='append', default=[],
+                        help="Only export this session id (repeatable)")
+    load = commands.add_parser('import', help="Load an archive directory into MongoDB")
+    load.add_argument('path')
+    load.add_argument('--bucket-size', type=int, default=BUCKET_SIZE,
+                      help="Points per canvas_points document")
+    load.add_argument('--chunk-size', type=int, default=1000,
+                      help="Documents per insert_many call")
+    args = parser.parse_args()
+
+    load_dotenv()
+    client = MongoClient(
+        os.getenv("uri"),
+        server_api=ServerApi('1'),
+        tlsCAFile=certifi.where()
+    )
+    db = client['Uottahack']
+
+    try:
+        if args.command == 'export':
+            from bson import ObjectId
+            query = {"_id": {"$in": [ObjectId(s) for s in args.session]}} if args.session else None
+            sessions, canvases, points = export_sessions(
+                db['sessions'], db[POINTS_COLLECTION], args.path, query
+            )
+            print(f"Exported {sessions} sessions, {canvases} canvases, {points} points to {args.path}")
+        else:
+            result = import_archive(db['sessions'], db[POINTS_COLLECTION], args.path,
+                                    args.bucket_size, args.chunk_size)
+            print(f"Imported {result['sessions']} sessions ({result['sessions_skipped']} already present), "
+                  f"{result['buckets']} buckets ({result['buckets_skipped']} already present), "
+                  f"{result['points']} points")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
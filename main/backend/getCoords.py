@@ -1,22 +1,28 @@
 import os
-from dotenv import load_dotenv
-from pymongo import MongoClient
-import certifi
 
-load_dotenv()
+def get_collection():
+    """Connect to the deployment in the uri environment variable"""
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    import certifi
 
-# MongoDB URI
-uri = os.getenv("uri")
-client = MongoClient(uri, tlsCAFile=certifi.where())
+    load_dotenv()
 
-# Select your database
-db = client['Uottahack']
-collection = db['digiPenDB'] 
+    # MongoDB URI
+    uri = os.getenv("uri")
+    client = MongoClient(uri, tlsCAFile=certifi.where())
 
-def getCoords(): 
+    # Select your database
+    db = client['Uottahack']
+    return db['digiPenDB']
+
+def getCoords(collection=None):
     # Using projection to only return x, y, and z fields
     # 1 means include the field, 0 means exclude
     # _id is included by default unless explicitly excluded
+    if collection is None:
+        collection = get_collection()
     return list(collection.find({}, {'_id': 0, 'x': 1, 'y': 1, 'z': 1}))
 
-print(getCoords())
\ No newline at end of file
+if __name__ == "__main__":
+    print(getCoords())
@@ -1,43 +1,32 @@
 import os
-import urllib.parse
-import certifi
-from pymongo.mongo_client import MongoClient
-from pymongo.server_api import ServerApi
-from dotenv import load_dotenv
-import configparser
 from datetime import datetime
 
-load_dotenv()
+def connect():
+    """Connect to the deployment in the uri environment variable and ping it"""
+    import certifi
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from dotenv import load_dotenv
 
-# Load configuration
-config = configparser.ConfigParser()
-config.read('config.properties')
+    load_dotenv()
+    uri = os.getenv("uri")
 
-# Encode the password to handle special characters
+    # Establish a MongoDB connection
+    client = MongoClient(
+        uri,
+        server_api=ServerApi('1'),
+        tlsCAFile=certifi.where()
+    )
 
+    try:
+        # Check the connection
+        client.admin.command('ping')
+        print("Pinged your deployment. You successfully connected to MongoDB!")
+    except Exception as e:
+        print(e)
+    return client
 
-password = "digiPenPassword"
-username = "philipp"
-
-uri = os.getenv("uri")
-
-# Establish a MongoDB connection
-print("Before Client")
-
-client = MongoClient(
-    uri,
-    server_api=ServerApi('1'),
-    tlsCAFile=certifi.where()
-)
-
-try:
-    # Check the connection
-    client.admin.command('ping')
-    print("Pinged your deployment. You successfully connected to MongoDB!")
-except Exception as e:
-    print(e)
-
-def create_session_with_canvases():
+def create_session_with_canvases(client):
     db = client['Uottahack']
     collection = db['sessions']
     
@@ -114,12 +103,12 @@ def create_session_with_canvases():
     print(f"Inserted {len(result.inserted_ids)} sessions")
 
 # Function to retrieve all sessions
-def get_all_sessions():
+def get_all_sessions(client):
     db = client['Uottahack']
     collection = db['sessions']
     return list(collection.find())
 
-# Create the sessions with their canvases and coordinates
-create_session_with_canvases()
-
-# Retrieve and print the sessions to verify
+if __name__ == "__main__":
+    # Create the sessions with their canvases and coordinates
+    client = connect()
+    create_session_with_canvases(client)
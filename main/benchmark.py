@@ -0,0 +1,425 @@
+# benchmark.py
+# Benchmarks for the ingest, motion and render hot paths.
+#
+#   python benchmark.py                      run everything, print a table
+#   python benchmark.py -k motion            only benchmarks whose name contains "motion"
+#   python benchmark.py --output base.json   save the results
+#   python benchmark.py --compare base.json  run again and compare against saved results
+#   python benchmark.py -k startup           cold-start time of every entry point
+#
+# Every benchmark runs on fixed datasets built from the captured test_data in
+# process_message.py, so numbers from different commits are comparable.
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+from process_message import long_capture
+
+# name -> (setup function, unit)
+BENCHMARKS = {}
+
+
+def register(name, unit='sample'):
+    """
+    Register a benchmark
+    The decorated setup(context) prepares its inputs and returns (run, items):
+    a callable doing the measured work and how many units one call handles
+    """
+    def decorator(setup):
+        BENCHMARKS[name] = (setup, unit)
+        return setup
+    return decorator
+
+
+class Context:
+    """Datasets shared by all benchmarks plus a scratch directory"""
+
+    def __init__(self, repeat=10):
+        self.samples = long_capture(repeat)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.log_dir = self.tmp.name
+        self._cleanups = []
+
+    def payloads(self):
+        """The samples as firmware JSON messages"""
+        return [
+            json.dumps({
+                "timestamp": int(row[6]),
+                "accel": {"x": row[0], "y": row[1], "z": row[2]},
+                "gyro": {"x": row[3], "y": row[4], "z": row[5]},
+            }).encode()
+            for row in self.samples.tolist()
+        ]
+
+    def frames(self, frame_samples=10):
+        """The samples as binary frames"""
+        from frames import encode_frame
+        return [
+            encode_frame(1, seq, self.samples[start:start + frame_samples])
+            for seq, start in enumerate(range(0, len(self.samples), frame_samples))
+        ]
+
+    def on_cleanup(self, callback):
+        self._cleanups.append(callback)
+
+    def close(self):
+        for callback in reversed(self._cleanups):
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error cleaning up benchmark: {e}")
+        self.tmp.cleanup()
+
+
+# Decoding
+
+def _register_decoders():
+    from decoder import available_backends, make_decoder
+
+    for backend in available_backends():
+        def setup(context, backend=backend):
+            from sample_ring import SampleRing
+            decode = make_decoder(backend)
+            payloads = context.payloads()
+            ring = SampleRing(capacity=4096)
+
+            def run():
+                for payload in payloads:
+                    decode(payload, ring)
+            return run, len(payloads)
+        register(f"decode.json.{backend}", 'message')(setup)
+
+
+_register_decoders()
+
+
+@register("decode.frames")
+def bench_decode_frames(context):
+    from frames import FrameDecoder
+    from sample_ring import SampleRing
+    frames = context.frames()
+    ring = SampleRing(capacity=4096)
+
+    def run():
+        decoder = FrameDecoder()
+        for frame in frames:
+            decoder.decode_into(frame, ring)
+    return run, len(context.samples)
+
+
+# Motion
+
+@register("motion.scalar")
+def bench_motion_scalar(context):
+    from accel_to_draw import MotionProcessor
+    rows = context.samples.tolist()
+
+    def run():
+        processor = MotionProcessor(window_size=10)
+        for row in rows:
+            processor.add_point(*row)
+            processor.get_plot_coordinates()
+    return run, len(rows)
+
+
+@register("motion.batch")
+def bench_motion_batch(context):
+    from accel_to_draw import MotionProcessor
+    samples = context.samples
+
+    def run():
+        processor = MotionProcessor(window_size=10)
+        for start in range(0, len(samples), 100):
+            processor.process_batch(samples[start:start + 100])
+    return run, len(samples)
+
+
+@register("integrator.process_sensor_data")
+def bench_integrator(context):
+    from integrate import PositionIntegrator, SensorData
+    data = [
+        SensorData(row[6], tuple(row[0:3]), tuple(row[3:6]))
+        for row in context.samples.tolist()
+    ]
+
+    def run():
+        integrator = PositionIntegrator()
+        for sample in data:
+            integrator.process_sensor_data(sample)
+    return run, len(data)
+
+
+# Logging
+
+def _register_loggers():
+    for fmt in ('csv', 'binary'):
+        def setup(context, fmt=fmt):
+            from logger import CoordinateLogger
+            samples = context.samples
+            positions = np.zeros((len(samples), 3))
+
+            def run():
+                logger = CoordinateLogger(context.log_dir, name=f"bench_{fmt}", fmt=fmt)
+                for start in range(0, len(samples), 100):
+                    logger.log_rows(samples[start:start + 100], positions[start:start + 100])
+                logger.close()
+                os.remove(logger.get_log_file_path())
+            return run, len(samples)
+        register(f"logger.{fmt}")(setup)
+
+
+_register_loggers()
+
+
+# Rendering
+
+def _agg_plotter(context):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from plotter import Plotter
+    plotter = Plotter()
+    context.on_cleanup(lambda: plt.close(plotter.fig))
+    return plotter
+
+
+@register("plotter.process_queue", 'point')
+def bench_plotter_queue(context):
+    plotter = _agg_plotter(context)
+    points = [(float(i), float(i % 7), 0) for i in range(len(context.samples))]
+
+    def run():
+        for x, y, z in points:
+            plotter.add_point(x, y, z)
+        plotter._process_queue()
+    return run, len(points)
+
+
+@register("plotter.update_plot", 'frame')
+def bench_plotter_update(context):
+    from accel_to_draw import MotionProcessor
+    from sample_ring import SampleRing
+    plotter = _agg_plotter(context)
+    ring = SampleRing(capacity=len(context.samples))
+    first = ring.extend(context.samples.T)
+    ring.positions[:] = MotionProcessor(window_size=10).process_batch(context.samples)
+    plotter.fig.canvas.draw()
+    plotter.attach_ring(ring)
+    frames = 50
+    per_frame = len(context.samples) // frames
+
+    def run():
+        # Replay the positions in 50 frames, each committing a block of new rows
+        ring.committed = first
+        plotter.attach_ring(ring)
+        for frame in range(frames):
+            ring.commit(first + (frame + 1) * per_frame)
+            plotter._update_plot(frame)
+    return run, frames
+
+
+@register("rasterize.thumbnail", 'thumbnail')
+def bench_rasterize(context):
+    from accel_to_draw import MotionProcessor
+    from rasterize import render, encode_png
+    positions = MotionProcessor(window_size=10).process_batch(context.samples)
+    xs, ys, zs = positions[:, 0], positions[:, 1], positions[:, 2]
+
+    def run():
+        for _ in range(20):
+            encode_png(render(xs, ys, zs, 128, 128))
+    return run, 20
+
+
+# End to end
+
+class _FakeMongo:
+    """Counts what MQTTHandler would store"""
+
+    def __init__(self):
+        self.points = 0
+
+    def add_points(self, xs, ys, timestamps, device=None):
+        self.points += len(xs)
+
+    def rollover(self, device=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def write_stats(self):
+        return {'points_written': self.points}
+
+
+class _FakePlotter:
+    def attach_ring(self, ring):
+        self.ring = ring
+
+    def mark_reset(self, seq):
+        pass
+
+
+class _Message:
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+@register("mqtt.on_message", 'message')
+def bench_on_message(context):
+    from mqtt_handler import MQTTHandler
+    config_path = os.path.join(context.log_dir, "config.properties")
+    with open(config_path, 'w') as f:
+        f.write("[mqtt]\nhost=localhost\nport=1883\nusername=bench\npassword=bench\n")
+    messages = [_Message("coordinates/bench", payload) for payload in context.payloads()]
+
+    def run():
+        handler = MQTTHandler(
+            mongo_handler=_FakeMongo(), plotter=_FakePlotter(), config_path=config_path,
+            verbose=False, log_options={'log_dir': context.log_dir}
+        )
+        handler.start()
+        for message in messages:
+            handler.on_message(None, None, message)
+        handler.stop()
+    return run, len(messages)
+
+
+# Startup
+
+def _register_startup():
+    from startup import ENTRY_POINTS, import_profile
+
+    for name in ENTRY_POINTS:
+        def setup(context, name=name):
+            # One cold start: a fresh interpreter importing the entry point
+            def run():
+                import_profile(name)
+            return run, 1
+        register(f"startup.{name}", 'start')(setup)
+
+
+_register_startup()
+
+
+def run_benchmark(name, context, repeat=5):
+    """Time one benchmark and return its result entry"""
+    setup, unit = BENCHMARKS[name]
+    run, items = setup(context)
+    # Warm caches, imports and lazily created state
+    run()
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    best = min(times)
+    return {
+        'unit': unit,
+        'items': items,
+        'repeat': repeat,
+        'best_s': best,
+        'median_s': statistics.median(times),
+        'mean_s': statistics.fmean(times),
+        'per_item_us': best / items * 1e6,
+        'items_per_s': items / best,
+    }
+
+
+def run_suite(pattern=None, repeat=5, dataset_repeat=10):
+    """Run every benchmark whose name contains pattern"""
+    context = Context(dataset_repeat)
+    results = {}
+    try:
+        for name in BENCHMARKS:
+            if pattern and pattern not in name:
+                continue
+            try:
+                results[name] = run_benchmark(name, context, repeat)
+            except ImportError as e:
+                print(f"Skipping {name}: {e}")
+    finally:
+        context.close()
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'samples': len(context.samples),
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+
+def print_results(report):
+    for name, result in report['results'].items():
+        print(f"{name:34s} {result['per_item_us']:10.2f} us/{result['unit']:8s}"
+              f"{result['items_per_s']:>14,.0f} {result['unit']}s/s")
+
+
+def compare(report, baseline, threshold=0.1):
+    """
+    Print per-benchmark ratios against a baseline report
+    Returns the names that got slower by more than threshold
+    """
+    regressions = []
+    for name, result in report['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:34s} {result['per_item_us']:10.2f} us   (new)")
+            continue
+        ratio = result['per_item_us'] / before['per_item_us']
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            flag = "  faster"
+        print(f"{name:34s} {before['per_item_us']:10.2f} -> {result['per_item_us']:10.2f} us  "
+              f"{ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingest, motion and render paths")
+    parser.add_argument('-k', dest='pattern', help="Only run benchmarks whose name contains this")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Baseline JSON file to compare against")
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help="Relative slowdown reported as a regression")
+    parser.add_argument('--list', action='store_true', help="List the benchmarks and exit")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, (_, unit) in BENCHMARKS.items():
+            print(f"{name} (per {unit})")
+        return 0
+
+    report = run_suite(args.pattern, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks slower than the baseline by more than "
+                  f"{args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    else:
+        print_results(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
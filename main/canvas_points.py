@@ -0,0 +1,339 @@
+# canvas_points.py
+# Canvas coordinates are stored in fixed-size buckets in their own collection
+# instead of one ever-growing array inside the session document.
+#
+# Bucket document:
+#   {"session_id": ObjectId, "canvas": int, "seq": int, "count": int, "points": [...],
+#    "x_min", "x_max", "y_min", "y_max", "t_start", "t_end"}
+#
+# Sessions carry summaries that are kept up to date as batches are written, so
+# readers can plan work without scanning coordinates:
+#   session.summary:              {"points", "strokes", "t_start", "t_end"}
+#   session.canvases[i].summary:  {"count", "strokes", "x_min", "x_max",
+#                                  "y_min", "y_max", "t_start", "t_end"}
+import numpy as np
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from strokes import PEN_DOWN
+
+POINTS_COLLECTION = 'canvas_points'
+BUCKET_SIZE = 500
+SESSION_PAGE_SIZE = 50
+# Milliseconds without a stored point after which the next point starts a new stroke
+STROKE_GAP = 250
+
+
+def ensure_indexes(points_collection, sessions_collection=None):
+    """Create the index that keys and orders buckets, and the session indexes"""
+    points_collection.create_index(
+        [("session_id", ASCENDING), ("canvas", ASCENDING), ("seq", ASCENDING)],
+        unique=True,
+        name="session_canvas_seq"
+    )
+    if sessions_collection is not None:
+        # Listing and exporting sessions by date
+        sessions_collection.create_index([("timestamp", DESCENDING)], name="timestamp")
+
+
+def empty_summary():
+    """Summary of a canvas without points"""
+    return {"count": 0, "strokes": 0}
+
+
+def summarize_points(points, last=None, stroke_gap=STROKE_GAP):
+    """
+    Summary of a batch of points appended to a canvas
+    last: (z, timestamp) of the point written before the batch, None for a new canvas
+    Returns the summary and the (z, timestamp) to pass with the next batch
+    Points without a timestamp (e.g. seeded sessions) only split strokes at pen-up
+    points and leave t_start/t_end out of the summary
+    """
+    count = len(points)
+    xs = np.fromiter((point["x"] for point in points), dtype=np.float64, count=count)
+    ys = np.fromiter((point["y"] for point in points), dtype=np.float64, count=count)
+    zs = np.fromiter((point.get("z", PEN_DOWN) for point in points), dtype=np.float64, count=count)
+    ts = np.fromiter((_timestamp(point) for point in points), dtype=np.float64, count=count)
+
+    # A stroke starts at a pen-down point after a pen-up point or a pause
+    prev_z = np.empty(count)
+    prev_t = np.empty(count)
+    prev_z[0], prev_t[0] = last if last is not None else (np.nan, -np.inf)
+    prev_z[1:] = zs[:-1]
+    prev_t[1:] = ts[:-1]
+    down = zs == PEN_DOWN
+    starts = down & ((prev_z != PEN_DOWN) | (ts - prev_t > stroke_gap))
+
+    summary = {
+        "count": count,
+        "strokes": int(starts.sum()),
+        "x_min": float(xs.min()), "x_max": float(xs.max()),
+        "y_min": float(ys.min()), "y_max": float(ys.max()),
+    }
+    if not np.isnan(ts).all():
+        summary["t_start"] = int(np.nanmin(ts))
+        summary["t_end"] = int(np.nanmax(ts))
+    return summary, (float(zs[-1]), float(ts[-1]))
+
+
+def merge_summary(summary, batch):
+    """Fold a batch summary into a canvas summary (summary_update for documents in memory)"""
+    merged = dict(summary)
+    merged["count"] = summary.get("count", 0) + batch["count"]
+    merged["strokes"] = summary.get("strokes", 0) + batch["strokes"]
+    for low, high in (("x_min", "x_max"), ("y_min", "y_max"), ("t_start", "t_end")):
+        if low in batch:
+            merged[low] = min(summary[low], batch[low]) if low in summary else batch[low]
+            merged[high] = max(summary[high], batch[high]) if high in summary else batch[high]
+    return merged
+
+
+def session_summary(canvas_summaries):
+    """Session summary built from the summaries of all its canvases"""
+    summary = {
+        "points": sum(s["count"] for s in canvas_summaries),
+        "strokes": sum(s["strokes"] for s in canvas_summaries),
+    }
+    starts = [s["t_start"] for s in canvas_summaries if "t_start" in s]
+    ends = [s["t_end"] for s in canvas_summaries if "t_end" in s]
+    if starts:
+        summary["t_start"] = min(starts)
+        summary["t_end"] = max(ends)
+    return summary
+
+
+def _timestamp(point):
+    timestamp = point.get("timestamp")
+    return np.nan if timestamp is None else timestamp
+
+
+def summary_update(canvas, summary):
+    """Update document folding a batch summary into the session and canvas summaries"""
+    prefix = f"canvases.{canvas}.summary"
+    update = {
+        "$inc": {
+            f"{prefix}.count": summary["count"],
+            f"{prefix}.strokes": summary["strokes"],
+            "summary.points": summary["count"],
+            "summary.strokes": summary["strokes"],
+        },
+        "$min": {
+            f"{prefix}.x_min": summary["x_min"],
+            f"{prefix}.y_min": summary["y_min"],
+        },
+        "$max": {
+            f"{prefix}.x_max": summary["x_max"],
+            f"{prefix}.y_max": summary["y_max"],
+        },
+    }
+    if "t_start" in summary:
+        update["$min"][f"{prefix}.t_start"] = summary["t_start"]
+        update["$min"]["summary.t_start"] = summary["t_start"]
+        update["$max"][f"{prefix}.t_end"] = summary["t_end"]
+        update["$max"]["summary.t_end"] = summary["t_end"]
+    return update
+
+
+def bucket_bounds(points):
+    """Extent of the points of one bucket (no t_start/t_end if they have no timestamps)"""
+    xs = [point["x"] for point in points]
+    ys = [point["y"] for point in points]
+    ts = [point["timestamp"] for point in points if point.get("timestamp") is not None]
+    bounds = {"x_min": min(xs), "x_max": max(xs), "y_min": min(ys), "y_max": max(ys)}
+    if ts:
+        bounds["t_start"] = min(ts)
+        bounds["t_end"] = max(ts)
+    return bounds
+
+
+def chunk(points, size=BUCKET_SIZE):
+    """Split a list of points into lists of at most size points"""
+    return [points[i:i + size] for i in range(0, len(points), size)]
+
+
+def bucket_parts(count, n, size=BUCKET_SIZE):
+    """Lengths of the parts n points appended after a bucket holding count points are split into"""
+    parts = []
+    while n > 0:
+        if count >= size:
+            count = 0
+        length = min(n, size - count)
+        parts.append(length)
+        count += length
+        n -= length
+    return parts
+
+
+def bucket_updates(session_id, canvas, seq, count, points, size=BUCKET_SIZE):
+    """
+    Build the upserts that append points after bucket (seq, count)
+    Returns the operations and the new (seq, count) of the last bucket
+    """
+    operations = []
+    start = 0
+    for length in bucket_parts(count, len(points), size):
+        if count >= size:
+            seq += 1
+            count = 0
+        part = points[start:start + length]
+        bounds = bucket_bounds(part)
+        low = {"x_min": bounds["x_min"], "y_min": bounds["y_min"]}
+        high = {"x_max": bounds["x_max"], "y_max": bounds["y_max"]}
+        if "t_start" in bounds:
+            low["t_start"] = bounds["t_start"]
+            high["t_end"] = bounds["t_end"]
+        operations.append(UpdateOne(
+            {"session_id": session_id, "canvas": canvas, "seq": seq},
+            {
+                "$push": {"points": {"$each": part}},
+                "$inc": {"count": len(part)},
+                "$min": low,
+                "$max": high,
+            },
+            upsert=True
+        ))
+        count += len(part)
+        start += len(part)
+    return operations, seq, count
+
+
+def iter_canvas_buckets(points_collection, session_id, canvas):
+    """Yield the point lists of a canvas one bucket at a time, in order"""
+    cursor = points_collection.find(
+        {"session_id": session_id, "canvas": canvas},
+        {"_id": 0, "points": 1}
+    ).sort("seq", ASCENDING)
+    for bucket in cursor:
+        yield bucket["points"]
+
+
+def canvas_point_count(points_collection, session_id, canvas):
+    """Number of points stored for a canvas, read from the bucket counters only"""
+    result = list(points_collection.aggregate([
+        {"$match": {"session_id": session_id, "canvas": canvas}},
+        {"$group": {"_id": None, "count": {"$sum": "$count"}}},
+    ]))
+    return result[0]["count"] if result else 0
+
+
+def list_sessions(sessions_collection, after=None, limit=SESSION_PAGE_SIZE):
+    """
+    One page of session summaries (_id, timestamp, canvas_count) in creation order
+    after: _id of the last session of the previous page
+    """
+    match = {} if after is None else {"_id": {"$gt": after}}
+    return list(sessions_collection.aggregate([
+        {"$match": match},
+        {"$sort": {"_id": ASCENDING}},
+        {"$limit": limit},
+        {"$project": {
+            "timestamp": 1,
+            "summary": 1,
+            "canvas_count": {"$size": {"$ifNull": ["$canvases", []]}},
+        }},
+    ]))
+
+
+def session_canvases(sessions_collection, session_id):
+    """
+    Canvas metadata of a session without its coordinates
+    "embedded" is the number of coordinates still stored in the session
+    document, None for canvases whose points live in buckets
+    """
+    result = list(sessions_collection.aggregate([
+        {"$match": {"_id": session_id}},
+        {"$project": {"_id": 0, "canvases": {"$map": {
+            "input": {"$ifNull": ["$canvases", []]},
+            "as": "canvas",
+            "in": {
+                "timestamp": "$$canvas.timestamp",
+                "device": "$$canvas.device",
+                "summary": "$$canvas.summary",
+                "embedded": {"$cond": [
+                    {"$isArray": "$$canvas.coordinates"},
+                    {"$size": "$$canvas.coordinates"},
+                    None,
+                ]},
+            },
+        }}}},
+    ]))
+    return result[0]["canvases"] if result else []
+
+
+def iter_embedded_points(sessions_collection, session_id, canvas, count, size=BUCKET_SIZE):
+    """Yield the coordinates embedded in a session document size points at a time"""
+    for start in range(0, count, size):
+        result = list(sessions_collection.aggregate([
+            {"$match": {"_id": session_id}},
+            {"$project": {"_id": 0, "points": {"$let": {
+                "vars": {"canvas": {"$arrayElemAt": ["$canvases", canvas]}},
+                "in": {"$slice": ["$$canvas.coordinates", start, size]},
+            }}}},
+        ]))
+        if not result or not result[0].get("points"):
+            return
+        yield result[0]["points"]
+
+
+def iter_canvas_chunks(sessions_collection, points_collection, session_id, canvas, embedded=None):
+    """
+    Yield the points of a canvas in chunks, wherever they are stored
+    embedded: Coordinate count from session_canvases, None to read the buckets
+    """
+    if embedded is None:
+        return iter_canvas_buckets(points_collection, session_id, canvas)
+    return iter_embedded_points(sessions_collection, session_id, canvas, embedded)
+
+
+def load_canvas_points(points_collection, session_id, canvas):
+    """Return all points of a canvas as a single list"""
+    points = []
+    for bucket_points in iter_canvas_buckets(points_collection, session_id, canvas):
+        points.extend(bucket_points)
+    return points
+
+
+def migrate_session(sessions_collection, points_collection, session, size=BUCKET_SIZE):
+    """
+    Move the embedded coordinates of one session into buckets
+    Safe to re-run: buckets of a canvas are rebuilt before its array is removed
+    Returns the number of points moved
+    """
+    moved = 0
+    unset = {}
+    summaries = {}
+    for canvas, canvas_doc in enumerate(session.get("canvases", [])):
+        if "coordinates" not in canvas_doc:
+            if "summary" in canvas_doc:
+                summaries[canvas] = canvas_doc["summary"]
+            continue
+        points = canvas_doc["coordinates"]
+        points_collection.delete_many({"session_id": session["_id"], "canvas": canvas})
+        buckets = [
+            {"session_id": session["_id"], "canvas": canvas, "seq": seq,
+             "count": len(part), "points": part, **bucket_bounds(part)}
+            for seq, part in enumerate(chunk(points, size))
+        ]
+        if buckets:
+            points_collection.insert_many(buckets)
+        unset[f"canvases.{canvas}.coordinates"] = ""
+        summaries[canvas] = summarize_points(points)[0] if points else empty_summary()
+        moved += len(points)
+
+    if unset:
+        # Summaries of migrated canvases, and of the session from all canvas summaries
+        update = {f"canvases.{canvas}.summary": summaries[canvas]
+                  for canvas in summaries if f"canvases.{canvas}.coordinates" in unset}
+        update["summary"] = session_summary(list(summaries.values()))
+        sessions_collection.update_one({"_id": session["_id"]}, {"$unset": unset, "$set": update})
+    return moved
+
+
+def migrate_embedded_canvases(sessions_collection, points_collection, size=BUCKET_SIZE):
+    """Migrate every session that still embeds coordinates in its canvases"""
+    ensure_indexes(points_collection, sessions_collection)
+    sessions = sessions_collection.find({"canvases.coordinates": {"$exists": True}})
+    migrated = 0
+    moved = 0
+    for session in sessions:
+        moved += migrate_session(sessions_collection, points_collection, session, size)
+        migrated += 1
+    return migrated, moved
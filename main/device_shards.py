@@ -0,0 +1,130 @@
+# device_shards.py
+# Runs per-device MotionProcessor state in a pool of worker processes.
+# Each device is pinned to one shard by a consistent hash, so its samples are
+# always processed in order by the same process while different pens run on
+# different cores.
+import bisect
+import multiprocessing
+import threading
+import zlib
+from accel_to_draw import MotionProcessor
+
+
+class HashRing:
+    def __init__(self, nodes, replicas=64):
+        """
+        Consistent hash ring
+        nodes: Shard identifiers
+        replicas: Virtual points per node, evens out the distribution
+        """
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._keys = [key for key, _ in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        return zlib.crc32(value.encode())
+
+    def node_for(self, key):
+        """Return the node that owns key"""
+        index = bisect.bisect(self._keys, self._hash(key)) % len(self._keys)
+        return self._ring[index][1]
+
+
+def _shard_main(inbox, outbox, window_size):
+    """Worker process: keeps one MotionProcessor per device it owns"""
+    processors = {}
+    while True:
+        batch = inbox.get()
+        if batch is None:
+            break
+        results = []
+        for device, start, samples in batch:
+            processor = processors.get(device)
+            if processor is None:
+                processor = MotionProcessor(window_size=window_size)
+                processors[device] = processor
+            if samples is None:
+                # Reset request for this device, acknowledged in order with its results
+                processor.reset()
+                results.append((device, start, None))
+                continue
+            results.append((device, start, processor.process_batch(samples)))
+        outbox.put(results)
+
+
+class ShardPool:
+    def __init__(self, result_handler, processes=None, window_size=10):
+        """
+        result_handler: Callable(list of (device, start, positions)) run on a collector thread,
+                        positions is None where a reset was submitted
+        processes: Number of worker processes (defaults to the CPU count)
+        window_size: Passed to every MotionProcessor
+        """
+        self.processes = processes or multiprocessing.cpu_count()
+        self.result_handler = result_handler
+        self.ring = HashRing(range(self.processes))
+        self._outbox = multiprocessing.Queue()
+        self._inboxes = []
+        self._workers = []
+        for shard in range(self.processes):
+            inbox = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=_shard_main,
+                args=(inbox, self._outbox, window_size),
+                name=f"motion-shard-{shard}",
+                daemon=True
+            )
+            worker.start()
+            self._inboxes.append(inbox)
+            self._workers.append(worker)
+
+        self._shard_of = {}
+        self._collector = threading.Thread(target=self._collect, name="shard-collector", daemon=True)
+        self._collector.start()
+
+    def shard_for(self, device):
+        shard = self._shard_of.get(device)
+        if shard is None:
+            shard = self.ring.node_for(device)
+            self._shard_of[device] = shard
+        return shard
+
+    def submit(self, batches):
+        """
+        Send sample batches to the shards owning their devices
+        batches: List of (device, start, samples) where samples is an (n, 7)
+                 process_batch array starting at sequence number start, or
+                 None to reset that device
+        """
+        per_shard = {}
+        for device, start, samples in batches:
+            per_shard.setdefault(self.shard_for(device), []).append((device, start, samples))
+        for shard, batch in per_shard.items():
+            self._inboxes[shard].put(batch)
+
+    def _collect(self):
+        finished = 0
+        while finished < self.processes:
+            results = self._outbox.get()
+            if results is None:
+                finished += 1
+                continue
+            try:
+                self.result_handler(results)
+            except Exception as e:
+                print(f"Error handling shard results: {e}")
+
+    def close(self):
+        """Let every shard finish its queued samples, then stop the pool"""
+        for inbox in self._inboxes:
+            inbox.put(None)
+        for worker in self._workers:
+            worker.join()
+        # Workers are done, unblock the collector once per shard
+        for _ in self._workers:
+            self._outbox.put(None)
+        self._collector.join()
@@ -0,0 +1,212 @@
+# fake_mqtt.py
+# In-memory stand-in for the Solace broker and the parts of the paho client
+# MQTTHandler uses, so the pipeline can run without a network or credentials.
+#
+#   broker = FakeBroker()
+#   handler = MQTTHandler(..., client_factory=broker.client)
+#   pen = broker.client()
+#   pen.publish("coordinates/pen1", payload)
+#
+# Like paho, every client delivers its messages, acknowledgements and connect
+# callback on its own loop thread, started by loop_start(). Delivery is in order per
+# client and lossless; a slow on_message backs messages up in the client's
+# inbox, which stands in for the socket buffer.
+import itertools
+import queue
+import threading
+import time
+
+MQTT_ERR_SUCCESS = 0
+MQTT_ERR_NO_CONN = 4
+
+# Stops a client's loop thread
+_STOP = object()
+
+
+def topic_matches(pattern, topic):
+    """Return True if topic matches a subscription pattern with + and # wildcards"""
+    pattern_levels = pattern.split('/')
+    topic_levels = topic.split('/')
+    for i, level in enumerate(pattern_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels) or (level != '+' and level != topic_levels[i]):
+            return False
+    return len(pattern_levels) == len(topic_levels)
+
+
+class FakeMessage:
+    """The attributes of paho's MQTTMessage"""
+
+    def __init__(self, topic, payload, qos=0, retain=False, mid=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.mid = mid
+        self.timestamp = time.monotonic()
+
+
+class FakeMessageInfo:
+    """The attributes of paho's MQTTMessageInfo; publishing never waits"""
+
+    def __init__(self, mid, rc=MQTT_ERR_SUCCESS):
+        self.mid = mid
+        self.rc = rc
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+    def is_published(self):
+        return self.rc == MQTT_ERR_SUCCESS
+
+
+class FakeBroker:
+    def __init__(self):
+        """Routes published messages to the subscribed clients"""
+        self._lock = threading.Lock()
+        self._subscribed = threading.Condition(self._lock)
+        # (pattern, client) pairs in subscription order
+        self._subscriptions = []
+        self._mids = itertools.count(1)
+
+        self.published = 0
+        self.delivered = 0
+
+    def client(self, *args, **kwargs):
+        """Create a client connected to this broker; accepts paho's Client arguments"""
+        return FakeClient(self)
+
+    def subscribe(self, client, pattern):
+        with self._lock:
+            if (pattern, client) not in self._subscriptions:
+                self._subscriptions.append((pattern, client))
+                self._subscribed.notify_all()
+
+    def wait_for_subscriber(self, topic, timeout=None):
+        """Block until some client subscribed to topic; False on timeout"""
+        with self._lock:
+            return self._subscribed.wait_for(
+                lambda: any(topic_matches(p, topic) for p, _ in self._subscriptions), timeout
+            )
+
+    def unsubscribe(self, client, pattern=None):
+        with self._lock:
+            self._subscriptions = [
+                (p, c) for p, c in self._subscriptions
+                if c is not client or (pattern is not None and p != pattern)
+            ]
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """Deliver a message to every matching subscriber and return its mid"""
+        mid = next(self._mids)
+        with self._lock:
+            clients = {c for p, c in self._subscriptions if topic_matches(p, topic)}
+            self.published += 1
+            self.delivered += len(clients)
+        for client in clients:
+            client._deliver(FakeMessage(topic, payload, qos, retain, mid))
+        return mid
+
+    def stats(self):
+        with self._lock:
+            return {'published': self.published, 'delivered': self.delivered}
+
+
+class FakeClient:
+    def __init__(self, broker):
+        """Client with paho's callback API (VERSION2) talking to a FakeBroker"""
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+        self.on_publish = None
+        self.on_disconnect = None
+        self._userdata = None
+        self._inbox = queue.SimpleQueue()
+        self._thread = None
+        self.connected = False
+
+    def user_data_set(self, userdata):
+        self._userdata = userdata
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def tls_set(self, *args, **kwargs):
+        pass
+
+    def max_inflight_messages_set(self, inflight):
+        pass
+
+    def connect(self, host='localhost', port=1883, keepalive=60):
+        """Connect at once; on_connect runs on the loop thread like paho's CONNACK"""
+        self.connected = True
+        self._inbox.put(self._connected)
+        return MQTT_ERR_SUCCESS
+
+    def _connected(self):
+        if self.on_connect:
+            self.on_connect(self, self._userdata, {}, 0, None)
+
+    def disconnect(self):
+        self.broker.unsubscribe(self)
+        self.connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, self._userdata, {}, 0, None)
+        return MQTT_ERR_SUCCESS
+
+    def subscribe(self, topic, qos=0):
+        """Subscribe to a pattern or a list of (pattern, qos) pairs"""
+        if not self.connected:
+            return MQTT_ERR_NO_CONN, None
+        patterns = [topic] if isinstance(topic, str) else [pattern for pattern, _ in topic]
+        for pattern in patterns:
+            self.broker.subscribe(self, pattern)
+        return MQTT_ERR_SUCCESS, None
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        if not self.connected:
+            return FakeMessageInfo(0, MQTT_ERR_NO_CONN)
+        if isinstance(payload, str):
+            payload = payload.encode()
+        elif payload is None:
+            payload = b''
+        mid = self.broker.publish(topic, payload, qos, retain)
+        if self.on_publish:
+            # The broker's acknowledgement, delivered on the loop thread
+            self._inbox.put(lambda: self.on_publish(self, self._userdata, mid, 0, None))
+        return FakeMessageInfo(mid)
+
+    def _deliver(self, message):
+        self._inbox.put(message)
+
+    def pending(self):
+        """Messages delivered to this client but not handed to on_message yet"""
+        return self._inbox.qsize()
+
+    def loop_start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return MQTT_ERR_SUCCESS
+
+    def loop_stop(self):
+        """Stop the loop thread after the messages already delivered"""
+        if self._thread is not None:
+            self._inbox.put(_STOP)
+            self._thread.join()
+            self._thread = None
+        return MQTT_ERR_SUCCESS
+
+    def _loop(self):
+        while True:
+            item = self._inbox.get()
+            if item is _STOP:
+                break
+            if callable(item):
+                item()
+            elif self.on_message:
+                try:
+                    self.on_message(self, self._userdata, item)
+                except Exception as e:
+                    print(f"Error in on_message: {e}")
@@ -0,0 +1,104 @@
+# frames.py
+# Compact binary sensor frames carrying several samples per MQTT message.
+#
+# Layout (little-endian):
+#   header  magic "LP" | version u8 | flags u8 | device_id u32 | seq u32 |
+#           base_timestamp u32 (ms) | count u16                       18 bytes
+#   sample  dt u16 (ms after base_timestamp) | ax ay az gx gy gz i16  16 bytes
+#
+# A 10-sample frame is 158 bytes where the same samples as JSON are ~1 KB.
+# Legacy JSON payloads start with "{", so the magic tells the two apart.
+import struct
+import numpy as np
+from decoder import DecodeError, RESET
+from sample_ring import SAMPLE_COLUMNS
+
+FRAME_MAGIC = b'LP'
+FRAME_VERSION = 1
+FLAG_RESET = 0x01
+
+HEADER = struct.Struct('<2sBBIIIH')
+SAMPLE_DTYPE = np.dtype([
+    ('dt', '<u2'),
+    ('ax', '<i2'), ('ay', '<i2'), ('az', '<i2'),
+    ('gx', '<i2'), ('gy', '<i2'), ('gz', '<i2'),
+])
+MAX_SAMPLES = 0xFFFF
+
+
+def is_frame(payload):
+    """True if payload is a binary frame rather than legacy JSON"""
+    return payload[:2] == FRAME_MAGIC
+
+
+def encode_frame(device_id, seq, samples, reset=False):
+    """
+    Pack samples into a frame
+    device_id: Numeric device id (u32)
+    seq: Frame sequence number (u32, wraps)
+    samples: (n, 7) array-like of (ax, ay, az, gx, gy, gz, timestamp_ms) rows
+    reset: Mark the frame as a canvas reset signal
+    """
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, SAMPLE_COLUMNS)
+    count = len(samples)
+    if count > MAX_SAMPLES:
+        raise ValueError(f"A frame holds at most {MAX_SAMPLES} samples, got {count}")
+    base = int(samples[0, 6]) if count else 0
+    records = np.empty(count, dtype=SAMPLE_DTYPE)
+    dt = samples[:, 6] - base
+    if count and (dt.min() < 0 or dt.max() > 0xFFFF):
+        raise ValueError("Sample timestamps must lie within 65535 ms after the first sample")
+    records['dt'] = dt
+    for column, name in enumerate(('ax', 'ay', 'az', 'gx', 'gy', 'gz')):
+        records[name] = np.clip(np.rint(samples[:, column]), -32768, 32767)
+    header = HEADER.pack(
+        FRAME_MAGIC, FRAME_VERSION, FLAG_RESET if reset else 0,
+        device_id & 0xFFFFFFFF, seq & 0xFFFFFFFF, base & 0xFFFFFFFF, count
+    )
+    return header + records.tobytes()
+
+
+def parse_header(payload):
+    """Return (version, flags, device_id, seq, base_timestamp, count)"""
+    if len(payload) < HEADER.size:
+        raise DecodeError(f"Frame shorter than its {HEADER.size} byte header")
+    magic, version, flags, device_id, seq, base, count = HEADER.unpack_from(payload)
+    if magic != FRAME_MAGIC:
+        raise DecodeError("Not a binary sensor frame")
+    if version != FRAME_VERSION:
+        raise DecodeError(f"Unsupported frame version {version}")
+    if len(payload) != HEADER.size + count * SAMPLE_DTYPE.itemsize:
+        raise DecodeError(f"Frame length {len(payload)} does not match {count} samples")
+    return version, flags, device_id, seq, base, count
+
+
+class FrameDecoder:
+    """Decodes the frames of one device and counts frames lost in transit"""
+
+    def __init__(self):
+        self.frames = 0
+        self.lost = 0
+        self.last_seq = None
+
+    def decode_into(self, payload, ring):
+        """
+        Write the samples of a frame into ring without an intermediate copy
+        Returns the sequence number of the first sample, or RESET
+        """
+        version, flags, device_id, seq, base, count = parse_header(payload)
+        if self.last_seq is not None:
+            gap = (seq - self.last_seq) & 0xFFFFFFFF
+            # Ignore duplicates and reordering, count skipped sequence numbers
+            if 0 < gap < 0x80000000:
+                self.lost += gap - 1
+        self.last_seq = seq
+        self.frames += 1
+        if flags & FLAG_RESET:
+            return RESET
+
+        records = np.frombuffer(payload, dtype=SAMPLE_DTYPE, count=count, offset=HEADER.size)
+        return ring.extend((
+            records['ax'], records['ay'], records['az'],
+            records['gx'], records['gy'], records['gz'],
+            records['dt'] + float(base),
+        ))
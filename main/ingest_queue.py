@@ -0,0 +1,225 @@
+# ingest_queue.py
+import threading
+import time
+from collections import deque
+
+# What put() does when the queue is full
+OVERFLOW_BLOCK = 'block'              # wait for the worker to make room
+OVERFLOW_DROP_OLDEST = 'drop-oldest'  # discard the oldest queued item
+OVERFLOW_COALESCE = 'coalesce'        # overwrite the newest queued item of the same stream
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_COALESCE)
+
+
+class StageTimer:
+    """Accumulates call count, total and worst duration per named stage"""
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, elapsed):
+        with self._lock:
+            entry = self._stages.get(stage)
+            if entry is None:
+                self._stages[stage] = [1, elapsed, elapsed]
+            else:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed > entry[2]:
+                    entry[2] = elapsed
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                stage: {
+                    'count': count,
+                    'total_ms': total * 1000,
+                    'mean_ms': total * 1000 / count,
+                    'max_ms': worst * 1000,
+                }
+                for stage, (count, total, worst) in self._stages.items()
+            }
+
+
+class IngestQueue:
+    def __init__(self, handler, maxsize=10000, policy=OVERFLOW_BLOCK, batch_size=100, key=None,
+                 coalescable=None):
+        """
+        Bounded queue drained in batches by a dedicated worker thread
+        handler: Callable(list_of_items) run on the worker thread for each batch
+        maxsize: Maximum number of queued items
+        policy: One of OVERFLOW_POLICIES, applied when the queue is full
+        batch_size: Maximum number of items handed to handler at once
+        key: Callable(item) returning the stream (e.g. pen) an item belongs to, so
+             'coalesce' never overwrites another stream's item (None: one stream)
+        coalescable: Callable(item) returning False for items 'coalesce' must neither
+                     overwrite nor be overwritten (e.g. resets); when the queue is
+                     full they wait for room like 'block' (None: every item)
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy {policy!r}, expected one of {OVERFLOW_POLICIES}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.policy = policy
+        self.batch_size = batch_size
+        self.key = key
+        self.coalescable = coalescable
+
+        self._items = deque()
+        # Items ever removed from the front, turns positions into deque indexes
+        self._removed = 0
+        # stream key -> position of its newest queued item if that item may be
+        # overwritten (coalesce policy only)
+        self._newest = {}
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._busy = False
+        self._running = False
+        self._stopped = False
+        self._thread = None
+
+        # Counters
+        self.enqueued = 0
+        self.processed = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.timer = StageTimer()
+
+    def put(self, item):
+        """
+        Queue an item; called from the network thread so it must stay cheap
+        Returns False if the item was dropped: the queue was stopped, or it is
+        full and blocking cannot help because no worker is running
+        """
+        with self._lock:
+            if self._stopped:
+                self.dropped += 1
+                return False
+            coalesce = self.policy == OVERFLOW_COALESCE
+            if coalesce:
+                key = self.key(item) if self.key else None
+                replaceable = self.coalescable is None or self.coalescable(item)
+            if len(self._items) >= self.maxsize:
+                if self.policy == OVERFLOW_BLOCK or (coalesce and not replaceable):
+                    if not self._wait_for_room():
+                        self.dropped += 1
+                        return False
+                elif self.policy == OVERFLOW_DROP_OLDEST:
+                    self._items.popleft()
+                    self._removed += 1
+                    self.dropped += 1
+                else:
+                    position = self._newest.get(key)
+                    if position is None or position < self._removed:
+                        # Nothing of this stream may be overwritten, keep the queued items
+                        self.dropped += 1
+                        return False
+                    self._items[position - self._removed] = item
+                    self.coalesced += 1
+                    self.enqueued += 1
+                    return True
+            if coalesce:
+                if replaceable:
+                    self._newest[key] = self._removed + len(self._items)
+                else:
+                    # Later items must not overwrite anything queued before this one
+                    self._newest.pop(key, None)
+            self._items.append(item)
+            self.enqueued += 1
+            if len(self._items) > self.max_depth:
+                self.max_depth = len(self._items)
+            self._not_empty.notify()
+            return True
+
+    def _wait_for_room(self):
+        """Wait until the queue is not full (caller holds _lock); False if no worker makes room"""
+        while len(self._items) >= self.maxsize and self._running:
+            self._not_full.wait()
+        # Not started yet, or stopped while waiting
+        return len(self._items) < self.maxsize and not self._stopped
+
+    def _take_batch(self):
+        """Wait for items and remove up to batch_size of them (None once stopped and empty)"""
+        with self._lock:
+            while not self._items:
+                if not self._running:
+                    return None
+                self._not_empty.wait()
+            count = min(len(self._items), self.batch_size)
+            batch = [self._items.popleft() for _ in range(count)]
+            self._removed += count
+            self._busy = True
+            self._not_full.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            started = time.perf_counter()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                print(f"Error processing batch of {len(batch)} messages: {e}")
+            self.timer.record('batch', time.perf_counter() - started)
+            with self._lock:
+                self.processed += len(batch)
+                self.batches += 1
+                self._busy = False
+                self._not_full.notify_all()
+
+    def start(self):
+        """Start the worker thread"""
+        if self._thread is None:
+            self._running = True
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="ingest-worker", daemon=True)
+            self._thread.start()
+
+    def join(self, timeout=None):
+        """Wait until everything queued so far has been processed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while self._items or self._busy:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._not_full.wait(remaining)
+        return True
+
+    def stop(self):
+        """Process what is left in the queue and stop the worker; later puts are dropped"""
+        with self._lock:
+            self._running = False
+            self._stopped = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def depth(self):
+        with self._lock:
+            return len(self._items)
+
+    def stats(self):
+        """Queue depth, overflow counters and worker timings"""
+        return {
+            'depth': self.depth(),
+            'max_depth': self.max_depth,
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'batches': self.batches,
+            'policy': self.policy,
+            'timings': self.timer.stats(),
+        }
@@ -0,0 +1,306 @@
+# load_test.py
+# End-to-end load test without the Solace broker or MongoDB Atlas.
+#
+# N simulated pens publish firmware JSON samples into an in-memory broker
+# (fake_mqtt.py). A regular MQTTHandler consumes them and stores pen-down
+# points through MongoDBHandler into mongomock, or into a local mongod with
+# --mongo-uri. The pens replay the captured test data at the requested rate.
+# The report gives the sustained throughput, the loss and two latencies, both
+# measured from publish:
+#   processed  positions computed, logged and handed to MongoDBHandler
+#   stored     the point's batch written to MongoDB (includes the batching delay)
+#
+#   python load_test.py --pens 10 --rate 200 --duration 10
+#   python load_test.py --pens 20 --rate 100 --processes 4 --overflow drop-oldest
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from fake_mqtt import FakeBroker
+from ingest_queue import OVERFLOW_POLICIES, OVERFLOW_BLOCK
+from mqtt_handler import MQTTHandler, TOPIC
+from process_message import long_capture
+from sample_ring import TIMESTAMP, PEN_UP
+
+# Firmware timestamps are whole milliseconds
+MAX_RATE = 1000
+
+
+def encode_sample(row):
+    """A (ax, ay, az, gx, gy, gz, timestamp) row as a firmware JSON message"""
+    return json.dumps({
+        "timestamp": int(row[6]),
+        "accel": {"x": row[0], "y": row[1], "z": row[2]},
+        "gyro": {"x": row[3], "y": row[4], "z": row[5]},
+    }).encode()
+
+
+def pen_messages(pens, rate, duration, reset_interval=0):
+    """
+    Pre-encode every pen's messages as lists of (timestamp, payload), timestamp
+    None for reset signals. Each pen starts the capture at a different row and
+    gets its own range of timestamps, so a timestamp identifies a sample
+    """
+    count = int(rate * duration)
+    capture = long_capture(1)
+    # Resets are sent on a schedule instead of where the capture has them
+    capture = capture[capture[:, 0] != -1]
+    period = 1000 / rate
+    span = int(duration * 1000) + 1000
+    reset_every = int(reset_interval * rate)
+
+    messages = []
+    for pen in range(pens):
+        offset = pen * 97 % len(capture)
+        repeat = (offset + count) // len(capture) + 1
+        rows = np.tile(capture, (repeat, 1))[offset:offset + count]
+        rows[:, 6] = pen * span + np.round(np.arange(count) * period)
+        pen_list = []
+        for i, row in enumerate(rows.tolist()):
+            if reset_every and i and i % reset_every == 0:
+                pen_list.append((None, encode_sample([-1, -1, -1, 0, 0, 0, row[6]])))
+            pen_list.append((int(row[6]), encode_sample(row)))
+        messages.append(pen_list)
+    return messages
+
+
+class LatencyTracker:
+    def __init__(self):
+        """Publish times of samples and the latency of each one processed and stored"""
+        # timestamp -> perf_counter() when it was published
+        self.sent = {}
+        self.processed = []
+        self.stored = []
+        # Pen-down samples that MongoDBHandler should store
+        self.pen_down = 0
+        self.last_processed = None
+        self._lock = threading.Lock()
+
+    def publish(self, timestamp):
+        self.sent[timestamp] = time.perf_counter()
+
+    def on_emit(self, device, samples, positions):
+        """MQTTHandler sink: runs once the samples were processed and handed on"""
+        now = time.perf_counter()
+        sent = self.sent
+        latencies = [now - sent[t] for t in samples[:, TIMESTAMP].astype(np.int64).tolist()]
+        with self._lock:
+            self.processed.extend(latencies)
+            self.pen_down += int(np.count_nonzero(positions[:, PEN_UP] == 0))
+            self.last_processed = now
+
+    def wrap_writer(self, write_buffer):
+        """Time every batch the write buffer stores"""
+        writer = write_buffer.writer
+
+        def timed_writer(key, points):
+            writer(key, points)
+            now = time.perf_counter()
+            sent = self.sent
+            latencies = [now - sent[point["timestamp"]] for point in points]
+            with self._lock:
+                self.stored.extend(latencies)
+        write_buffer.writer = timed_writer
+
+    def processed_count(self):
+        with self._lock:
+            return len(self.processed)
+
+
+def make_store(mongo_uri=None):
+    """MongoDBHandler on a local mongod, or on mongomock"""
+    from mongodb_handler import MongoDBHandler
+    if mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(mongo_uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    return MongoDBHandler(client=client)
+
+
+def publish(broker, messages, rate, tracker):
+    """
+    Publish every pen's messages at rate per pen, pens interleaved in time
+    Returns the number of messages published and the seconds it took
+    """
+    clients = []
+    for _ in messages:
+        client = broker.client()
+        client.connect()
+        clients.append(client)
+    topics = [f"{TOPIC}/pen{pen}" for pen in range(len(messages))]
+    period = 1 / rate
+    positions = [0] * len(messages)
+    remaining = len(messages)
+    published = 0
+    started = time.perf_counter()
+    while remaining:
+        # Every pen catches up to its schedule, then sleep until the next sample is due
+        elapsed = time.perf_counter() - started
+        due_count = int(elapsed / period) + 1
+        remaining = 0
+        for pen, pen_list in enumerate(messages):
+            position = positions[pen]
+            stop = min(due_count, len(pen_list))
+            client = clients[pen]
+            topic = topics[pen]
+            while position < stop:
+                timestamp, payload = pen_list[position]
+                if timestamp is not None:
+                    tracker.publish(timestamp)
+                client.publish(topic, payload, qos=1)
+                position += 1
+            published += position - positions[pen]
+            positions[pen] = position
+            if position < len(pen_list):
+                remaining += 1
+        if remaining:
+            delay = due_count * period - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+    elapsed = time.perf_counter() - started
+    for client in clients:
+        client.disconnect()
+    return published, elapsed
+
+
+def run_load_test(pens=10, rate=100, duration=10.0, processes=0, queue_size=10000,
+                  overflow_policy=OVERFLOW_BLOCK, reset_interval=0, store=True,
+                  mongo_uri=None, log_format='csv', drain_timeout=30.0):
+    """
+    Run the pipeline under load and return the report
+    pens: Simulated pens publishing at the same time
+    rate: Samples per second published by each pen
+    duration: Seconds of publishing
+    reset_interval: Seconds between reset signals of each pen (0 sends none)
+    store: Store points through MongoDBHandler (mongomock unless mongo_uri is given)
+    drain_timeout: Seconds to wait for the pipeline to catch up after publishing
+    """
+    if not 0 < rate <= MAX_RATE:
+        raise ValueError(f"rate must be between 0 and {MAX_RATE} samples/s per pen")
+    messages = pen_messages(pens, rate, duration, reset_interval)
+    samples = sum(1 for pen_list in messages for timestamp, _ in pen_list if timestamp is not None)
+    tracker = LatencyTracker()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "config.properties")
+        with open(config_path, 'w') as f:
+            f.write("[mqtt]\nhost=localhost\nport=1883\nusername=load\npassword=load\n")
+
+        mongo_handler = make_store(mongo_uri) if store else None
+        if mongo_handler:
+            tracker.wrap_writer(mongo_handler.write_buffer)
+        broker = FakeBroker()
+        handler = MQTTHandler(
+            mongo_handler=mongo_handler, config_path=config_path, queue_size=queue_size,
+            overflow_policy=overflow_policy, verbose=False, processes=processes,
+            log_options={'log_dir': tmp, 'fmt': log_format}, client_factory=broker.client
+        )
+        handler.add_sink(tracker.on_emit)
+        handler.connect()
+        handler.start()
+        try:
+            # Messages published before the handler subscribed would be lost
+            if not broker.wait_for_subscriber(f"{TOPIC}/pen0", timeout=5):
+                raise RuntimeError("MQTTHandler did not subscribe")
+            published, publish_s = publish(broker, messages, rate, tracker)
+
+            # Wait for the pipeline to catch up before stopping it
+            deadline = time.monotonic() + drain_timeout
+            ingest = handler.ingest
+            while time.monotonic() < deadline:
+                handled = ingest.processed + ingest.dropped + ingest.coalesced
+                if handled >= published and tracker.processed_count() >= samples - ingest.dropped - ingest.coalesced:
+                    break
+                time.sleep(0.01)
+            drained = time.perf_counter()
+        finally:
+            handler.stop()
+            if mongo_handler:
+                mongo_handler.close_connection()
+        stats = handler.stats()
+
+    processed = tracker.processed_count()
+    first = min(tracker.sent.values()) if tracker.sent else drained
+    busy = (tracker.last_processed or drained) - first
+    report = {
+        'pens': pens,
+        'rate': rate,
+        'published': published,
+        'samples': samples,
+        'processed': processed,
+        'lost': samples - processed,
+        'loss': (samples - processed) / samples if samples else 0.0,
+        'offered_per_s': published / publish_s if publish_s else 0.0,
+        'sustained_per_s': processed / busy if busy > 0 else 0.0,
+        'latency_ms': {'processed': percentiles(tracker.processed)},
+        'ingest': stats['ingest'],
+    }
+    if mongo_handler:
+        report['stored'] = len(tracker.stored)
+        report['store_lost'] = tracker.pen_down - len(tracker.stored)
+        report['latency_ms']['stored'] = percentiles(tracker.stored)
+    return report
+
+
+def percentiles(latencies):
+    """p50, p99 and max of latencies in seconds, as milliseconds"""
+    if not latencies:
+        return None
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+    return {'p50': p50, 'p99': p99, 'max': max(latencies) * 1000}
+
+
+def print_report(report):
+    print(f"{report['pens']} pens at {report['rate']} samples/s: published {report['published']} "
+          f"messages ({report['offered_per_s']:,.0f}/s offered)")
+    print(f"Processed {report['processed']} of {report['samples']} samples, "
+          f"sustained {report['sustained_per_s']:,.0f} samples/s, "
+          f"lost {report['lost']} ({report['loss']:.2%})")
+    ingest = report['ingest']
+    print(f"Queue: max depth {ingest['max_depth']}, dropped {ingest['dropped']}, "
+          f"coalesced {ingest['coalesced']}")
+    if 'stored' in report:
+        print(f"Stored {report['stored']} pen-down points, {report['store_lost']} missing")
+    for stage, latency in report['latency_ms'].items():
+        if latency:
+            print(f"  {stage:9s} latency p50 {latency['p50']:8.2f} ms  p99 {latency['p99']:8.2f} ms  "
+                  f"max {latency['max']:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the ingest pipeline with simulated pens")
+    parser.add_argument('--pens', type=int, default=10)
+    parser.add_argument('--rate', type=float, default=100, help="Samples per second per pen")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds of publishing")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="Motion processing worker processes (0 processes in-thread)")
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_BLOCK)
+    parser.add_argument('--reset-interval', type=float, default=0,
+                        help="Seconds between reset signals of each pen (0 sends none)")
+    parser.add_argument('--log-format', choices=('csv', 'binary'), default='csv')
+    parser.add_argument('--no-store', action='store_true', help="Do not store points")
+    parser.add_argument('--mongo-uri',
+                        help="Store in this MongoDB (e.g. a local mongod) instead of mongomock")
+    parser.add_argument('--output', help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = run_load_test(
+        pens=args.pens, rate=args.rate, duration=args.duration, processes=args.processes,
+        queue_size=args.queue_size, overflow_policy=args.overflow,
+        reset_interval=args.reset_interval, store=not args.no_store,
+        mongo_uri=args.mongo_uri, log_format=args.log_format,
+    )
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
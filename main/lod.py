@@ -0,0 +1,151 @@
+# lod.py
+# Level-of-detail decimation for drawn paths.
+#
+# A path never needs more vertices than the pixels it crosses: of every run of
+# consecutive points that fall into the same pixel cell only the first and the
+# last are kept. The cell size follows the current axes extent and DPI, so the
+# result is indistinguishable on screen while the vertex count stays bounded
+# by the length of the path in pixels instead of the number of samples.
+import numpy as np
+
+
+def pixel_size(ax):
+    """Data units per display pixel along x and y for the current view of ax"""
+    x_min, x_max = ax.get_xlim()
+    y_min, y_max = ax.get_ylim()
+    width = max(ax.bbox.width, 1.0)
+    height = max(ax.bbox.height, 1.0)
+    return abs(x_max - x_min) / width, abs(y_max - y_min) / height
+
+
+def decimate_mask(xs, ys, dx, dy, zs=None):
+    """
+    Boolean mask of the points to draw
+    dx, dy: Cell size in data units (e.g. from pixel_size)
+    zs: Optional pen flags, points where the flag changes are always kept
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    keep = np.ones(n, dtype=bool)
+    if n <= 2 or dx <= 0 or dy <= 0:
+        return keep
+    cx = np.floor(xs / dx)
+    cy = np.floor(ys / dy)
+    # change[i]: point i + 1 lies in a different cell than point i
+    change = (cx[1:] != cx[:-1]) | (cy[1:] != cy[:-1])
+    if zs is not None:
+        zs = np.asarray(zs)
+        change |= zs[1:] != zs[:-1]
+    # Keep the first and last point of every run, and both ends of the path
+    keep[1:-1] = change[:-1] | change[1:]
+    return keep
+
+
+def decimate(xs, ys, dx, dy, zs=None):
+    """Return the decimated (xs, ys) arrays"""
+    keep = decimate_mask(xs, ys, dx, dy, zs)
+    return np.asarray(xs)[keep], np.asarray(ys)[keep]
+
+
+class PathDecimator:
+    def __init__(self, tolerance=1.0, capacity=4096):
+        """
+        Keeps a growing path and its decimated vertices up to date as points are appended
+        tolerance: Cell size in pixels, larger values drop more points
+        capacity: Initial number of points allocated, doubled as needed
+        """
+        self.tolerance = tolerance
+        self.resolution = None
+        self.count = 0
+        self.kept_count = 0
+        self._x = np.empty(capacity)
+        self._y = np.empty(capacity)
+        self._z = np.empty(capacity)
+        self._kept = np.empty(capacity, dtype=np.int64)
+
+    def _reserve(self, size):
+        if size > len(self._x):
+            capacity = max(size, 2 * len(self._x))
+            for name in ('_x', '_y', '_z'):
+                grown = np.empty(capacity)
+                grown[:self.count] = getattr(self, name)[:self.count]
+                setattr(self, name, grown)
+        if size > len(self._kept):
+            grown = np.empty(max(size, 2 * len(self._kept)), dtype=np.int64)
+            grown[:self.kept_count] = self._kept[:self.kept_count]
+            self._kept = grown
+
+    def _cells(self):
+        dx, dy = self.resolution
+        return dx * self.tolerance, dy * self.tolerance
+
+    def _update_kept(self, start):
+        """
+        Decide which raw points from start on are drawn
+        Returns how many previously kept vertices are still kept
+        """
+        if self.resolution is None:
+            indices = np.arange(start, self.count)
+        else:
+            # Points before start - 1 were decided with both neighbours known; the
+            # previous last point is re-evaluated now that it has a successor
+            first = max(start - 1, 0)
+            while self.kept_count and self._kept[self.kept_count - 1] >= first:
+                self.kept_count -= 1
+            low = max(first - 1, 0)
+            mask = decimate_mask(self._x[low:self.count], self._y[low:self.count],
+                                 *self._cells(), zs=self._z[low:self.count])
+            indices = np.flatnonzero(mask) + low
+            indices = indices[indices >= first]
+        retained = self.kept_count
+        self._kept[self.kept_count:self.kept_count + len(indices)] = indices
+        self.kept_count += len(indices)
+        return retained
+
+    def extend(self, xs, ys, zs=None):
+        """
+        Append points to the path
+        Returns the position in the decimated vertices from which they changed:
+        drawing points()[position:] connects the new points to what is already drawn
+        """
+        n = len(xs)
+        if n == 0:
+            return max(self.kept_count - 1, 0)
+        start = self.count
+        self._reserve(start + n)
+        self._x[start:start + n] = xs
+        self._y[start:start + n] = ys
+        self._z[start:start + n] = 0 if zs is None else zs
+        self.count += n
+        retained = self._update_kept(start)
+        return max(retained - 1, 0)
+
+    def set_resolution(self, dx, dy):
+        """
+        Set the data units per pixel and re-decimate the whole path if they changed
+        Returns True when the decimated vertices were rebuilt
+        """
+        resolution = (float(dx), float(dy))
+        if resolution == self.resolution:
+            return False
+        self.resolution = resolution
+        self.kept_count = 0
+        self._update_kept(0)
+        return True
+
+    def points(self, start=0):
+        """Decimated (xs, ys, zs) from position start of the kept vertices"""
+        kept = self._kept[start:self.kept_count]
+        return self._x[kept], self._y[kept], self._z[kept]
+
+    def raw(self):
+        """All appended (xs, ys, zs)"""
+        return self._x[:self.count], self._y[:self.count], self._z[:self.count]
+
+    def clear(self):
+        self.count = 0
+        self.kept_count = 0
+
+    def __len__(self):
+        return self.kept_count
@@ -1,22 +1,174 @@
-import json
+import gzip
+import shutil
+import threading
+import time
 from datetime import datetime
 import os
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CSV_HEADER = (
+    "Timestamp,Raw_Accel_X,Raw_Accel_Y,Raw_Accel_Z,"
+    "Raw_Gyro_X,Raw_Gyro_Y,Raw_Gyro_Z,"
+    "Calc_Pos_X,Calc_Pos_Y,Calc_Pos_Z\n"
+)
+_ROW_FORMAT = ",".join(["%.15g"] * 10) + "\n"
+
+# Binary logs: an 8 byte magic followed by fixed 80 byte records in CSV column order
+BINARY_MAGIC = b"LPLOG01\n"
+BINARY_RECORD = np.dtype([
+    ('timestamp', '<f8'),
+    ('ax', '<f8'), ('ay', '<f8'), ('az', '<f8'),
+    ('gx', '<f8'), ('gy', '<f8'), ('gz', '<f8'),
+    ('x', '<f8'), ('y', '<f8'), ('z', '<f8'),
+])
+
+COMPRESSION_SUFFIX = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def read_binary_log(path):
+    """Memory-map a binary log as a structured array of BINARY_RECORD rows"""
+    with open(path, 'rb') as f:
+        if f.read(len(BINARY_MAGIC)) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary coordinate log")
+    return np.memmap(path, dtype=BINARY_RECORD, mode='r', offset=len(BINARY_MAGIC))
+
+
+def _compress(path, method):
+    """Compress a closed log segment next to itself and remove the original"""
+    target = path + COMPRESSION_SUFFIX[method]
+    try:
+        with open(path, 'rb') as src:
+            if method == 'gzip':
+                with gzip.open(target, 'wb', compresslevel=6) as dst:
+                    shutil.copyfileobj(src, dst)
+            else:
+                with open(target, 'wb') as dst:
+                    zstandard.ZstdCompressor(level=3).copy_stream(src, dst)
+        os.remove(path)
+    except Exception as e:
+        print(f"Error compressing log segment {path}: {e}")
+
 
 class CoordinateLogger:
-    def __init__(self, log_dir="logs"):
+    def __init__(self, log_dir="logs", name=None, fmt='csv', buffer_size=64 * 1024,
+                 flush_interval=1.0, max_bytes=None, max_age=None, compress=None):
+        """
+        log_dir: Directory the log segments are written to
+        name: Suffix for the file name (e.g. a device id)
+        fmt: 'csv' or 'binary' (fixed 80 byte records, see BINARY_RECORD)
+        buffer_size: Bytes held in memory before they are written out
+        flush_interval: Seconds after which buffered rows are written, also while no rows arrive
+        max_bytes: Start a new segment once the current one reaches this size
+        max_age: Start a new segment once the current one is this many seconds old
+                 (segments without rows are not rotated)
+        compress: None, 'gzip' or 'zstd' for closed segments
+        """
+        if fmt not in ('csv', 'binary'):
+            raise ValueError(f"Unknown log format {fmt!r}")
+        if compress not in (None, 'gzip', 'zstd'):
+            raise ValueError(f"Unknown compression {compress!r}")
+        if compress == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression needs the zstandard package")
+
         self.log_dir = log_dir
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
-        
+        self.fmt = fmt
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+
         # Create a new log file with timestamp
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = os.path.join(log_dir, f"coordinate_log_{timestamp}.txt")
-        
-        # Initialize the log file with headers
-        with open(self.log_file, 'w') as f:
-            f.write("Timestamp,Raw_Accel_X,Raw_Accel_Y,Raw_Accel_Z,")
-            f.write("Raw_Gyro_X,Raw_Gyro_Y,Raw_Gyro_Z,")
-            f.write("Calc_Pos_X,Calc_Pos_Y,Calc_Pos_Z\n")
+        suffix = f"_{name}" if name else ""
+        self._base_name = f"coordinate_log_{timestamp}{suffix}"
+        self._extension = ".txt" if fmt == 'csv' else ".bin"
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._buffer = []
+        self._buffered = 0
+        self._segment = 0
+        self._compressors = []
+        self.rows = 0
+        self._open_segment()
+
+        # Idle pens send no rows, so flushing and rotation also run on a timer
+        periods = [period for period in (flush_interval, max_age) if period]
+        self._timer = None
+        if periods:
+            self._period = min(periods)
+            self._timer = threading.Thread(target=self._run_timer, name="log-timer", daemon=True)
+            self._timer.start()
+
+    def _open_segment(self):
+        """Open the next log segment and write its header"""
+        index = f"_{self._segment:04d}" if self._segment else ""
+        self.log_file = os.path.join(self.log_dir, f"{self._base_name}{index}{self._extension}")
+        self._file = open(self.log_file, 'wb')
+        self._file.write(CSV_HEADER.encode() if self.fmt == 'csv' else BINARY_MAGIC)
+        self._segment_bytes = self._file.tell()
+        self._header_bytes = self._segment_bytes
+        self._segment_started = time.monotonic()
+        self._last_flush = self._segment_started
+
+    def _rotate(self):
+        """Close the current segment, compress it in the background and start the next"""
+        self._file.close()
+        closed = self.log_file
+        self._segment += 1
+        self._open_segment()
+        if self.compress:
+            worker = threading.Thread(target=_compress, args=(closed, self.compress), daemon=True)
+            worker.start()
+            # Only unfinished compressions are waited for in close()
+            self._compressors = [w for w in self._compressors if w.is_alive()]
+            self._compressors.append(worker)
+
+    def _write_buffer(self):
+        """Write buffered rows to the current segment (caller holds _lock)"""
+        if self._buffer:
+            data = b"".join(self._buffer)
+            self._file.write(data)
+            self._file.flush()
+            self._segment_bytes += len(data)
+            self._buffer.clear()
+            self._buffered = 0
+        self._last_flush = time.monotonic()
+
+        if self._segment_bytes > self._header_bytes and (
+                (self.max_bytes and self._segment_bytes >= self.max_bytes) or
+                (self.max_age and self._last_flush - self._segment_started >= self.max_age)):
+            self._rotate()
+
+    def _run_timer(self):
+        """Background loop writing rows older than flush_interval and rotating old segments"""
+        with self._lock:
+            while not self._file.closed:
+                self._wakeup.wait(self._period)
+                if self._file.closed:
+                    break
+                now = time.monotonic()
+                if ((self._buffer and self.flush_interval and
+                        now - self._last_flush >= self.flush_interval) or
+                        (self.max_age and now - self._segment_started >= self.max_age)):
+                    self._write_buffer()
+
+    def _append(self, data, rows):
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            self.rows += rows
+            if (self._buffered >= self.buffer_size or
+                    time.monotonic() - self._last_flush >= self.flush_interval):
+                self._write_buffer()
 
     def log_coordinates(self, raw_data, calculated_position):
         """
@@ -26,20 +178,106 @@ class CoordinateLogger:
         """
         try:
             timestamp = raw_data.get('timestamp', datetime.now().timestamp())
-            
-            log_entry = (
-                f"{timestamp},"
-                f"{raw_data['accel']['x']},{raw_data['accel']['y']},{raw_data['accel']['z']},"
-                f"{raw_data['gyro']['x']},{raw_data['gyro']['y']},{raw_data['gyro']['z']},"
-                f"{calculated_position[0]},{calculated_position[1]},{calculated_position[2]}\n"
+            row = (
+                timestamp,
+                raw_data['accel']['x'], raw_data['accel']['y'], raw_data['accel']['z'],
+                raw_data['gyro']['x'], raw_data['gyro']['y'], raw_data['gyro']['z'],
+                calculated_position[0], calculated_position[1], calculated_position[2],
             )
-            
-            with open(self.log_file, 'a') as f:
-                f.write(log_entry)
-                
+            if self.fmt == 'csv':
+                self._append((_ROW_FORMAT % row).encode(), 1)
+            else:
+                self._append(np.array([row], dtype=np.float64).astype('<f8').tobytes(), 1)
+        except Exception as e:
+            print(f"Error logging coordinates: {e}")
+
+    def log_rows(self, samples, positions):
+        """
+        Log a block of samples with their positions
+        samples: (n, 7) array of (ax, ay, az, gx, gy, gz, timestamp) rows
+        positions: (n, 3) array of (x, y, z) rows
+        """
+        try:
+            n = len(samples)
+            if n == 0:
+                return
+            rows = np.column_stack((samples[:, 6], samples[:, :6], positions))
+            if self.fmt == 'csv':
+                data = ((_ROW_FORMAT * n) % tuple(rows.ravel().tolist())).encode()
+            else:
+                data = rows.astype('<f8', copy=False).tobytes()
+            self._append(data, n)
         except Exception as e:
             print(f"Error logging coordinates: {e}")
 
+    def flush(self):
+        """Write buffered rows now"""
+        with self._lock:
+            self._write_buffer()
+
+    def close(self):
+        """Write buffered rows, close the log and wait for pending compression"""
+        with self._lock:
+            if self._file.closed:
+                return
+            self._write_buffer()
+            self._file.close()
+            self._wakeup.notify()
+            if self.compress:
+                self._compressors.append(threading.Thread(
+                    target=_compress, args=(self.log_file, self.compress), daemon=True))
+                self._compressors[-1].start()
+        if self._timer is not None:
+            self._timer.join()
+            self._timer = None
+        for worker in self._compressors:
+            worker.join()
+        self._compressors.clear()
+
     def get_log_file_path(self):
         """Return the path to the current log file"""
-        return self.log_file
\ No newline at end of file
+        return self.log_file
+
+
+def benchmark(count=20000, block=100):
+    """Logging cost per sample: per-sample open/append/close versus the buffered logger"""
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-20000, 20000, size=(count, 7)).astype(np.float64)
+    samples[:, 6] = np.arange(count) * 10
+    positions = rng.normal(size=(count, 3)) * 100
+    results = {}
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        # What every message used to cost
+        path = os.path.join(log_dir, "previous.txt")
+        rows = samples.tolist()
+        started = time.perf_counter()
+        for sample, position in zip(rows, positions.tolist()):
+            with open(path, 'a') as f:
+                f.write(
+                    f"{sample[6]},"
+                    f"{sample[0]},{sample[1]},{sample[2]},"
+                    f"{sample[3]},{sample[4]},{sample[5]},"
+                    f"{position[0]},{position[1]},{position[2]}\n"
+                )
+        results['previous (open/append per sample)'] = (time.perf_counter() - started) / count
+
+        for fmt, compress in (('csv', None), ('binary', None), ('csv', 'gzip')):
+            logger = CoordinateLogger(log_dir, name=f"{fmt}_{compress}", fmt=fmt,
+                                      max_bytes=256 * 1024, compress=compress)
+            started = time.perf_counter()
+            for start in range(0, count, block):
+                logger.log_rows(samples[start:start + block], positions[start:start + block])
+            logger.close()
+            label = f"buffered {fmt}" + (f" + {compress}" if compress else "")
+            results[label] = (time.perf_counter() - started) / count
+    return results
+
+
+if __name__ == "__main__":
+    results = benchmark()
+    baseline = next(iter(results.values()))
+    for name, per_sample in results.items():
+        print(f"{name:36s} {per_sample * 1e6:7.2f} us/sample  {baseline / per_sample:6.1f}x")
@@ -1,13 +1,81 @@
+# main.py
+# Runs the ingest pipeline: MQTT -> motion processing -> logs and MongoDB.
+#
+#   python main.py              live plot of the first pen that publishes
+#   python main.py --headless   no plot and no matplotlib import, for servers;
+#                               runs until SIGINT/SIGTERM, then drains its buffers
+import argparse
+import signal
+import threading
 from mqtt_handler import MQTTHandler
 from mongodb_handler import MongoDBHandler
-from plotter import Plotter
+from ingest_queue import OVERFLOW_POLICIES, OVERFLOW_BLOCK
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Receive pen data over MQTT, store and plot it")
+    parser.add_argument('--headless', action='store_true',
+                        help="Do not plot; run until SIGINT or SIGTERM (implies --quiet)")
+    parser.add_argument('--config', default='config.properties')
+    parser.add_argument('--processes', type=int, default=0,
+                        help="Motion processing worker processes (0 processes in-thread)")
+    parser.add_argument('--plot-device', help="Pen shown by the plotter (default: the first one seen)")
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--overflow', choices=OVERFLOW_POLICIES, default=OVERFLOW_BLOCK,
+                        help="What to do with new payloads when the queue is full")
+    parser.add_argument('--log-format', choices=('csv', 'binary'), default='csv')
+    parser.add_argument('--quiet', action='store_true', help="Do not print every received sample")
+    parser.add_argument('--stats-interval', type=float, default=30.0,
+                        help="Seconds between status lines in headless mode (0 disables them)")
+    return parser.parse_args(argv)
+
+def print_status(mqtt_handler):
+    stats = mqtt_handler.stats()
+    ingest = stats['ingest']
+    line = (f"Processed {ingest['processed']} messages, queue depth {ingest['depth']}, "
+            f"dropped {ingest['dropped']}")
+    if 'store' in stats:
+        line += f", {stats['store']['points_written']} points written"
+    print(line)
+
+def run_headless(mqtt_handler, stats_interval):
+    """Block until SIGINT or SIGTERM"""
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"\nReceived {signal.Signals(signum).name}, shutting down...")
+        stop.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+    while not stop.wait(stats_interval or None):
+        print_status(mqtt_handler)
+
+def run_with_plot(mqtt_handler, plot_device):
+    """Show the live plot; closing the window or SIGTERM stops the pipeline"""
+    # Only the interactive mode pays for matplotlib
+    from plotter import Plotter
+    plotter = Plotter()
+    mqtt_handler.attach_plotter(plotter, plot_device)
+    signal.signal(signal.SIGTERM, lambda signum, frame: plotter.close())
+    # Show the plot (this will block until the window is closed)
+    plotter.start_animation()
+
+def main(argv=None):
+    args = parse_args(argv)
+    mongo_handler = None
+    mqtt_handler = None
     try:
         # Initialize components
-        mongo_handler = MongoDBHandler()
-        plotter = Plotter()
-        mqtt_handler = MQTTHandler(mongo_handler=mongo_handler, plotter=plotter)
+        mongo_handler = MongoDBHandler(config_path=args.config)
+        mqtt_handler = MQTTHandler(
+            mongo_handler=mongo_handler,
+            config_path=args.config,
+            queue_size=args.queue_size,
+            overflow_policy=args.overflow,
+            verbose=not (args.quiet or args.headless),
+            processes=args.processes,
+            log_options={'fmt': args.log_format},
+        )
 
         # Test MongoDB connection
         if not mongo_handler.test_connection():
@@ -22,16 +90,21 @@ def main():
         # Start MQTT client
         mqtt_handler.start()
 
-        # Show the plot (this will block until the window is closed)
-        plotter.start_animation()
+        if args.headless:
+            run_headless(mqtt_handler, args.stats_interval)
+        else:
+            run_with_plot(mqtt_handler, args.plot_device)
 
     except KeyboardInterrupt:
         print("\nShutting down...")
     finally:
-        # Clean up
-        mqtt_handler.stop()
-        mongo_handler.close_connection()
+        # Stop receiving, drain the queue and write out buffered points and logs
+        if mqtt_handler:
+            mqtt_handler.stop()
+            print_status(mqtt_handler)
+        if mongo_handler:
+            mongo_handler.close_connection()
         print("Disconnected successfully")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
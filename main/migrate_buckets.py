@@ -0,0 +1,36 @@
+# migrate_buckets.py
+# Moves coordinates embedded in sessions.canvases[i].coordinates into the
+# bucketed canvas_points collection. Safe to run more than once.
+import os
+import argparse
+from canvas_points import POINTS_COLLECTION, BUCKET_SIZE, migrate_embedded_canvases
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate embedded canvas coordinates to buckets")
+    parser.add_argument('--bucket-size', type=int, default=BUCKET_SIZE,
+                        help="Points per canvas_points document")
+    args = parser.parse_args()
+
+    import certifi
+    from pymongo.mongo_client import MongoClient
+    from pymongo.server_api import ServerApi
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    client = MongoClient(
+        os.getenv("uri"),
+        server_api=ServerApi('1'),
+        tlsCAFile=certifi.where()
+    )
+    db = client['Uottahack']
+
+    try:
+        migrated, moved = migrate_embedded_canvases(
+            db['sessions'], db[POINTS_COLLECTION], args.bucket_size
+        )
+        print(f"Migrated {migrated} sessions ({moved} points)")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
@@ -3,17 +3,64 @@ from pymongo.server_api import ServerApi
 import urllib.parse
 import certifi
 import configparser
+import threading
 from datetime import datetime
 from bson import ObjectId
+from pymongo.errors import BulkWriteError
+from write_buffer import WriteBehindBuffer, PartialWrite
+from canvas_points import (POINTS_COLLECTION, BUCKET_SIZE, ensure_indexes,
+                           bucket_parts, bucket_updates, load_canvas_points, empty_summary,
+                           summarize_points, merge_summary, summary_update)
 
 class MongoDBHandler:
-    def __init__(self, config_path='config.properties'):
-        self.config = self._load_config(config_path)
-        self.client = self._setup_client()
+    def __init__(self, config_path='config.properties', batch_size=200, max_batch_age=0.5,
+                 bucket_size=BUCKET_SIZE, client=None):
+        """
+        batch_size: Number of buffered points that triggers a write
+        max_batch_age: Seconds a buffered point may wait before it is written
+        bucket_size: Number of points stored per canvas_points document
+        client: MongoClient to use instead of the one configured in config_path
+                (e.g. a mongomock client for tests)
+        """
+        if client is None:
+            self.config = self._load_config(config_path)
+            client = self._setup_client()
+        self.client = client
         self.db = self.client['Uottahack']
         self.collection = self.db['sessions']
+        self.points_collection = self.db[POINTS_COLLECTION]
+        self.bucket_size = bucket_size
         self.current_session_id = None
         self.current_canvas_id = None
+        # Canvases in the current session, so a new canvas index needs no read
+        self.canvas_count = 0
+        # device id -> canvas index, every pen draws on its own canvas
+        self.device_canvases = {}
+        # (session, canvas) -> points buffered so far, empty canvases are not rolled over
+        self._canvas_points = {}
+
+        # (session, canvas) -> (seq, count) of the bucket being filled
+        self._buckets = {}
+        # (session, canvas) -> (z, timestamp) of the last written point, for stroke counts
+        self._last_points = {}
+        # (session, canvas) whose last bucket write failed without saying what was
+        # stored (e.g. a timeout); the next write reads the bucket counts first
+        self._unsure = set()
+        # (session, canvas) -> summary of stored points whose session update failed
+        self._unsent_summaries = {}
+        self._summary_lock = threading.Lock()
+        try:
+            ensure_indexes(self.points_collection, self.collection)
+        except Exception as e:
+            # An unreachable cluster is reported by test_connection()
+            print(f"Error creating indexes: {e}")
+
+        # Points are written behind the ingest path in batches
+        self.write_buffer = WriteBehindBuffer(
+            self._write_points,
+            max_batch=batch_size,
+            max_age=max_batch_age
+        )
         self._create_new_session()
 
     def _load_config(self, config_path):
@@ -46,36 +93,89 @@ class MongoDBHandler:
         try:
             session_doc = {
                 "timestamp": datetime.now(),
-                "canvases": []
+                "canvases": [],
+                "summary": {"points": 0, "strokes": 0}
             }
             result = self.collection.insert_one(session_doc)
             self.current_session_id = result.inserted_id
+            self.canvas_count = 0
+            self.device_canvases = {}
             self._create_new_canvas()
             print(f"New session created with ID: {self.current_session_id}")
         except Exception as e:
             print(f"Error creating new session: {e}")
 
-    def _create_new_canvas(self):
-        """Create a new canvas in the current session"""
+    def _create_new_canvas(self, device=None):
+        """Create a new canvas in the current session and return its index"""
         try:
+            # Coordinates live in the canvas_points collection
             canvas = {
                 "timestamp": datetime.now(),
-                "coordinates": []
+                "summary": empty_summary()
             }
+            if device is not None:
+                canvas["device"] = device
             
-            result = self.collection.update_one(
+            self.collection.update_one(
                 {"_id": self.current_session_id},
                 {"$push": {"canvases": canvas}}
             )
             
-            # Get the index of the newly created canvas
-            session = self.collection.find_one({"_id": self.current_session_id})
-            self.current_canvas_id = len(session["canvases"]) - 1
+            # This handler is the only writer of the session, the new canvas is the last one
+            self.current_canvas_id = self.canvas_count
+            self.canvas_count += 1
+            
+            if device is not None:
+                self.device_canvases[device] = self.current_canvas_id
             
             print(f"New canvas created with index: {self.current_canvas_id}")
+            return self.current_canvas_id
         except Exception as e:
             print(f"Error creating new canvas: {e}")
 
+    def canvas_for(self, device):
+        """Return the index of the canvas a device draws on (None if none could be created)"""
+        canvas_id = self.device_canvases.get(device)
+        if canvas_id is None:
+            if self.device_canvases:
+                canvas_id = self._create_new_canvas(device)
+            elif self.current_canvas_id is not None:
+                # The first pen takes the canvas created with the session
+                canvas_id = self.current_canvas_id
+                self.device_canvases[device] = canvas_id
+                try:
+                    self.collection.update_one(
+                        {"_id": self.current_session_id},
+                        {"$set": {f"canvases.{canvas_id}.device": device}}
+                    )
+                except Exception as e:
+                    print(f"Error assigning canvas {canvas_id} to {device}: {e}")
+        return canvas_id
+
+    def rollover(self, device=None):
+        """
+        Start a new canvas for a device after a reset signal and return its index
+        Points buffered for the old canvas are written first. A canvas that got
+        no points since the last reset is kept, repeated resets add no empty canvases
+        """
+        canvas_id = self.current_canvas_id if device is None else self.device_canvases.get(device)
+        if canvas_id is None:
+            # The device has not drawn yet, its first point takes a canvas anyway
+            return None
+        key = (self.current_session_id, canvas_id)
+        if not self._canvas_points.get(key):
+            return canvas_id
+        self.write_buffer.flush(key)
+        self._canvas_points.pop(key, None)
+        if not self.write_buffer.pending(key):
+            # Points that failed to write still append after the last bucket
+            self._buckets.pop(key, None)
+            self._last_points.pop(key, None)
+            self._unsure.discard(key)
+        new_canvas = self._create_new_canvas(device)
+        # The device keeps drawing on the old canvas if no new one could be created
+        return canvas_id if new_canvas is None else new_canvas
+
     def insert_coordinates(self, x, y, z, timestamp):
         """Insert coordinates and timestamp into the collection"""
         try:
@@ -92,6 +192,141 @@ class MongoDBHandler:
             print(f"Error inserting data to MongoDB: {e}")
             return False
 
+    def add_point(self, x, y, z, timestamp, device=None):
+        """Buffer a point for the device's canvas; it is written in a later batch"""
+        canvas_id = self.current_canvas_id if device is None else self.canvas_for(device)
+        if canvas_id is None:
+            print("Error adding point: no canvas to add it to")
+            return
+        key = (self.current_session_id, canvas_id)
+        self._canvas_points[key] = self._canvas_points.get(key, 0) + 1
+        self.write_buffer.add(key, {"x": x, "y": y, "z": z, "timestamp": timestamp})
+
+    def add_points(self, xs, ys, timestamps, device=None):
+        """Buffer a block of pen-down points (z=0) for the device's canvas"""
+        canvas_id = self.current_canvas_id if device is None else self.canvas_for(device)
+        if canvas_id is None:
+            print(f"Error adding {len(xs)} points: no canvas to add them to")
+            return
+        key = (self.current_session_id, canvas_id)
+        self._canvas_points[key] = self._canvas_points.get(key, 0) + len(xs)
+        self.write_buffer.extend(
+            key,
+            [
+                {"x": x, "y": y, "z": 0, "timestamp": int(timestamp)}
+                for x, y, timestamp in zip(xs.tolist(), ys.tolist(), timestamps.tolist())
+            ]
+        )
+
+    def _write_points(self, key, points):
+        """
+        Append a batch of points to the buckets of a canvas in one round trip,
+        then fold its summary into the session document in a second one
+
+        The two collections cannot be updated atomically without a transaction,
+        which needs a replica set and costs extra round trips per batch. The points
+        are the data, so they decide whether the batch failed: the write buffer
+        retries from the first point that was not stored (PartialWrite). A failed
+        summary update does not fail the batch, which would store its points twice;
+        it is merged into the next update of the canvas or sent by flush()
+
+        A failure that does not say which buckets were updated (a timeout or a lost
+        connection) marks the canvas unsure. Its next write first reads the bucket
+        counts to find how much of the batch was stored, so nothing is appended twice
+        """
+        written = 0
+        if key in self._unsure:
+            written = self._reconcile(key, points)
+            points = points[written:]
+            if not points:
+                return
+        session_id, canvas_id = key
+        seq, count = self._buckets.get(key, (0, 0))
+        operations, last_seq, last_count = bucket_updates(
+            session_id, canvas_id, seq, count, points, self.bucket_size
+        )
+        try:
+            self.points_collection.bulk_write(operations, ordered=True)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors")
+            if not errors:
+                # Only the write concern failed, the updates may or may not stay
+                self._unsure.add(key)
+                raise PartialWrite(written, str(e))
+            # Ordered: the buckets before the failed operation were updated
+            stored = sum(bucket_parts(count, len(points), self.bucket_size)[:errors[0]["index"]])
+            if stored:
+                self._stored(key, points[:stored])
+            raise PartialWrite(written + stored, str(e))
+        except Exception as e:
+            self._unsure.add(key)
+            raise PartialWrite(written, str(e))
+        self._stored(key, points, (last_seq, last_count))
+
+    def _reconcile(self, key, points):
+        """
+        Count the points of a batch an unsure write already stored, from the bucket
+        counts, and record them. Raises if the counts cannot be read
+        """
+        session_id, canvas_id = key
+        seq, count = self._buckets.get(key, (0, 0))
+        buckets = list(self.points_collection.find(
+            {"session_id": session_id, "canvas": canvas_id, "seq": {"$gte": seq}},
+            {"_id": 0, "seq": 1, "count": 1}
+        ).sort("seq", 1))
+        self._unsure.discard(key)
+        stored = sum(bucket["count"] for bucket in buckets) - count
+        if stored <= 0:
+            return 0
+        if stored > len(points):
+            # The buffer dropped the head of the batch to stay bounded
+            print(f"Error reconciling canvas {canvas_id}: {stored} points stored, {len(points)} buffered")
+        self._stored(key, points[:stored], (buckets[-1]["seq"], buckets[-1]["count"]))
+        return min(stored, len(points))
+
+    def _stored(self, key, points, bucket=None):
+        """Record points appended to the buckets of a canvas and update its summary"""
+        if bucket is None:
+            seq, count = self._buckets.get(key, (0, 0))
+            _, seq, count = bucket_updates(key[0], key[1], seq, count, points, self.bucket_size)
+            bucket = (seq, count)
+        self._buckets[key] = bucket
+        summary, self._last_points[key] = summarize_points(points, self._last_points.get(key))
+        self._send_summary(key, summary)
+
+    def _send_summary(self, key, summary=None):
+        """Fold a summary, with any earlier one that failed to send, into the session"""
+        session_id, canvas_id = key
+        with self._summary_lock:
+            unsent = self._unsent_summaries.pop(key, None)
+        if unsent is not None:
+            summary = unsent if summary is None else merge_summary(unsent, summary)
+        if summary is None:
+            return
+        try:
+            self.collection.update_one({"_id": session_id}, summary_update(canvas_id, summary))
+        except Exception as e:
+            print(f"Error updating summary of canvas {canvas_id}: {e}")
+            with self._summary_lock:
+                newer = self._unsent_summaries.get(key)
+                self._unsent_summaries[key] = summary if newer is None else merge_summary(summary, newer)
+
+    def flush(self):
+        """Write all buffered points and summaries now"""
+        self.write_buffer.flush()
+        self._send_unsent_summaries()
+
+    def _send_unsent_summaries(self):
+        """Retry the summary updates that failed"""
+        with self._summary_lock:
+            keys = list(self._unsent_summaries)
+        for key in keys:
+            self._send_summary(key)
+
+    def write_stats(self):
+        """Batch size and flush latency counters of the write buffer"""
+        return self.write_buffer.stats()
+
     def get_current_session(self):
         """Retrieve the current session data"""
         try:
@@ -103,15 +338,25 @@ class MongoDBHandler:
     def get_current_canvas(self):
         """Retrieve the current canvas data"""
         try:
-            session = self.get_current_session()
-            if session and len(session["canvases"]) > self.current_canvas_id:
-                return session["canvases"][self.current_canvas_id]
+            self.flush()
+            session = self.collection.find_one(
+                {"_id": self.current_session_id},
+                {"canvases": {"$slice": [self.current_canvas_id, 1]}}
+            )
+            if session and session["canvases"]:
+                canvas = dict(session["canvases"][0])
+                canvas["coordinates"] = load_canvas_points(
+                    self.points_collection, self.current_session_id, self.current_canvas_id
+                )
+                return canvas
             return None
         except Exception as e:
             print(f"Error retrieving canvas: {e}")
             return None
 
     def close_connection(self):
+        self.write_buffer.close()
+        self._send_unsent_summaries()
         self.client.close()
 # from pymongo.mongo_client import MongoClient
 # from pymongo.server_api import ServerApi
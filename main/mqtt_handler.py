@@ -1,31 +1,91 @@
 # mqtt_handler.py
 import paho.mqtt.client as mqtt
-import json
+import time
 import configparser
-from accel_to_draw import MotionProcessor, IMUPoint  # Changed import
+from operator import itemgetter
+import numpy as np
+from accel_to_draw import MotionProcessor
 from logger import CoordinateLogger
+from ingest_queue import IngestQueue, OVERFLOW_BLOCK
+from device_shards import ShardPool
+from decoder import decode_into, may_be_reset, DecodeError, RESET, RESET_SENTINEL
+from frames import FrameDecoder, is_frame
+from sample_ring import SampleRing, AX, AY, AZ, GX, GY, GZ, TIMESTAMP, POS_X, POS_Y, PEN_UP
+
+# Pens publish on "coordinates/<client_id>"; the bare topic is the legacy single pen
+TOPIC = "coordinates"
+DEFAULT_DEVICE = "default"
+
+def coalescable(item):
+    """
+    True for a (topic, payload) item holding a single JSON sample; resets and
+    multi-sample binary frames must not be overwritten by the coalesce policy
+    """
+    payload = item[1]
+    return not is_frame(payload) and not may_be_reset(payload)
+
+def device_for_topic(topic):
+    """Return the device id encoded in a topic"""
+    if topic.startswith(TOPIC + "/"):
+        return topic[len(TOPIC) + 1:]
+    return DEFAULT_DEVICE
 
 class MQTTHandler:
-    def __init__(self, mongo_handler=None, plotter=None, config_path='config.properties'):
+    def __init__(self, mongo_handler=None, plotter=None, config_path='config.properties',
+                 queue_size=10000, overflow_policy=OVERFLOW_BLOCK, batch_size=100, verbose=True,
+                 processes=0, plot_device=None, ring_capacity=65536, log_options=None,
+                 client_factory=None):
         """
         Initialize MQTT Handler
         mongo_handler: Optional MongoDB handler for storing coordinates
         plotter: Optional Plotter instance for visualization
+        queue_size: Maximum number of payloads waiting for the processing worker
+        overflow_policy: 'block', 'drop-oldest' or 'coalesce' when the queue is full
+        batch_size: Maximum number of payloads the worker processes at once
+        verbose: Print every received sample
+        processes: Shard devices across this many worker processes (0 processes in-thread)
+        plot_device: Device shown by the plotter (defaults to the first one seen)
+        ring_capacity: Samples retained per device for the plotter and in-flight batches
+        log_options: Keyword arguments for every CoordinateLogger (format, rotation, compression)
+        client_factory: Callable returning a paho-compatible client, e.g. fake_mqtt.FakeBroker.client
         """
         self.config = self._load_config(config_path)
         self.mongo_handler = mongo_handler
         self.plotter = plotter
+        self.plot_device = plot_device
         self.client = None
+        self.client_factory = client_factory
+        self.verbose = verbose
+        self.processes = processes
+
+        # Payloads are processed off the network thread
+        self.ingest = IngestQueue(
+            self._process_batch,
+            maxsize=queue_size,
+            policy=overflow_policy,
+            batch_size=batch_size,
+            # Coalescing replaces a pen's newest payload, never another pen's
+            key=itemgetter(0),
+            coalescable=coalescable
+        )
+        self.timer = self.ingest.timer
         
-        # Initialize the motion processor instead of position integrator
-        self.accel_processor = MotionProcessor(window_size=10)
-        
-        # Store local sensor data
-        self.current_accel = {'x': 0, 'y': 0, 'z': 0}
-        self.current_gyro = {'x': 0, 'y': 0, 'z': 0}
+        # One motion processor per device, either here or in the shard pool
+        self.processors = {}
+        # One preallocated sample ring per device
+        self.rings = {}
+        self.ring_capacity = ring_capacity
+        # Binary frame decoders, they count lost frames per device
+        self.frame_decoders = {}
+        self.shards = None
         
-        # Add this line after other initializations
-        self.logger = CoordinateLogger()
+        # One coordinate log per device, created on first use
+        self.loggers = {}
+        self.log_options = log_options or {}
+        # device -> reset signals received
+        self.resets = {}
+        # Callables receiving every emitted block, see add_sink
+        self.sinks = []
 
     def _load_config(self, config_path):
         config = configparser.ConfigParser()
@@ -39,70 +99,235 @@ class MQTTHandler:
 
     def on_connect(self, client, userdata, flags, reason_code, properties=None):
         print(f"Connected with result code {reason_code}")
-        client.subscribe("coordinates", qos=1)
+        client.subscribe([(TOPIC, 1), (TOPIC + "/+", 1)])
 
     def on_message(self, client, userdata, message):
-        try:
-            data = json.loads(message.payload.decode())
-            print(f"Received sensor data:")
-            print(f"Accelerometer: ({data['accel']['x']}, {data['accel']['y']}, {data['accel']['z']})")
-            print(f"Gyroscope: ({data['gyro']['x']}, {data['gyro']['y']}, {data['gyro']['z']})")
-            print(f"Timestamp: {data['timestamp']}")
-            
-            # Update local storage
-            self.current_accel = data['accel']
-            self.current_gyro = data['gyro']
-            
-            # Process acceleration data to get position
-            self.accel_processor.add_point(
-                self.current_accel['x'],
-                self.current_accel['y'],
-                self.current_accel['z'],
-                self.current_gyro['x'],
-                self.current_gyro['y'],
-                self.current_gyro['z'],
-                data['timestamp']
-            )
-            
-            # Get the current position
-            x, y, z = self.accel_processor.get_plot_coordinates()
-            print(f"Calculated position: ({x}, {y}, {z})")
-            
-            # Log the coordinates
-            self.logger.log_coordinates(data, (x, y, z))
-            
-            # Add to plotter if available
-            if self.plotter:
-                self.plotter.add_point(x, y, z)
-
-            # Store in MongoDB if handler available and z=0
-            if self.mongo_handler and z == 0:
-                # Update the current canvas with the new coordinates
-                self.mongo_handler.collection.update_one(
-                    {
-                        "_id": self.mongo_handler.current_session_id,
-                        "canvases": {"$elemMatch": {"timestamp": {"$exists": True}}}
-                    },
-                    {
-                        "$push": {
-                            f"canvases.{self.mongo_handler.current_canvas_id}.coordinates": {
-                                "x": x,
-                                "y": y,
-                                "z": z,
-                                "timestamp": data['timestamp']
-                            }
-                        }
-                    }
+        """Queue the raw payload; all processing happens on the ingest worker"""
+        self.ingest.put((message.topic, message.payload))
+
+    def processor_for(self, device):
+        """Return the motion processor holding the state of a device"""
+        processor = self.processors.get(device)
+        if processor is None:
+            processor = MotionProcessor(window_size=10)
+            self.processors[device] = processor
+        return processor
+
+    def attach_plotter(self, plotter, device=None):
+        """
+        Show a device (default: the first one seen) in a plotter, also while running
+        The pipeline itself never needs a plotter
+        """
+        self.plotter = plotter
+        self.plot_device = device
+        if device is None and self.rings:
+            self.plot_device = next(iter(self.rings))
+        ring = self.rings.get(self.plot_device)
+        if ring is not None:
+            plotter.attach_ring(ring)
+
+    def add_sink(self, sink):
+        """
+        Call sink(device, samples, positions) for every block of processed samples,
+        after it was logged and handed to MongoDB (on the ingest or collector thread)
+        """
+        self.sinks.append(sink)
+
+    def ring_for(self, device):
+        """Return the sample ring a device's payloads are decoded into"""
+        ring = self.rings.get(device)
+        if ring is None:
+            ring = SampleRing(self.ring_capacity)
+            self.rings[device] = ring
+            if self.plotter and self.plot_device in (None, device):
+                self.plot_device = device
+                self.plotter.attach_ring(ring)
+        return ring
+
+    def logger_for(self, device):
+        """Return the coordinate logger of a device"""
+        logger = self.loggers.get(device)
+        if logger is None:
+            name = None if device == DEFAULT_DEVICE else device
+            logger = CoordinateLogger(name=name, **self.log_options)
+            self.loggers[device] = logger
+        return logger
+
+    def frame_decoder_for(self, device):
+        """Return the binary frame decoder tracking a device's frame sequence"""
+        frame_decoder = self.frame_decoders.get(device)
+        if frame_decoder is None:
+            frame_decoder = FrameDecoder()
+            self.frame_decoders[device] = frame_decoder
+        return frame_decoder
+
+    def _process_batch(self, items):
+        """Process a batch of (topic, payload) items drained from the ingest queue"""
+        record = self.timer.record
+        started = time.perf_counter()
+        # device -> sequence number of its first sample in this batch
+        batch_start = {}
+        for topic, payload in items:
+            device = device_for_topic(topic)
+            ring = self.ring_for(device)
+            try:
+                if is_frame(payload):
+                    seq = self.frame_decoder_for(device).decode_into(payload, ring)
+                else:
+                    seq = decode_into(payload, ring)
+            except DecodeError as e:
+                print(f"Error processing message: {e}")
+                continue
+            if seq == RESET:
+                # Canvas reset frames carry no sample
+                self._reset(device, batch_start.pop(device, None))
+                continue
+            if device not in batch_start:
+                batch_start[device] = seq
+        record('decode', time.perf_counter() - started)
+
+        if self.shards:
+            # Positions come back through _apply_shard_results on the collector thread.
+            # Copies, since the queue pickles them later while the ring keeps moving
+            self.shards.submit([
+                (device, start, self.rings[device].sample_view(start, self.rings[device].head).copy())
+                for device, start in batch_start.items()
+            ])
+            return
+
+        started = time.perf_counter()
+        ranges = [self._process_range(device, start) for device, start in batch_start.items()]
+        record('motion', time.perf_counter() - started)
+
+        for device, start, stop in ranges:
+            self._emit(device, start, stop)
+
+    def _process_range(self, device, start):
+        """Compute positions for the samples of a device from start to the ring head"""
+        ring = self.rings[device]
+        processor = self.processor_for(device)
+        for part in ring.slices(start, ring.head):
+            ring.positions[part] = processor.process_batch(ring.samples[part])
+        return device, start, ring.head
+
+    def _reset(self, device, start):
+        """
+        Handle a reset signal: samples of the device received before it (from
+        start, None if there are none) finish on the old canvas, then its motion
+        state, log and stored canvas start over
+        """
+        ring = self.rings[device]
+        self.resets[device] = self.resets.get(device, 0) + 1
+        if self.plotter and device == self.plot_device:
+            self.plotter.mark_reset(ring.head)
+
+        if self.shards:
+            # The shard resets its processor after the samples, the rollover
+            # follows their results through _apply_shard_results
+            batches = []
+            if start is not None:
+                batches.append((device, start, ring.sample_view(start, ring.head).copy()))
+            batches.append((device, ring.head, None))
+            self.shards.submit(batches)
+            return
+
+        if start is not None:
+            self._emit(*self._process_range(device, start))
+        processor = self.processors.get(device)
+        if processor is not None:
+            processor.reset()
+        self._rollover(device, ring.head)
+
+    def _rollover(self, device, seq):
+        """Mark the reset in the device's log and move it to a new canvas"""
+        ring = self.rings[device]
+        # Logged as a firmware sentinel row, so replays reset at the same point
+        timestamp = ring.samples[(seq - 1) % ring.capacity, TIMESTAMP] if seq else 0
+        self.logger_for(device).log_rows(
+            np.array([[RESET_SENTINEL] * 3 + [0, 0, 0, timestamp]]),
+            np.array([[0, 0, 1]])
+        )
+        if self.mongo_handler:
+            self.mongo_handler.rollover(device)
+
+    def _apply_shard_results(self, results):
+        """Store positions computed by the shard pool and emit them"""
+        for device, start, positions in results:
+            if positions is None:
+                self._rollover(device, start)
+                continue
+            ring = self.rings[device]
+            stop = start + len(positions)
+            offset = 0
+            for part in ring.slices(start, stop):
+                size = part.stop - part.start
+                ring.positions[part] = positions[offset:offset + size]
+                offset += size
+            self._emit(device, start, stop)
+
+    def _emit(self, device, start, stop):
+        """Hand the samples [start, stop) of a device to the logger, plotter and MongoDB"""
+        record = self.timer.record
+        now = time.perf_counter
+        ring = self.rings[device]
+        samples = ring.sample_view(start, stop)
+        positions = ring.position_view(start, stop)
+
+        if self.verbose:
+            for sample, position in zip(samples.tolist(), positions.tolist()):
+                print(f"Received sensor data from {device}:")
+                print(f"Accelerometer: ({sample[AX]}, {sample[AY]}, {sample[AZ]})")
+                print(f"Gyroscope: ({sample[GX]}, {sample[GY]}, {sample[GZ]})")
+                print(f"Timestamp: {sample[TIMESTAMP]}")
+                print(f"Calculated position: ({position[POS_X]}, {position[POS_Y]}, {position[PEN_UP]})")
+                print("-------------------")
+
+        # Log the coordinates
+        started = now()
+        self.logger_for(device).log_rows(samples, positions)
+        logged = now()
+        record('log', logged - started)
+
+        # The plotter reads committed rows straight from the ring
+        ring.commit(stop)
+        plotted = now()
+        record('plot', plotted - logged)
+
+        # Buffer pen-down points for MongoDB if handler available
+        if self.mongo_handler:
+            down = positions[:, PEN_UP] == 0
+            if down.any():
+                self.mongo_handler.add_points(
+                    positions[down, POS_X],
+                    positions[down, POS_Y],
+                    samples[down, TIMESTAMP],
+                    device
                 )
-            
-            print("-------------------")
-            
-        except Exception as e:
-            print(f"Error processing message: {e}")
+        record('store', now() - plotted)
+
+        for sink in self.sinks:
+            sink(device, samples, positions)
+
+    def stats(self):
+        """Queue depth, overflow counts, per-stage timings and write counters"""
+        stats = {'ingest': self.ingest.stats()}
+        if self.resets:
+            stats['resets'] = dict(self.resets)
+        if self.frame_decoders:
+            stats['frames'] = {
+                device: {'frames': d.frames, 'lost': d.lost}
+                for device, d in self.frame_decoders.items()
+            }
+        if self.mongo_handler:
+            stats['store'] = self.mongo_handler.write_stats()
+        return stats
 
     def connect(self):
         """Establish MQTT connection"""
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        if self.client_factory:
+            self.client = self.client_factory()
+        else:
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
         
@@ -121,7 +346,10 @@ class MQTTHandler:
             return False
 
     def start(self):
-        """Start MQTT client loop"""
+        """Start the processing worker and the MQTT client loop"""
+        if self.processes and self.shards is None:
+            self.shards = ShardPool(self._apply_shard_results, processes=self.processes)
+        self.ingest.start()
         if self.client:
             self.client.loop_start()
 
@@ -129,4 +357,14 @@ class MQTTHandler:
         """Stop MQTT client"""
         if self.client:
             self.client.loop_stop()
-            self.client.disconnect()
\ No newline at end of file
+            self.client.disconnect()
+        # Drain payloads that were already received
+        self.ingest.stop()
+        if self.shards:
+            self.shards.close()
+            self.shards = None
+        for logger in self.loggers.values():
+            logger.close()
+        # Write out any points still buffered
+        if self.mongo_handler:
+            self.mongo_handler.flush()
\ No newline at end of file
@@ -1,14 +1,20 @@
 # plotter.py
 import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 from collections import deque
 import numpy as np
 from queue import Queue
 from threading import Lock
+from matplotlib.collections import LineCollection
+from lod import PathDecimator, pixel_size
+from strokes import split_strokes
+
+# New points are redrawn every frame until this many have collected, then they
+# are baked into the cached background as static strokes
+BAKE_POINTS = 256
 
 class Plotter:
-    def __init__(self, max_points=1000):
-        # Initialize deques for storing coordinates
+    def __init__(self, max_points=1000, bake_points=BAKE_POINTS):
+        # Initialize deques for storing the most recent coordinates
         self.x_coords = deque(maxlen=max_points)
         self.y_coords = deque(maxlen=max_points)
         self.z_coords = deque(maxlen=max_points)
@@ -17,6 +23,28 @@ class Plotter:
         self.point_queue = Queue()
         self.lock = Lock()
         
+        # Optional SampleRing the live positions are read from
+        self.ring = None
+        self._ring_cursor = 0
+        # Ring sequence number a new canvas starts at, see mark_reset
+        self._reset_at = None
+
+        # Points not baked yet, the first one repeats the end of the baked path
+        self.bake_points = bake_points
+        self._tail_x = []
+        self._tail_y = []
+        self._tail_z = []
+        # Baked path, decimated to the pixel resolution of the current view
+        self.path = PathDecimator()
+        self._path_view = None
+        # Static stroke collections holding the older part of the path
+        self._baked = []
+        self._unbaked = []
+        # Canvas pixels without the animated artists, and the view they belong to
+        self._background = None
+        self._view = None
+        self.full_redraws = 0
+        
         # Set up the plot
         self.fig = plt.figure(figsize=(10, 8))
         self.ax = self.fig.add_subplot(111)
@@ -39,6 +67,13 @@ class Plotter:
         self.ax.set_xlim(-1000, 1000)  # Adjust these values based on your scale
         self.ax.set_ylim(-1000, 1000)
 
+        # Persistent artists, only their data changes between frames
+        self._blit = self.fig.canvas.supports_blit
+        self.tail_strokes = self._add_strokes([], animated=self._blit)
+        self.marker, = self.ax.plot([], [], 'ro', animated=self._blit)
+        self.lines = [self.tail_strokes, self.marker]
+        self.fig.canvas.mpl_connect('draw_event', self._on_draw)
+
     def add_point(self, x, y, z):
         """Add a single coordinate point to queue"""
         self.point_queue.put((x, y, z))
@@ -49,6 +84,58 @@ class Plotter:
         self.coordinate_list = coordinates
         self.current_index = 0
 
+    def attach_ring(self, ring):
+        """Read live positions straight from a SampleRing"""
+        with self.lock:
+            self.ring = ring
+            self._ring_cursor = ring.committed
+            self._reset_at = None
+
+    def mark_reset(self, seq):
+        """Ring samples from seq on belong to a new canvas, clear the plot once it gets there"""
+        with self.lock:
+            self._reset_at = seq
+
+    def _apply_reset(self):
+        with self.lock:
+            reset_at = self._reset_at
+            if reset_at is None or self.ring.committed < reset_at:
+                return
+            self._reset_at = None
+        self.clear()
+        with self.lock:
+            # Samples of the old canvas not drawn yet are skipped
+            self._ring_cursor = max(self._ring_cursor, reset_at)
+
+    def _process_ring(self):
+        """Append positions committed to the ring since the last frame"""
+        with self.lock:
+            stop = self.ring.committed
+            if stop <= self._ring_cursor:
+                return
+            positions = self.ring.position_view(self._ring_cursor, stop)
+            self._ring_cursor = stop
+            xs = positions[:, 0]
+            ys = positions[:, 1]
+            
+            zs = positions[:, 2]
+            
+            # Only add points if they're different from the previous point
+            prev_x = self.x_coords[-1] if self.x_coords else np.nan
+            prev_y = self.y_coords[-1] if self.y_coords else np.nan
+            prev_z = self.z_coords[-1] if self.z_coords else np.nan
+            moved = ((xs != np.r_[prev_x, xs[:-1]]) | (ys != np.r_[prev_y, ys[:-1]]) |
+                     (zs != np.r_[prev_z, zs[:-1]]))
+            new_x = xs[moved].tolist()
+            new_y = ys[moved].tolist()
+            new_z = zs[moved].tolist()
+            self.x_coords.extend(new_x)
+            self.y_coords.extend(new_y)
+            self.z_coords.extend(new_z)
+            self._tail_x.extend(new_x)
+            self._tail_y.extend(new_y)
+            self._tail_z.extend(new_z)
+
     def _process_queue(self):
         """Process any points in the queue"""
         while not self.point_queue.empty():
@@ -57,47 +144,121 @@ class Plotter:
                 # Only add points if they're different from the last point
                 if (len(self.x_coords) == 0 or 
                     x != self.x_coords[-1] or 
-                    y != self.y_coords[-1]):
+                    y != self.y_coords[-1] or
+                    z != self.z_coords[-1]):
                     self.x_coords.append(x)
                     self.y_coords.append(y)
                     self.z_coords.append(z)
+                    self._tail_x.append(x)
+                    self._tail_y.append(y)
+                    self._tail_z.append(z)
+
+    def _add_strokes(self, strokes, animated=False):
+        """Add a LineCollection drawing every pen-down stroke"""
+        collection = LineCollection(strokes, colors='b', linewidths=2, animated=animated)
+        self.ax.add_collection(collection, autolim=False)
+        return collection
+
+    def _bake_tail(self):
+        """Turn the unbaked points into static strokes (caller holds lock)"""
+        # The first tail point is already part of the baked path
+        skip = 1 if self.path.count else 0
+        position = self.path.extend(self._tail_x[skip:], self._tail_y[skip:], self._tail_z[skip:])
+        strokes = self._add_strokes(split_strokes(*self.path.points(position)))
+        self._baked.append(strokes)
+        self._unbaked.append(strokes)
+        # The next segment starts where this one ends
+        self._tail_x = self._tail_x[-1:]
+        self._tail_y = self._tail_y[-1:]
+        self._tail_z = self._tail_z[-1:]
+
+    def _view_state(self):
+        return self.ax.get_xlim(), self.ax.get_ylim(), self.fig.bbox.bounds
+
+    def _rebuild_path(self):
+        """Replace the baked segments by one stroke collection decimated for the current view"""
+        self.path.set_resolution(*pixel_size(self.ax))
+        for strokes in self._baked:
+            strokes.remove()
+        self._baked.clear()
+        self._unbaked.clear()
+        if self.path.count:
+            self._baked.append(self._add_strokes(split_strokes(*self.path.points())))
+
+    def _on_draw(self, event):
+        """After a full draw: cache the background and paint the animated artists on it"""
+        if not self._blit:
+            return
+        canvas = self.fig.canvas
+        self._background = canvas.copy_from_bbox(self.fig.bbox)
+        self._view = self._view_state()
+        # A full draw already includes every baked segment
+        self._unbaked.clear()
+        for artist in self.lines:
+            self.ax.draw_artist(artist)
+
+    def _render(self):
+        """Blit the animated artists, redrawing everything only when the view changed"""
+        canvas = self.fig.canvas
+        view = self._view_state()
+        if self._path_view != view:
+            # Zoomed, resized or scrolled: the baked path is decimated again for the new scale
+            self._rebuild_path()
+            self._path_view = view
+            self._background = None
+        if not self._blit:
+            canvas.draw_idle()
+            return
+        if self._background is None or self._view != view:
+            self.full_redraws += 1
+            canvas.draw()
+            return
+
+        canvas.restore_region(self._background)
+        if self._unbaked:
+            # New static segments go into the cached background once
+            for strokes in self._unbaked:
+                self.ax.draw_artist(strokes)
+            self._unbaked.clear()
+            self._background = canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self.lines:
+            self.ax.draw_artist(artist)
+        canvas.blit(self.fig.bbox)
 
     def _update_plot(self, frame):
         """Update function for animation"""
         self._process_queue()
+        if self.ring is not None:
+            self._apply_reset()
+            self._process_ring()
 
-        # Clear previous lines
-        for line in self.lines:
-            line.remove()
-        self.lines.clear()
-        
-        if len(self.x_coords) > 0:
-            # Plot the continuous path
-            line, = self.ax.plot(self.x_coords, self.y_coords, 'b-', linewidth=2)
-            self.lines.append(line)
-            
-            # Add current position marker
-            point, = self.ax.plot([self.x_coords[-1]], [self.y_coords[-1]], 'ro')
-            self.lines.append(point)
-            
-            # Dynamically adjust plot limits if point is near edge
-            margin = 100  # Buffer space
-            x_min, x_max = self.ax.get_xlim()
-            y_min, y_max = self.ax.get_ylim()
-            
+        with self.lock:
+            if len(self.x_coords) == 0:
+                return self.lines
+            if len(self._tail_x) > self.bake_points:
+                self._bake_tail()
+            # Update the pen-down strokes and the current position marker in place
+            self.tail_strokes.set_segments(split_strokes(self._tail_x, self._tail_y, self._tail_z))
             current_x = self.x_coords[-1]
             current_y = self.y_coords[-1]
-            
-            if current_x < x_min + margin:
-                self.ax.set_xlim(current_x - 500, x_max)
-            elif current_x > x_max - margin:
-                self.ax.set_xlim(x_min, current_x + 500)
-                
-            if current_y < y_min + margin:
-                self.ax.set_ylim(current_y - 500, y_max)
-            elif current_y > y_max - margin:
-                self.ax.set_ylim(y_min, current_y + 500)
-        
+            self.marker.set_data([current_x], [current_y])
+
+        # Dynamically adjust plot limits if point is near edge
+        margin = 100  # Buffer space
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+
+        if current_x < x_min + margin:
+            self.ax.set_xlim(current_x - 500, x_max)
+        elif current_x > x_max - margin:
+            self.ax.set_xlim(x_min, current_x + 500)
+
+        if current_y < y_min + margin:
+            self.ax.set_ylim(current_y - 500, y_max)
+        elif current_y > y_max - margin:
+            self.ax.set_ylim(y_min, current_y + 500)
+
+        self._render()
         return self.lines
 
     def _animate(self, frame):
@@ -113,18 +274,26 @@ class Plotter:
 
     def start_animation(self, interval=100):
         """Start animation"""
-        self.animation = FuncAnimation(
-            self.fig,
-            self._update_plot,
-            interval=interval,
-            blit=True,
-            cache_frame_data=False  # Disable caching
-        )
+        self.animation = self.fig.canvas.new_timer(interval=interval)
+        self.animation.add_callback(self._update_plot, None)
+        # Start ticking once the window has been drawn for the first time
+        def start(event):
+            self.fig.canvas.mpl_disconnect(cid)
+            self.animation.start()
+        cid = self.fig.canvas.mpl_connect('draw_event', start)
         plt.show()
 
+    def close(self):
+        """Stop the animation and close the plot window"""
+        if self.animation is not None:
+            self.animation.stop()
+        plt.close(self.fig)
+
     def plot_static(self):
         """Create a static plot of current coordinates"""
         self._update_plot(None)
+        for artist in self.lines:
+            artist.set_animated(False)
         plt.show()
 
     def clear(self):
@@ -135,6 +304,19 @@ class Plotter:
             self.z_coords.clear()
             while not self.point_queue.empty():
                 self.point_queue.get()
+            for strokes in self._baked:
+                strokes.remove()
+            self._baked.clear()
+            self._unbaked.clear()
+            self.path.clear()
+            self._path_view = None
+            self._tail_x = []
+            self._tail_y = []
+            self._tail_z = []
+            self.tail_strokes.set_segments([])
+            self.marker.set_data([], [])
+            # The baked segments were part of the cached background
+            self._background = None
 # # plotter.py
 # import matplotlib.pyplot as plt
 # from matplotlib.animation import FuncAnimation
@@ -274,4 +456,3 @@ class Plotter:
 #             self.y_coords.clear()
 #             self.z_coords.clear()
 #             while not self.point_queue.empty():
-#                 self.point_queue.get()
\ No newline at end of file
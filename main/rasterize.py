@@ -0,0 +1,254 @@
+# rasterize.py
+# Draws canvas strokes into NumPy images and writes them as PNG, no matplotlib.
+#
+# Every segment between consecutive pen-down points is sampled once per pixel
+# of its length, all segments of a canvas at once. Samples are either rounded
+# to the nearest pixel or, with anti-aliasing, spread over their four
+# neighbouring pixels with bilinear weights. Coverage is accumulated with a
+# single np.bincount, so the cost is one vectorized pass over the samples.
+import struct
+import zlib
+import numpy as np
+from strokes import PEN_DOWN
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def fit_transform(xs, ys, width, height, margin=2, bounds=None):
+    """
+    Scale and offset mapping data coordinates to pixel coordinates
+    Keeps the aspect ratio, centres the drawing and flips y so it points up
+    bounds: Optional (x_min, y_min, x_max, y_max), defaults to the points' extent
+    """
+    if bounds is None:
+        if len(xs) == 0:
+            bounds = (0.0, 0.0, 1.0, 1.0)
+        else:
+            bounds = (float(np.min(xs)), float(np.min(ys)), float(np.max(xs)), float(np.max(ys)))
+    x_min, y_min, x_max, y_max = bounds
+    span_x = max(x_max - x_min, 1e-9)
+    span_y = max(y_max - y_min, 1e-9)
+    scale = min((width - 1 - 2 * margin) / span_x, (height - 1 - 2 * margin) / span_y)
+    scale = max(scale, 0.0)
+    offset_x = (width - 1 - span_x * scale) / 2 - x_min * scale
+    offset_y = (height - 1 - span_y * scale) / 2 + y_max * scale
+    return scale, offset_x, offset_y
+
+
+def segment_mask(zs, timestamps=None, max_gap=None, pen_down=PEN_DOWN):
+    """
+    connect[i] is True when points i and i + 1 belong to the same stroke
+    Stored canvases only keep pen-down points, so a gap of more than max_gap
+    between timestamps is treated as the pen having been lifted
+    """
+    down = np.asarray(zs) == pen_down
+    connect = down[1:] & down[:-1]
+    if timestamps is not None and max_gap is not None:
+        connect &= np.diff(np.asarray(timestamps, dtype=np.float64)) <= max_gap
+    return connect
+
+
+def _segment_samples(px, py, connect):
+    """Points every pixel along the connected segments, plus isolated pen-down points"""
+    x0 = px[:-1][connect]
+    y0 = py[:-1][connect]
+    dx = px[1:][connect] - x0
+    dy = py[1:][connect] - y0
+    steps = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+    total = int(steps.sum())
+    # t runs from 0 to 1 along every segment
+    owner = np.repeat(np.arange(len(steps)), steps)
+    first = np.cumsum(steps) - steps
+    index = np.arange(total) - np.repeat(first, steps)
+    t = index / np.maximum(steps - 1, 1)[owner]
+    return x0[owner] + dx[owner] * t, y0[owner] + dy[owner] * t
+
+
+def coverage(xs, ys, zs=None, width=128, height=128, line_width=1.0, antialias=True,
+             margin=2, bounds=None, timestamps=None, max_gap=None):
+    """
+    Render strokes into a float32 (height, width) coverage image in [0, 1]
+    xs, ys: Point coordinates in data units
+    zs: Pen flags (0 = down); all points are drawn as one stroke when omitted
+    line_width: Stroke width in pixels
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    if zs is None:
+        zs = np.zeros(len(xs))
+    zs = np.asarray(zs)
+    image = np.zeros(width * height, dtype=np.float64)
+    if len(xs) == 0:
+        return image.reshape(height, width).astype(np.float32)
+
+    pad = margin + line_width / 2
+    scale, offset_x, offset_y = fit_transform(xs, ys, width, height, pad, bounds)
+    px = xs * scale + offset_x
+    py = offset_y - ys * scale
+
+    connect = segment_mask(zs, timestamps, max_gap)
+    sx, sy = _segment_samples(px, py, connect)
+    # Pen-down points not connected to either neighbour are drawn as dots
+    down = zs == PEN_DOWN
+    linked = np.zeros(len(xs), dtype=bool)
+    linked[:-1] |= connect
+    linked[1:] |= connect
+    isolated = down & ~linked
+    sx = np.concatenate((sx, px[isolated]))
+    sy = np.concatenate((sy, py[isolated]))
+
+    # Wider strokes stamp every sample with a disc of offsets
+    radius = max(line_width / 2 - 0.5, 0.0)
+    if radius > 0:
+        r = int(np.ceil(radius))
+        ox, oy = np.meshgrid(np.arange(-r, r + 1), np.arange(-r, r + 1))
+        inside = ox ** 2 + oy ** 2 <= radius ** 2 + 1e-9
+        ox = ox[inside].astype(np.float64)
+        oy = oy[inside].astype(np.float64)
+        sx = (sx[:, None] + ox).ravel()
+        sy = (sy[:, None] + oy).ravel()
+
+    if antialias:
+        fx = np.floor(sx)
+        fy = np.floor(sy)
+        wx = sx - fx
+        wy = sy - fy
+        ix = fx.astype(np.int64)
+        iy = fy.astype(np.int64)
+        for cx, cy, weight in (
+            (ix, iy, (1 - wx) * (1 - wy)),
+            (ix + 1, iy, wx * (1 - wy)),
+            (ix, iy + 1, (1 - wx) * wy),
+            (ix + 1, iy + 1, wx * wy),
+        ):
+            valid = (cx >= 0) & (cx < width) & (cy >= 0) & (cy < height)
+            image += np.bincount(cy[valid] * width + cx[valid], weights=weight[valid],
+                                 minlength=width * height)
+        # Samples are one pixel apart, so a fully covered pixel collects about 1
+        np.minimum(image, 1.0, out=image)
+    else:
+        ix = np.rint(sx).astype(np.int64)
+        iy = np.rint(sy).astype(np.int64)
+        valid = (ix >= 0) & (ix < width) & (iy >= 0) & (iy < height)
+        image[iy[valid] * width + ix[valid]] = 1.0
+    return image.reshape(height, width).astype(np.float32)
+
+
+def shade(cover, ink=(0, 0, 255), background=(255, 255, 255)):
+    """Blend ink over background by coverage, returns an (h, w, 3) uint8 image"""
+    ink = np.asarray(ink, dtype=np.float32)
+    background = np.asarray(background, dtype=np.float32)
+    rgb = background + (ink - background) * cover[..., None]
+    return np.rint(rgb).astype(np.uint8)
+
+
+def render(xs, ys, zs=None, width=128, height=128, ink=(0, 0, 255), background=(255, 255, 255),
+           **options):
+    """Render strokes to an RGB uint8 image; options are passed to coverage()"""
+    return shade(coverage(xs, ys, zs, width, height, **options), ink, background)
+
+
+def points_to_arrays(points):
+    """Columns (xs, ys, zs, timestamps) of a list of stored point dicts"""
+    count = len(points)
+    return tuple(
+        np.fromiter((point.get(name, 0) for point in points), dtype=np.float64, count=count)
+        for name in ('x', 'y', 'z', 'timestamp')
+    )
+
+
+def render_points(points, width=128, height=128, max_gap=None, **options):
+    """Render stored canvas points (dicts with x, y, z, timestamp) to an RGB image"""
+    xs, ys, zs, timestamps = points_to_arrays(points)
+    return render(xs, ys, zs, width, height, timestamps=timestamps, max_gap=max_gap, **options)
+
+
+def _chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data +
+            struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def encode_png(image, level=6):
+    """Encode an (h, w) grayscale or (h, w, 3) RGB uint8 image as PNG bytes"""
+    image = np.ascontiguousarray(image, dtype=np.uint8)
+    if image.ndim == 2:
+        color_type = 0
+    elif image.ndim == 3 and image.shape[2] == 3:
+        color_type = 2
+    else:
+        raise ValueError(f"Expected an (h, w) or (h, w, 3) image, got shape {image.shape}")
+    height, width = image.shape[:2]
+    # Every scanline starts with its filter type, 0 (none)
+    rows = image.reshape(height, -1)
+    raw = np.zeros((height, rows.shape[1] + 1), dtype=np.uint8)
+    raw[:, 1:] = rows
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return (PNG_SIGNATURE +
+            _chunk(b'IHDR', header) +
+            _chunk(b'IDAT', zlib.compress(raw.tobytes(), level)) +
+            _chunk(b'IEND', b''))
+
+
+def write_png(path, image, level=6):
+    with open(path, 'wb') as f:
+        f.write(encode_png(image, level))
+
+
+def export_archive(archive_path, out_dir, width=256, height=256, max_gap=None, **options):
+    """Write one PNG per canvas of a columnar session archive, returns the count"""
+    import os
+    from archive import SessionArchive
+
+    archive = SessionArchive(archive_path)
+    sessions = archive.sessions()
+    os.makedirs(out_dir, exist_ok=True)
+    written = 0
+    for session, canvas, columns in archive.iter_canvases():
+        image = render(columns['x'], columns['y'], columns['z'], width, height,
+                       timestamps=columns['timestamp'], max_gap=max_gap, **options)
+        write_png(os.path.join(out_dir, f"{sessions[session]['_id']}_{canvas}.png"), image)
+        written += 1
+    return written
+
+
+def benchmark(count=200, size=128, repeat=20):
+    """Thumbnails per second for the captured test path"""
+    import time
+    from accel_to_draw import MotionProcessor
+    from process_message import long_capture
+
+    positions = MotionProcessor(window_size=10).process_batch(long_capture(repeat))
+    xs, ys, zs = positions[:, 0], positions[:, 1], positions[:, 2]
+    results = {}
+    for antialias in (False, True):
+        started = time.perf_counter()
+        for _ in range(count):
+            encode_png(render(xs, ys, zs, size, size, antialias=antialias))
+        elapsed = time.perf_counter() - started
+        results[f"{size}x{size} {'anti-aliased' if antialias else 'aliased'}"] = count / elapsed
+    return len(xs), results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Render canvases of a session archive to PNG")
+    parser.add_argument('archive', nargs='?', help="Archive directory written by archive.py export")
+    parser.add_argument('out_dir', nargs='?', default='thumbnails')
+    parser.add_argument('--size', type=int, default=256)
+    parser.add_argument('--line-width', type=float, default=1.5)
+    parser.add_argument('--max-gap', type=float, default=None,
+                        help="Start a new stroke after this many ms without points")
+    parser.add_argument('--no-antialias', action='store_true')
+    parser.add_argument('--benchmark', action='store_true')
+    args = parser.parse_args()
+
+    if args.benchmark or args.archive is None:
+        points, results = benchmark()
+        for name, rate in results.items():
+            print(f"{name} ({points} points): {rate:,.0f} thumbnails/s")
+    else:
+        written = export_archive(args.archive, args.out_dir, args.size, args.size,
+                                 max_gap=args.max_gap, line_width=args.line_width,
+                                 antialias=not args.no_antialias)
+        print(f"Wrote {written} thumbnails to {args.out_dir}")
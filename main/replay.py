@@ -0,0 +1,372 @@
+# replay.py
+# Feeds CoordinateLogger captures back through the motion pipeline.
+#
+# Every logged row holds the raw sample plus the position computed live, so a
+# capture can be replayed through MotionProcessor (or PositionIntegrator) and
+# the logger/plotter/MongoDB sinks without a broker or a pen. Replays are
+# deterministic: the same capture always yields the same positions, and for
+# MotionProcessor they are compared against the positions recorded live.
+import gzip
+import os
+import re
+import threading
+import time
+import argparse
+import numpy as np
+from accel_to_draw import MotionProcessor
+from decoder import RESET_SENTINEL
+from integrate import PositionIntegrator, SensorData
+from ingest_queue import StageTimer
+from logger import BINARY_MAGIC, BINARY_RECORD, CoordinateLogger
+from sample_ring import SampleRing, POS_X, POS_Y, PEN_UP, TIMESTAMP
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+PROCESSOR_MOTION = 'motion'
+PROCESSOR_INTEGRATOR = 'integrator'
+# Paced replays cut blocks at this many seconds of replay time, so samples are
+# never released in bursts longer than this
+PACE_INTERVAL = 0.02
+
+# --log writes here, away from the captures in logs/ that are being replayed
+REPLAY_LOG_DIR = os.path.join("logs", "replay")
+
+# coordinate_log_<date>_<time>[_<device>][_<segment>].<txt|bin>[.gz|.zst]
+_LOG_NAME = re.compile(r'^(coordinate_log_\d{8}_\d{6}(?:_.+?)?)(?:_\d{4})?\.(?:txt|bin)(?:\.gz|\.zst)?$')
+
+
+def capture_name(path):
+    """Name shared by all segments of one capture, or the file name itself"""
+    name = os.path.basename(path)
+    match = _LOG_NAME.match(name)
+    return match.group(1) if match else name
+
+
+def log_files(path):
+    """A single log file, or every coordinate log in a directory in capture order"""
+    if os.path.isdir(path):
+        return sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if _LOG_NAME.match(name)
+        )
+    return [path]
+
+
+def _open_log(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        if zstandard is None:
+            raise ValueError(f"{path} needs the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def read_log(path):
+    """
+    Read a CSV or binary log (optionally gzip/zstd compressed)
+    Returns (samples, positions): (n, 7) sample rows in SampleRing column
+    order and the (n, 3) positions that were logged with them
+    """
+    with _open_log(path) as f:
+        head = f.read(len(BINARY_MAGIC))
+        if head == BINARY_MAGIC:
+            rows = np.frombuffer(f.read(), dtype=BINARY_RECORD)
+            table = rows.view('<f8').reshape(-1, len(BINARY_RECORD.names))
+        else:
+            data = head + f.read()
+            table = np.loadtxt(data.decode().splitlines(), delimiter=',', skiprows=1, ndmin=2)
+    if table.size == 0:
+        return np.empty((0, 7)), np.empty((0, 3))
+    # Log columns: timestamp, ax..gz, x, y, z
+    samples = np.column_stack((table[:, 1:7], table[:, 0]))
+    return samples, np.array(table[:, 7:10])
+
+
+class LogReplay:
+    def __init__(self, processor=PROCESSOR_MOTION, speed=None, block_size=100,
+                 mongo_handler=None, plotter=None, logger=None, window_size=10):
+        """
+        processor: 'motion' (MotionProcessor) or 'integrator' (PositionIntegrator)
+        speed: None replays as fast as possible, 1.0 in real time, N at N times real time
+        block_size: Samples processed and handed to the sinks at once (paced replays
+                    also end a block after PACE_INTERVAL seconds of samples)
+        mongo_handler: Optional MongoDBHandler receiving pen-down points
+        plotter: Optional Plotter, fed through a SampleRing like the live pipeline
+        logger: Optional CoordinateLogger receiving the replayed rows
+        """
+        if processor not in (PROCESSOR_MOTION, PROCESSOR_INTEGRATOR):
+            raise ValueError(f"Unknown processor {processor!r}")
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be positive")
+        self.processor = processor
+        self.speed = speed
+        self.block_size = block_size
+        self.mongo_handler = mongo_handler
+        self.plotter = plotter
+        self.logger = logger
+        self.window_size = window_size
+        self.timer = StageTimer()
+        self.ring = SampleRing(capacity=max(4096, 4 * block_size))
+        if plotter is not None:
+            plotter.attach_ring(self.ring)
+
+        # capture name -> processor, segments of a capture share state
+        self._processors = {}
+        self._stop = threading.Event()
+        self.samples = 0
+        self.resets = 0
+        self.mismatched = 0
+        self.elapsed = 0.0
+
+    def stop(self):
+        """Ask a running replay to stop after the current block"""
+        self._stop.set()
+
+    def _processor_for(self, capture):
+        processor = self._processors.get(capture)
+        if processor is None:
+            if self.processor == PROCESSOR_MOTION:
+                processor = MotionProcessor(window_size=self.window_size)
+            else:
+                processor = PositionIntegrator()
+            self._processors[capture] = processor
+        return processor
+
+    def _blocks(self, samples):
+        """
+        Yield (start, stop, reset) ranges of at most block_size samples
+        Reset sentinel rows logged by MQTTHandler come as ranges of their own
+        """
+        resets = np.flatnonzero((samples[:, :3] == RESET_SENTINEL).all(axis=1)).tolist()
+        position = 0
+        for reset in resets + [len(samples)]:
+            if self.speed is None:
+                for start in range(position, reset, self.block_size):
+                    yield start, min(start + self.block_size, reset), False
+            else:
+                yield from self._paced_blocks(samples[:, TIMESTAMP], position, reset)
+            if reset < len(samples):
+                yield reset, reset + 1, True
+            position = reset + 1
+
+    def _paced_blocks(self, timestamps, start, stop):
+        """Ranges of samples spanning less than PACE_INTERVAL of replay time"""
+        window = PACE_INTERVAL * self.speed * 1000
+        while start < stop:
+            end = min(start + self.block_size, stop)
+            following = timestamps[start + 1:end]
+            # A device clock restart ends the block as well
+            inside = (following >= timestamps[start]) & (following < timestamps[start] + window)
+            if not inside.all():
+                end = start + 1 + int(np.argmin(inside))
+            yield start, end, False
+            start = end
+
+    def _reset(self, capture, row):
+        """Start over on a new canvas, as the live pipeline did at this row"""
+        self.resets += 1
+        processor = self._processors[capture]
+        if self.processor == PROCESSOR_MOTION:
+            processor.reset()
+        else:
+            self._processors[capture] = PositionIntegrator()
+        if self.logger:
+            self.logger.log_rows(row, np.array([[0, 0, 1]]))
+        if self.plotter is not None:
+            self.plotter.mark_reset(self.ring.head)
+        if self.mongo_handler:
+            self.mongo_handler.rollover(capture)
+
+    def _integrate(self, integrator, samples):
+        """Run PositionIntegrator over a block, rows without a point are pen-up"""
+        positions = np.zeros((len(samples), 3))
+        positions[:, PEN_UP] = 1
+        for row, sample in enumerate(samples.tolist()):
+            point = integrator.process_sensor_data(
+                SensorData(sample[6], tuple(sample[0:3]), tuple(sample[3:6]))
+            )
+            if point is not None:
+                positions[row] = (point[0], point[1], 0)
+        return positions
+
+    def _pace(self, timestamp, clock):
+        """
+        Sleep until a sample with this device timestamp is due
+        clock: (wall time, device timestamp) of the reference sample plus the last timestamp
+        """
+        if self.speed is None:
+            return clock
+        now = time.perf_counter()
+        if clock is None or timestamp < clock[2]:
+            # First block, or the device clock restarted
+            return now, timestamp, timestamp
+        due = clock[0] + (timestamp - clock[1]) / 1000.0 / self.speed
+        if due > now:
+            time.sleep(due - now)
+        return clock[0], clock[1], timestamp
+
+    def replay_file(self, path):
+        """Replay one log file"""
+        record = self.timer.record
+        now = time.perf_counter
+
+        started = now()
+        samples, logged_positions = read_log(path)
+        record('read', now() - started)
+
+        capture = capture_name(path)
+        self._processor_for(capture)
+        clock = None
+        for start, stop, reset in self._blocks(samples):
+            if self._stop.is_set():
+                break
+            block = samples[start:stop]
+            if reset:
+                self._reset(capture, block)
+                continue
+            processor = self._processors[capture]
+            # Released when its last sample is due
+            clock = self._pace(block[-1, TIMESTAMP], clock)
+
+            started = now()
+            if self.processor == PROCESSOR_MOTION:
+                positions = processor.process_batch(block)
+                # CSV logs keep 15 significant digits, binary logs are exact
+                logged_block = logged_positions[start:start + len(block)]
+                self.mismatched += int(np.count_nonzero(
+                    ~np.isclose(positions, logged_block, rtol=1e-12, atol=1e-9).all(axis=1)
+                ))
+            else:
+                positions = self._integrate(processor, block)
+            processed = now()
+            record('motion', processed - started)
+
+            if self.logger:
+                self.logger.log_rows(block, positions)
+            logged = now()
+            record('log', logged - processed)
+
+            if self.plotter is not None:
+                first = self.ring.extend(block.T)
+                offset = 0
+                for part in self.ring.slices(first, self.ring.head):
+                    size = part.stop - part.start
+                    self.ring.positions[part] = positions[offset:offset + size]
+                    offset += size
+                self.ring.commit(self.ring.head)
+            plotted = now()
+            record('plot', plotted - logged)
+
+            if self.mongo_handler:
+                down = positions[:, PEN_UP] == 0
+                if down.any():
+                    self.mongo_handler.add_points(
+                        positions[down, POS_X], positions[down, POS_Y],
+                        block[down, TIMESTAMP], capture
+                    )
+            record('store', now() - plotted)
+            self.samples += len(block)
+
+    def run(self, path):
+        """Replay a log file or a directory of logs and return stats()"""
+        started = time.perf_counter()
+        for log_path in log_files(path):
+            if self._stop.is_set():
+                break
+            self.replay_file(log_path)
+        if self.mongo_handler:
+            started_flush = time.perf_counter()
+            self.mongo_handler.flush()
+            self.timer.record('flush', time.perf_counter() - started_flush)
+        self.elapsed += time.perf_counter() - started
+        return self.stats()
+
+    def stats(self):
+        """Samples replayed, throughput, mismatches against the logged positions and stage timings"""
+        stats = {
+            'samples': self.samples,
+            'elapsed_s': self.elapsed,
+            'samples_per_s': self.samples / self.elapsed if self.elapsed else 0.0,
+            'captures': len(self._processors),
+            'resets': self.resets,
+            'timings': self.timer.stats(),
+        }
+        if self.processor == PROCESSOR_MOTION:
+            stats['mismatched'] = self.mismatched
+        return stats
+
+
+def print_stats(stats):
+    print(f"Replayed {stats['samples']} samples from {stats['captures']} captures "
+          f"in {stats['elapsed_s']:.2f} s ({stats['samples_per_s']:,.0f} samples/s), "
+          f"{stats['resets']} canvas resets")
+    if 'mismatched' in stats:
+        print(f"Rows differing from the logged positions: {stats['mismatched']}")
+    for stage, timing in stats['timings'].items():
+        print(f"  {stage:8s} {timing['count']:7d} calls  mean {timing['mean_ms']:8.3f} ms  "
+              f"max {timing['max_ms']:8.3f} ms  total {timing['total_ms']:9.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay coordinate logs through the motion pipeline")
+    parser.add_argument('path', help="Log file or directory of logs")
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument('--realtime', action='store_true', help="Replay at the recorded rate")
+    pacing.add_argument('--speed', type=float, help="Replay at N times the recorded rate")
+    parser.add_argument('--integrator', action='store_true',
+                        help="Use PositionIntegrator instead of MotionProcessor")
+    parser.add_argument('--block-size', type=int, default=100)
+    parser.add_argument('--log', action='store_true', help="Write the replayed rows to a new log")
+    parser.add_argument('--log-dir', default=REPLAY_LOG_DIR, help="Directory of the --log output")
+    parser.add_argument('--store', action='store_true', help="Store points in MongoDB")
+    parser.add_argument('--plot', action='store_true', help="Show the replay in the plotter")
+    args = parser.parse_args()
+    if args.log and os.path.isdir(args.path) and os.path.realpath(args.path) == os.path.realpath(args.log_dir):
+        # The replay would read back its own output
+        parser.error("--log-dir must not be the directory being replayed")
+
+    mongo_handler = None
+    if args.store:
+        from mongodb_handler import MongoDBHandler
+        mongo_handler = MongoDBHandler()
+    plotter = None
+    if args.plot:
+        from plotter import Plotter
+        plotter = Plotter()
+
+    replay = LogReplay(
+        processor=PROCESSOR_INTEGRATOR if args.integrator else PROCESSOR_MOTION,
+        speed=1.0 if args.realtime else args.speed,
+        block_size=args.block_size,
+        mongo_handler=mongo_handler,
+        plotter=plotter,
+        logger=CoordinateLogger(log_dir=args.log_dir, name="replay") if args.log else None,
+    )
+    try:
+        if plotter is None:
+            print_stats(replay.run(args.path))
+        else:
+            # The plot window needs the main thread
+            results = []
+            worker = threading.Thread(target=lambda: results.append(replay.run(args.path)), daemon=True)
+            worker.start()
+            plotter.start_animation()
+            replay.stop()
+            worker.join()
+            print_stats(results[0])
+    except KeyboardInterrupt:
+        replay.stop()
+        print_stats(replay.stats())
+    finally:
+        if replay.logger:
+            replay.logger.close()
+        if mongo_handler:
+            mongo_handler.close_connection()
+
+
+if __name__ == "__main__":
+    main()
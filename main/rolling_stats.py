@@ -0,0 +1,81 @@
+# rolling_stats.py
+# Fixed-window statistics answered in constant time without allocating,
+# used by MotionProcessor for its rest, threshold and stability checks.
+from array import array
+from math import sqrt
+
+
+class RollingStats:
+    """Mean and variance of the last `size` values (Welford add/remove over a ring buffer)"""
+    __slots__ = ('size', 'count', 'mean', '_m2', '_buffer', '_index')
+
+    def __init__(self, size):
+        self.size = size
+        self._buffer = array('d', bytes(8 * size))
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+        self._index = 0
+
+    def append(self, value):
+        if self.count < self.size:
+            self.count += 1
+            delta = value - self.mean
+            self.mean += delta / self.count
+            self._m2 += delta * (value - self.mean)
+        else:
+            # Window is full: replace the oldest value in a single update
+            old = self._buffer[self._index]
+            old_mean = self.mean
+            self.mean += (value - old) / self.count
+            self._m2 += (value - old) * (value - self.mean + old - old_mean)
+        self._buffer[self._index] = value
+        self._index += 1
+        if self._index == self.size:
+            self._index = 0
+
+    def variance(self):
+        """Population variance (same as np.var with ddof=0)"""
+        if self.count == 0:
+            return 0.0
+        return max(self._m2 / self.count, 0.0)
+
+    def std(self):
+        return sqrt(self.variance())
+
+    def __len__(self):
+        return self.count
+
+
+class RollingFlags:
+    """Boolean window of the last `size` flags that knows whether they are all true"""
+    __slots__ = ('size', 'count', 'run')
+
+    def __init__(self, size):
+        self.size = size
+        self.clear()
+
+    def clear(self):
+        self.count = 0
+        # Number of consecutive true flags ending at the newest one
+        self.run = 0
+
+    def append(self, flag):
+        if self.count < self.size:
+            self.count += 1
+        self.run = self.run + 1 if flag else 0
+
+    def extend(self, flags):
+        for flag in flags:
+            self.append(flag)
+
+    def all_true(self, k=None):
+        """True if the last k flags (default: the whole window) are all true"""
+        k = self.count if k is None else min(k, self.count)
+        return self.run >= k
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,148 @@
+# sample_ring.py
+# Preallocated storage for IMU samples and the positions computed from them.
+#
+# The decoder writes each sample straight into a row of `samples`, the motion
+# processor reads row ranges as (n, 7) views and writes (x, y, pen_up) into
+# the matching rows of `positions`, and the logger/plotter read the same
+# views. Nothing is allocated per sample.
+#
+# Memory per retained sample: 7 float64 sample columns + 3 float64 position
+# columns = 80 bytes (see measure_memory below for the old dict path).
+import numpy as np
+
+# Column layout of SampleRing.samples (the process_batch input layout)
+AX, AY, AZ, GX, GY, GZ, TIMESTAMP = range(7)
+SAMPLE_COLUMNS = 7
+# Column layout of SampleRing.positions (the process_batch output layout)
+POS_X, POS_Y, PEN_UP = range(3)
+POSITION_COLUMNS = 3
+
+BYTES_PER_SAMPLE = (SAMPLE_COLUMNS + POSITION_COLUMNS) * np.dtype(np.float64).itemsize
+
+
+class SampleRing:
+    __slots__ = ('capacity', 'samples', 'positions', 'head', 'committed', '_flat')
+
+    def __init__(self, capacity=65536):
+        """
+        capacity: Number of most recent samples kept; older rows are overwritten
+        """
+        self.capacity = capacity
+        self.samples = np.zeros((capacity, SAMPLE_COLUMNS))
+        self.positions = np.zeros((capacity, POSITION_COLUMNS))
+        # Flat float view of samples: item assignment without creating row views
+        self._flat = memoryview(self.samples).cast('B').cast('d')
+        # Sequence number of the next sample to be written
+        self.head = 0
+        # Samples before this sequence number have their positions filled in
+        self.committed = 0
+
+    def append(self, ax, ay, az, gx, gy, gz, timestamp):
+        """Write one sample and return its sequence number"""
+        seq = self.head
+        base = (seq % self.capacity) * SAMPLE_COLUMNS
+        flat = self._flat
+        flat[base] = ax
+        flat[base + 1] = ay
+        flat[base + 2] = az
+        flat[base + 3] = gx
+        flat[base + 4] = gy
+        flat[base + 5] = gz
+        flat[base + 6] = timestamp
+        self.head = seq + 1
+        return seq
+
+    def extend(self, columns):
+        """
+        Write a block of samples given as 7 column arrays in sample column order
+        Returns the sequence number of the first sample
+        """
+        start = self.head
+        stop = start + len(columns[0])
+        parts = self.slices(start, stop)
+        # Only the newest `capacity` samples of an oversized block are kept
+        offset = len(columns[0]) - sum(part.stop - part.start for part in parts)
+        for part in parts:
+            size = part.stop - part.start
+            rows = self.samples[part]
+            for column, values in enumerate(columns):
+                rows[:, column] = values[offset:offset + size]
+            offset += size
+        self.head = stop
+        return start
+
+    def slices(self, start, stop):
+        """
+        Split the sequence range [start, stop) into at most two contiguous row slices
+        Ranges older than the capacity are clipped to what is still retained
+        """
+        start = max(start, stop - self.capacity, 0)
+        if start >= stop:
+            return []
+        first = start % self.capacity
+        last = first + (stop - start)
+        if last <= self.capacity:
+            return [slice(first, last)]
+        return [slice(first, self.capacity), slice(0, last - self.capacity)]
+
+    def sample_view(self, start, stop):
+        """(n, 7) view of a range that does not wrap, else a copy"""
+        parts = self.slices(start, stop)
+        if len(parts) < 2:
+            return self.samples[parts[0]] if parts else self.samples[:0]
+        return np.concatenate([self.samples[part] for part in parts])
+
+    def position_view(self, start, stop):
+        """(n, 3) view of a range that does not wrap, else a copy"""
+        parts = self.slices(start, stop)
+        if len(parts) < 2:
+            return self.positions[parts[0]] if parts else self.positions[:0]
+        return np.concatenate([self.positions[part] for part in parts])
+
+    def commit(self, stop):
+        """Mark positions up to sequence number stop as computed"""
+        self.committed = max(self.committed, stop)
+
+    def __len__(self):
+        return min(self.head, self.capacity)
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes + self.positions.nbytes
+
+
+def measure_memory(count=10000):
+    """Compare retained bytes per sample of the ring against the old dict/IMUPoint path"""
+    import json
+    import tracemalloc
+    from accel_to_draw import IMUPoint
+
+    payload = b'{"timestamp":40692,"accel":{"x":276,"y":-16152,"z":2796},"gyro":{"x":-120,"y":35,"z":8}}'
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    retained = []
+    for i in range(count):
+        data = json.loads(payload.decode())
+        accel = dict(data['accel'])
+        gyro = dict(data['gyro'])
+        point = IMUPoint(accel['x'], accel['y'], accel['z'],
+                         gyro['x'], gyro['y'], gyro['z'], data['timestamp'] + i)
+        retained.append((data, accel, gyro, point, (float(i), float(i), 0)))
+    dict_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+    del retained
+
+    before = tracemalloc.get_traced_memory()[0]
+    ring = SampleRing(capacity=count)
+    for i in range(count):
+        ring.append(276, -16152, 2796, -120, 35, 8, 40692 + i)
+    ring_bytes = (tracemalloc.get_traced_memory()[0] - before) / count
+    tracemalloc.stop()
+    return dict_bytes, ring_bytes
+
+
+if __name__ == "__main__":
+    dict_bytes, ring_bytes = measure_memory()
+    print(f"dict/IMUPoint path: {dict_bytes:.0f} bytes per retained sample")
+    print(f"SampleRing:         {ring_bytes:.0f} bytes per retained sample "
+          f"({BYTES_PER_SAMPLE} bytes of column data)")
@@ -0,0 +1,115 @@
+# startup.py
+# Cold-start cost of every entry point, measured with python -X importtime.
+#
+#   python startup.py              import time per entry point and its heaviest packages
+#   python startup.py -k ingest    only entry points whose name contains "ingest"
+#
+# Every entry point is imported in a fresh interpreter. Importing one must not
+# connect, parse config or open windows, so the numbers are pure import cost.
+# benchmark.py runs the same measurements as startup.<name>, which lets
+# --output/--compare track cold starts next to the hot paths.
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+MAIN_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(MAIN_DIR)
+BACKEND_DIR = os.path.join(MAIN_DIR, 'backend')
+
+# name -> (directory the entry point runs from, module)
+ENTRY_POINTS = {
+    'ingest': (MAIN_DIR, 'main'),
+    'viewer': (MAIN_DIR, 'Canvas'),
+    'replay': (MAIN_DIR, 'replay'),
+    'archive': (MAIN_DIR, 'archive'),
+    'rasterize': (MAIN_DIR, 'rasterize'),
+    'migrate_buckets': (MAIN_DIR, 'migrate_buckets'),
+    'acc_sim': (ROOT_DIR, 'acc_sim'),
+    'tracking_server': (ROOT_DIR, 'tracking_server'),
+    'seed_db': (BACKEND_DIR, 'seedDB'),
+    'get_coords': (BACKEND_DIR, 'getCoords'),
+}
+
+# import time:  self [us] | cumulative | imported package
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)')
+
+
+def import_profile(name, python=sys.executable):
+    """
+    Import an entry point in a fresh interpreter
+    Returns the wall time in seconds (interpreter start included) and a list of
+    (module, self_us, cumulative_us, depth) in the order -X importtime reports them
+    """
+    directory, module = ENTRY_POINTS[name]
+    code = f"import sys; sys.path.insert(0, {directory!r}); import {module}"
+    started = time.perf_counter()
+    result = subprocess.run([python, '-X', 'importtime', '-c', code],
+                            cwd=directory, capture_output=True, text=True)
+    wall = time.perf_counter() - started
+    lines = result.stderr.splitlines()
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n" + "\n".join(lines[-5:]))
+
+    imports = []
+    for line in lines:
+        match = _IMPORT_LINE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            imports.append((match.group(4), int(match.group(1)), int(match.group(2)), depth))
+    return wall, imports
+
+
+def summarize(name, wall, imports, top=5):
+    """Total import time and the packages that cost the most, for one entry point"""
+    module = ENTRY_POINTS[name][1]
+    total = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+    # Every module is imported once, so its cost shows up where it was first needed
+    packages = sorted(
+        ((cumulative, package) for package, _, cumulative, _ in imports
+         if '.' not in package and package != module),
+        reverse=True
+    )
+    return {
+        'wall_ms': wall * 1000,
+        'import_ms': total / 1000,
+        'modules': len(imports),
+        'heaviest': [(package, cumulative / 1000) for cumulative, package in packages[:top]],
+    }
+
+
+def measure(pattern=None, repeat=3):
+    """Best of repeat cold starts for every entry point whose name contains pattern"""
+    results = {}
+    for name in ENTRY_POINTS:
+        if pattern and pattern not in name:
+            continue
+        try:
+            runs = [import_profile(name) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"Skipping {name}: {e}")
+            continue
+        wall, imports = min(runs, key=lambda run: run[0])
+        results[name] = summarize(name, wall, imports)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of the entry points")
+    parser.add_argument('-k', dest='pattern', help="Only entry points whose name contains this")
+    parser.add_argument('--repeat', type=int, default=3, help="Cold starts per entry point, the best is kept")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    print(f"{'interpreter':16s} {(time.perf_counter() - started) * 1000:8.1f} ms")
+    for name, result in measure(args.pattern, args.repeat).items():
+        heaviest = ", ".join(f"{package} {ms:.0f}" for package, ms in result['heaviest'])
+        print(f"{name:16s} {result['wall_ms']:8.1f} ms  imports {result['import_ms']:7.1f} ms "
+              f"({result['modules']} modules)  {heaviest}")
+
+
+if __name__ == "__main__":
+    main()
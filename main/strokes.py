@@ -0,0 +1,37 @@
+# strokes.py
+# Splits a path into pen-down strokes in one vectorized pass.
+#
+# Positions carry a pen flag in z (MotionProcessor.get_plot_coordinates returns
+# 0 while the pen is down). A stroke is a maximal run of pen-down points; all
+# strokes of a path are drawn by a single LineCollection.
+import numpy as np
+
+PEN_DOWN = 0
+
+
+def stroke_bounds(zs, pen_down=PEN_DOWN):
+    """Return (starts, stops) index arrays of the pen-down runs in zs"""
+    down = np.asarray(zs) == pen_down
+    if len(down) == 0:
+        empty = np.empty(0, dtype=np.intp)
+        return empty, empty
+    # Indices where the pen goes down or up
+    edges = np.flatnonzero(np.diff(down.view(np.int8))) + 1
+    bounds = np.concatenate(([0], edges, [len(down)]))
+    starts = bounds[:-1]
+    stops = bounds[1:]
+    is_down = down[starts]
+    return starts[is_down], stops[is_down]
+
+
+def split_strokes(xs, ys, zs, pen_down=PEN_DOWN):
+    """Return one (n, 2) array of points per pen-down stroke, ready for LineCollection"""
+    points = np.column_stack((xs, ys))
+    starts, stops = stroke_bounds(zs, pen_down)
+    return [points[start:stop] for start, stop in zip(starts.tolist(), stops.tolist())]
+
+
+def stroke_ends(xs, ys, zs, pen_down=PEN_DOWN):
+    """Return the (xs, ys) of the last point of every stroke"""
+    _, stops = stroke_bounds(zs, pen_down)
+    return np.asarray(xs)[stops - 1], np.asarray(ys)[stops - 1]
@@ -0,0 +1,63 @@
+# test_ingest_queue.py
+# Run with: python -m pytest main/test_ingest_queue.py
+from operator import itemgetter
+import numpy as np
+from ingest_queue import IngestQueue, OVERFLOW_COALESCE
+from mqtt_handler import coalescable
+from frames import encode_frame
+
+SAMPLE = b'{"timestamp":40692,"accel":{"x":276,"y":-16152,"z":2796},"gyro":{"x":-120,"y":35,"z":8}}'
+RESET = b'{"timestamp":40700,"accel":{"x":-1,"y":-1,"z":-1},"gyro":{"x":0,"y":0,"z":0}}'
+
+
+def make_queue(maxsize):
+    processed = []
+    queue = IngestQueue(processed.extend, maxsize=maxsize, policy=OVERFLOW_COALESCE,
+                        key=itemgetter(0), coalescable=coalescable)
+    return queue, processed
+
+
+def test_queued_reset_survives_overflow():
+    queue, processed = make_queue(maxsize=2)
+    assert queue.put(("coordinates/pen1", SAMPLE))
+    assert queue.put(("coordinates/pen1", RESET))
+    # Full: the sample after the reset may not overwrite it, it is dropped instead
+    assert not queue.put(("coordinates/pen1", SAMPLE))
+    queue.start()
+    queue.stop()
+    assert processed == [("coordinates/pen1", SAMPLE), ("coordinates/pen1", RESET)]
+    assert queue.coalesced == 0 and queue.dropped == 1
+
+
+def test_reset_waits_for_room_instead_of_overwriting():
+    queue, processed = make_queue(maxsize=2)
+    queue.put(("coordinates/pen1", SAMPLE))
+    queue.put(("coordinates/pen1", SAMPLE))
+    queue.start()
+    # Blocks until the worker made room, nothing queued is overwritten
+    assert queue.put(("coordinates/pen1", RESET))
+    queue.stop()
+    assert processed[-1] == ("coordinates/pen1", RESET)
+    assert len(processed) == 3 and queue.coalesced == 0
+
+
+def test_frames_are_not_coalesced():
+    frame = encode_frame(1, 0, np.zeros((4, 7)))
+    queue, processed = make_queue(maxsize=1)
+    queue.put(("coordinates/pen1", frame))
+    assert not queue.put(("coordinates/pen1", SAMPLE))
+    queue.start()
+    queue.stop()
+    assert processed == [("coordinates/pen1", frame)]
+
+
+def test_samples_coalesce_per_pen():
+    queue, processed = make_queue(maxsize=2)
+    queue.put(("coordinates/pen1", SAMPLE))
+    queue.put(("coordinates/pen2", SAMPLE))
+    newer = SAMPLE.replace(b"40692", b"40702")
+    assert queue.put(("coordinates/pen1", newer))
+    queue.start()
+    queue.stop()
+    assert processed == [("coordinates/pen1", newer), ("coordinates/pen2", SAMPLE)]
+    assert queue.coalesced == 1
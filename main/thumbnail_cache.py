@@ -0,0 +1,171 @@
+# thumbnail_cache.py
+# Two-level cache of rendered canvas images (PNG bytes).
+#
+# Entries are keyed by session id, canvas index and a version: the canvas'
+# point count, or a content hash for canvases that can change without growing.
+# A live canvas that gets new points therefore gets a new key, and storing it
+# drops every older version of that canvas. Both levels evict the least
+# recently used entries once they exceed their byte budget.
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+THUMBNAIL_DIR = '.thumbnails'
+
+
+def content_hash(*columns):
+    """Short hash of point columns, usable as a cache version"""
+    digest = hashlib.blake2b(digest_size=12)
+    for column in columns:
+        digest.update(np.ascontiguousarray(column, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+class ThumbnailCache:
+    def __init__(self, cache_dir=THUMBNAIL_DIR, memory_budget=32 * 1024 * 1024,
+                 disk_budget=256 * 1024 * 1024):
+        """
+        cache_dir: Directory for the on-disk level (None keeps images in memory only)
+        memory_budget: Bytes of PNG data kept in memory
+        disk_budget: Bytes of PNG files kept in cache_dir
+        """
+        self.cache_dir = cache_dir
+        self.memory_budget = memory_budget
+        self.disk_budget = disk_budget
+        self._lock = threading.Lock()
+        # (session, canvas, version) -> png bytes, least recently used first
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        # file name -> size, least recently used first
+        self._disk = OrderedDict()
+        self._disk_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            entries = sorted(
+                (entry.stat().st_mtime, entry.name, entry.stat().st_size)
+                for entry in os.scandir(cache_dir)
+                if entry.is_file() and entry.name.endswith('.png')
+            )
+            for _, name, size in entries:
+                self._disk[name] = size
+                self._disk_bytes += size
+
+    @staticmethod
+    def _file_name(session_id, canvas, version):
+        return f"{session_id}_{canvas}_{version}.png"
+
+    def _evict_memory(self):
+        while self._memory_bytes > self.memory_budget and self._memory:
+            _, data = self._memory.popitem(last=False)
+            self._memory_bytes -= len(data)
+
+    def _evict_disk(self):
+        while self._disk_bytes > self.disk_budget and self._disk:
+            name, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._remove_file(name)
+
+    def _remove_file(self, name):
+        try:
+            os.remove(os.path.join(self.cache_dir, name))
+        except OSError:
+            pass
+
+    def _remember(self, key, data):
+        """Put data in the memory level (caller holds _lock)"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        self._evict_memory()
+
+    def get(self, session_id, canvas, version):
+        """Return the cached PNG bytes, or None"""
+        key = (str(session_id), canvas, str(version))
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+            name = self._file_name(*key)
+            if self.cache_dir and name in self._disk:
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    os.utime(path)
+                except OSError:
+                    self._disk_bytes -= self._disk.pop(name)
+                    self.misses += 1
+                    return None
+                self._disk.move_to_end(name)
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+            self.misses += 1
+            return None
+
+    def put(self, session_id, canvas, version, data):
+        """Store PNG bytes and drop every other version of the same canvas"""
+        key = (str(session_id), canvas, str(version))
+        self.invalidate(session_id, canvas, keep=version)
+        with self._lock:
+            self._remember(key, data)
+            if self.cache_dir:
+                name = self._file_name(*key)
+                try:
+                    with open(os.path.join(self.cache_dir, name), 'wb') as f:
+                        f.write(data)
+                except OSError as e:
+                    print(f"Error writing thumbnail {name}: {e}")
+                    return
+                self._disk_bytes -= self._disk.pop(name, 0)
+                self._disk[name] = len(data)
+                self._disk_bytes += len(data)
+                self._evict_disk()
+
+    def get_or_render(self, session_id, canvas, version, render):
+        """Return cached PNG bytes, calling render() and storing its result on a miss"""
+        data = self.get(session_id, canvas, version)
+        if data is None:
+            data = render()
+            self.put(session_id, canvas, version, data)
+        return data
+
+    def invalidate(self, session_id, canvas=None, keep=None):
+        """Drop cached images of a session, or of one of its canvases except version keep"""
+        session_id = str(session_id)
+        keep = None if keep is None else str(keep)
+        prefix = f"{session_id}_" if canvas is None else f"{session_id}_{canvas}_"
+        with self._lock:
+            for key in [k for k in self._memory
+                        if k[0] == session_id and (canvas is None or k[1] == canvas) and k[2] != keep]:
+                self._memory_bytes -= len(self._memory.pop(key))
+            if self.cache_dir:
+                for name in [n for n in self._disk if n.startswith(prefix)]:
+                    version = name[len(prefix):-len('.png')] if canvas is not None else None
+                    if keep is not None and version == keep:
+                        continue
+                    self._disk_bytes -= self._disk.pop(name)
+                    self._remove_file(name)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
@@ -0,0 +1,191 @@
+# write_buffer.py
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class PartialWrite(Exception):
+    """Raised by a writer that stored the first `written` points of a batch before failing"""
+
+    def __init__(self, written, message=""):
+        super().__init__(message)
+        self.written = written
+
+
+class WriteBehindBuffer:
+    def __init__(self, writer, max_batch=200, max_age=0.5, max_pending=20000):
+        """
+        Buffer points per key and persist them in batches from a background thread
+        writer: Callable(key, points) that stores one batch of points for a key.
+                A batch it raises for is buffered again and retried after max_age;
+                PartialWrite says how much of it was stored
+        max_batch: Flush a key as soon as it holds this many points
+        max_age: Flush a key once its oldest point has waited this many seconds
+        max_pending: Upper bound on buffered points; the oldest are dropped beyond it
+        """
+        self.writer = writer
+        self.max_batch = max_batch
+        self.max_age = max_age
+        self.max_pending = max_pending
+
+        # key -> (time of first buffered point, deque of points)
+        self._pending = OrderedDict()
+        self._pending_count = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # Serializes writers so batches for a key are stored in order
+        self._write_lock = threading.Lock()
+
+        # Counters
+        self.batches = 0
+        self.points_written = 0
+        self.dropped = 0
+        self.errors = 0
+        self.retried = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.total_flush_time = 0.0
+        self.last_flush_time = 0.0
+        self.max_flush_time = 0.0
+
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def add(self, key, point):
+        """Buffer a single point for key"""
+        self.extend(key, (point,))
+
+    def extend(self, key, points):
+        """Buffer several points for key"""
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = (time.monotonic(), deque())
+                self._pending[key] = entry
+            before = len(entry[1])
+            entry[1].extend(points)
+            self._pending_count += len(entry[1]) - before
+
+            self._trim()
+
+            if len(entry[1]) >= self.max_batch:
+                self._wakeup.notify()
+
+    def _trim(self):
+        """Keep memory bounded by discarding the oldest buffered points (caller holds _lock)"""
+        while self._pending_count > self.max_pending:
+            oldest_key = next(iter(self._pending))
+            oldest = self._pending[oldest_key][1]
+            oldest.popleft()
+            self._pending_count -= 1
+            self.dropped += 1
+            if not oldest:
+                del self._pending[oldest_key]
+
+    def _requeue(self, key, points):
+        """Buffer points that failed to write again, ahead of newer points of key"""
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                # Retried once they are max_age old again
+                entry = (time.monotonic(), deque())
+                self._pending[key] = entry
+            entry[1].extendleft(reversed(points))
+            self._pending_count += len(points)
+            self.retried += len(points)
+            self._trim()
+
+    def _take(self, force=False, key=None):
+        """Remove and return the batches that are due (caller holds _lock)"""
+        now = time.monotonic()
+        due = []
+        for k, (first_time, points) in list(self._pending.items()):
+            if key is not None and k != key:
+                continue
+            if force or len(points) >= self.max_batch or now - first_time >= self.max_age:
+                due.append((k, list(points)))
+                del self._pending[k]
+                self._pending_count -= len(points)
+        return due
+
+    def _write(self, batches):
+        """Persist batches, splitting anything larger than max_batch"""
+        for key, points in batches:
+            for start in range(0, len(points), self.max_batch):
+                chunk = points[start:start + self.max_batch]
+                started = time.perf_counter()
+                try:
+                    self.writer(key, chunk)
+                except Exception as e:
+                    self.errors += 1
+                    written = e.written if isinstance(e, PartialWrite) else 0
+                    self.points_written += written
+                    print(f"Error writing batch of {len(chunk)} points, "
+                          f"retrying {len(points) - start - written}: {e}")
+                    # Later chunks of the key wait as well, so points stay in order
+                    self._requeue(key, points[start + written:])
+                    break
+                elapsed = time.perf_counter() - started
+
+                self.batches += 1
+                self.points_written += len(chunk)
+                self.last_batch_size = len(chunk)
+                self.max_batch_size = max(self.max_batch_size, len(chunk))
+                self.total_flush_time += elapsed
+                self.last_flush_time = elapsed
+                self.max_flush_time = max(self.max_flush_time, elapsed)
+
+    def _run(self):
+        """Background loop flushing batches that hit the size or age threshold"""
+        while self._running:
+            with self._lock:
+                self._wakeup.wait(timeout=self.max_age / 2)
+            with self._write_lock:
+                with self._lock:
+                    due = self._take()
+                self._write(due)
+
+    def flush(self, key=None):
+        """Synchronously write everything buffered (optionally for a single key)"""
+        with self._write_lock:
+            with self._lock:
+                due = self._take(force=True, key=key)
+            self._write(due)
+
+    def close(self):
+        """Stop the background thread and flush what is left"""
+        if self._running:
+            self._running = False
+            with self._lock:
+                self._wakeup.notify()
+            self._thread.join()
+        self.flush()
+        left = self.pending()
+        if left:
+            print(f"Error writing buffered points: {left} points were not stored")
+
+    def pending(self, key=None):
+        """Points buffered (for one key)"""
+        with self._lock:
+            if key is None:
+                return self._pending_count
+            entry = self._pending.get(key)
+            return len(entry[1]) if entry else 0
+
+    def stats(self):
+        """Return counters for batch sizes and flush latency"""
+        return {
+            'batches': self.batches,
+            'points_written': self.points_written,
+            'pending': self.pending(),
+            'dropped': self.dropped,
+            'errors': self.errors,
+            'retried': self.retried,
+            'last_batch_size': self.last_batch_size,
+            'max_batch_size': self.max_batch_size,
+            'mean_batch_size': self.points_written / self.batches if self.batches else 0.0,
+            'last_flush_ms': self.last_flush_time * 1000,
+            'max_flush_ms': self.max_flush_time * 1000,
+            'mean_flush_ms': self.total_flush_time * 1000 / self.batches if self.batches else 0.0,
+        }
@@ -1,15 +1,16 @@
-import paho.mqtt.client as mqtt
+import os
+import sys
 import json
 import configparser
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation
 from collections import deque
 import numpy as np
 
-# Create deques to store coordinate history
-x_coords = deque(maxlen=100)  # Stores last 100 points
-y_coords = deque(maxlen=100)
-z_coords = deque(maxlen=100)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'main'))
+from lod import decimate_mask, pixel_size
+from strokes import PEN_DOWN, split_strokes, stroke_ends
+
+# Coordinate history as (x, y, z) tuples, so on_message adds a whole point at once
+coords = deque(maxlen=100)  # Stores last 100 points
 
 def load_config():
     config = configparser.ConfigParser()
@@ -21,19 +22,24 @@ def load_config():
         'password': config.get('mqtt', 'password')
     }
 
-# Load configuration
-config = load_config()
+# Figure and artists, created by setup_plot()
+fig = ax = strokes = stroke_end_markers = None
+lines = []
 
-# Use configuration values
-MQTT_HOST = config['host']
-MQTT_PORT = config['port']
-MQTT_USER = config['username']
-MQTT_PASSWORD = config['password']
+def setup_plot():
+    """Create the figure; matplotlib is only imported when the plot is shown"""
+    global fig, ax, strokes, stroke_end_markers, lines
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import LineCollection
 
-# Set up the figure and subplot
-fig = plt.figure(figsize=(10, 8))
-ax = fig.add_subplot(111)
-lines = []  # Store multiple line objects
+    # Set up the figure and subplot
+    fig = plt.figure(figsize=(10, 8))
+    ax = fig.add_subplot(111)
+    # One collection draws every pen-down stroke, one line marks the stroke ends
+    strokes = LineCollection([], colors='b')
+    ax.add_collection(strokes)
+    stroke_end_markers, = ax.plot([], [], 'ro', linestyle='')
+    lines = [strokes, stroke_end_markers]
 
 # Initialize the plot
 def init():
@@ -41,53 +47,29 @@ def init():
     ax.set_xlabel('Y Coordinate (Longitude)')
     ax.set_ylabel('X Coordinate (Latitude)')
     ax.grid(True)
-    return []
+    return lines
 
 # Animation update function
 def update(frame):
-    global lines
-    
-    # Clear previous lines
-    for line in lines:
-        line.remove()
-    lines.clear()
-    
-    if len(x_coords) > 0:
-        # Create segments of continuous z=0 points
-        segments_x = []
-        segments_y = []
-        current_segment_x = []
-        current_segment_y = []
-        
-        # Group continuous z=0 points into segments
-        for x, y, z in zip(x_coords, y_coords, z_coords):
-            if z == 0:
-                current_segment_x.append(x)
-                current_segment_y.append(y)
-            else:
-                if current_segment_x:  # If we have points in the current segment
-                    segments_x.append(current_segment_x)
-                    segments_y.append(current_segment_y)
-                    current_segment_x = []
-                    current_segment_y = []
-        
-        # Add the last segment if it exists
-        if current_segment_x:
-            segments_x.append(current_segment_x)
-            segments_y.append(current_segment_y)
-        
-        # Plot each segment as a separate line
-        for seg_x, seg_y in zip(segments_x, segments_y):
-            line, = ax.plot(seg_y, seg_x, 'b-')
-            lines.append(line)
-            
-            # Add point at the end of each segment
-            point, = ax.plot([seg_y[-1]], [seg_x[-1]], 'ro')
-            lines.append(point)
-        
+    # Copying the deque is atomic while paho's thread appends to it
+    points = list(coords)
+    if len(points) > 0:
+        # Y is drawn horizontally, X vertically
+        ys, xs, zs = np.array(points, dtype=float).T
+
+        # Drop points that land on the same pixel, then split into z=0 strokes
+        keep = decimate_mask(xs, ys, *pixel_size(ax), zs=zs)
+        xs, ys, zs = xs[keep], ys[keep], zs[keep]
+        strokes.set_segments(split_strokes(xs, ys, zs))
+
+        # Add point at the end of each segment
+        stroke_end_markers.set_data(*stroke_ends(xs, ys, zs))
+
         # Adjust plot limits dynamically
-        ax.relim()
-        ax.autoscale_view()
+        down = zs == PEN_DOWN
+        if down.any():
+            ax.dataLim.update_from_data_xy(np.column_stack((xs[down], ys[down])), ignore=True)
+            ax.autoscale_view()
     
     return lines
 
@@ -102,10 +84,8 @@ def on_message(client, userdata, message):
         print(f"Received coordinates:")
         print(f"Location: ({coordinates['x']}, {coordinates['y']}, {coordinates['z']})")
         
-        # Add new coordinates to deques
-        x_coords.append(coordinates['x'])
-        y_coords.append(coordinates['y'])
-        z_coords.append(coordinates['z'])
+        # Add new coordinates to the history
+        coords.append((coordinates['x'], coordinates['y'], coordinates['z']))
 
         # Print whether point will be plotted
         if coordinates['z'] == 0:
@@ -118,18 +98,26 @@ def on_message(client, userdata, message):
         print(f"Error processing message: {e}")
 
 def main():
+    # Load configuration
+    config = load_config()
+
+    import paho.mqtt.client as mqtt
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+    setup_plot()
+
     client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
     client.on_connect = on_connect
     client.on_message = on_message
     
     # Set credentials
-    client.username_pw_set(MQTT_USER, MQTT_PASSWORD)
+    client.username_pw_set(config['username'], config['password'])
     
     # Enable SSL/TLS
     client.tls_set()
     
     # Connect to Solace Cloud
-    client.connect(MQTT_HOST, MQTT_PORT, 60)
+    client.connect(config['host'], config['port'], 60)
     
     # Start MQTT client in a non-blocking way
     client.loop_start()